@@ -0,0 +1,198 @@
+'''
+Backtest of the triangular engine on a tick recording.
+
+The engine is built from its usual configuration with the 'replay' exchange
+(engines/exchanges/replay.py) in place of the live one, and runs its own
+check_orderBook, getMaxAmount and place_order unchanged. Instead of polling,
+the driver moves the virtual clock of the replay one record at a time and
+runs a tick of the engine after each book of the triangle, as fast as the CPU
+allows. The other pairs recorded are only used to value the currencies.
+
+The report gives the opportunities found, the orders placed and filled, and
+the profit and loss of each currency, valued at the last prices replayed.
+'''
+
+import time
+from typing import Dict, Optional
+from engines.triangular_arbitrage import CryptoEngineTriArbitrage
+# Module of the adapters, on the path set by the engine loader
+from base import ExchangeException
+from engines.valuation import parse_pair
+from utils.logging import crypto_arb_log
+
+
+class TriangularBacktest(object):
+    def __init__(self, config: Dict, recording: str, startValue: float = 1000,
+                 balances: Optional[Dict[str, float]] = None):
+        '''
+        config: the 'triangular' block of arbitrage_config.json, its exchange and keyFile are replaced
+        recording: directory of a recording, or one of its files
+        startValue: value of each ticker of the triangle at the start, in the valuation currency
+        balances: balances at the start, replacing startValue
+        '''
+        config = dict(config, exchange='replay', keyFile=recording,
+                      websocket=False, eventDriven=False, scanAllTriangles=False)
+        config.pop('record', None)
+        self.arbitrage = CryptoEngineTriArbitrage(config, mock=False)
+        self.engine = self.arbitrage.engine
+        self.startValue = startValue
+        self.startBalances = balances
+        self.tickers = [config['tickerA'], config['tickerB'], config['tickerC']]
+        self.pairs = [config['tickerPairA'], config['tickerPairB'], config['tickerPairC']]
+
+    def init_balances(self):
+        valuation = self.arbitrage.valuation
+        if self.startBalances is None:
+            self.startBalances = {}
+            for ticker in self.tickers:
+                self.startBalances[ticker] = self.startValue / valuation.value_from_books(ticker)
+        self.engine.balances.update(self.startBalances)
+
+    async def run(self) -> Dict:
+        valuation = self.arbitrage.valuation
+        # Every pair recorded links the currencies to the valuation one
+        for pair in self.engine.productPairs:
+            currencies = parse_pair(pair, self.tickers) if pair is not None else None
+            if currencies is not None and pair not in valuation.pairs:
+                valuation.add_pair(pair, *currencies)
+
+        report = {'records': 0, 'ticks': 0, 'opportunities': 0, 'routes': {1: 0, 2: 0}, 'rejectedOrders': 0, 'errors': 0}
+        triangle = set(self.pairs)
+        started = False
+        wallStart = time.perf_counter()
+        for pair in self.engine.replay():
+            report['records'] += 1
+            valuation.update_book(pair, self.engine.books[pair])
+            if pair not in triangle:
+                continue
+            if not started:
+                # The engine needs the books of the triangle and the value of its tickers
+                if not triangle.issubset(self.engine.books) or \
+                   any(valuation.value_from_books(ticker) is None for ticker in self.tickers):
+                    continue
+                self.init_balances()
+                await self.arbitrage.ledger.load()
+                report['start'] = self.engine.now
+                started = True
+            report['ticks'] += 1
+            try:
+                bookStatus = await self.arbitrage.tick()
+            except (Exception, ExchangeException) as e:
+                report['errors'] += 1
+                crypto_arb_log.debug(e)
+                continue
+            # The route found counts even when some of its orders got rejected
+            if bookStatus is not None and bookStatus['status']:
+                report['opportunities'] += 1
+                report['routes'][bookStatus['status']] += 1
+                report['rejectedOrders'] += bookStatus.get('rejected', 0)
+        report['wallTime'] = time.perf_counter() - wallStart
+        report['end'] = self.engine.now
+        return self.add_results(report)
+
+    def add_results(self, report: Dict) -> Dict:
+        '''
+        Add the orders, fills and profit and loss to a report
+        '''
+        orders = list(self.engine.orders.values())
+        report['orders'] = len(orders)
+        report['filledOrders'] = sum(1 for order in orders if order['remaining'] <= 0 and not order.get('cancelled'))
+        report['cancelledOrders'] = sum(1 for order in orders if order.get('cancelled'))
+        report['openOrders'] = sum(1 for order in orders if order['remaining'] > 0)
+        report['fills'] = len(self.engine.fills)
+        report['fees'] = {}
+        for fill in self.engine.fills:
+            report['fees'][fill['feeCurrency']] = report['fees'].get(fill['feeCurrency'], 0.0) + fill['fee']
+
+        valuation = self.arbitrage.valuation
+        report['valuationCurrency'] = valuation.quoteCurrency
+        report['pnl'] = {}
+        report['pnlValue'] = 0.0 if self.startBalances is not None else None
+        for ticker in self.tickers:
+            start = (self.startBalances or {}).get(ticker, 0.0)
+            change = self.engine.balances.get(ticker, 0.0) - start
+            value = valuation.value_from_books(ticker)
+            report['pnl'][ticker] = {'start': start, 'end': start + change, 'change': change,
+                                     'value': change * value if value is not None else None}
+            if value is None or report['pnlValue'] is None:
+                report['pnlValue'] = None
+            else:
+                report['pnlValue'] += change * value
+        report['feesValue'] = None
+        if all(valuation.value_from_books(currency) is not None for currency in report['fees']):
+            report['feesValue'] = sum((fee * valuation.value_from_books(currency) for currency, fee in report['fees'].items()), 0.0)
+        return report
+
+    async def end_engine(self):
+        await self.arbitrage.end_engine()
+
+
+def format_report(report: Dict) -> str:
+    def value(amount):
+        return '{0:.4f}'.format(amount) if amount is not None else 'n/a'
+
+    if 'start' not in report:
+        return '{0} records replayed, the tickers of the triangle could not all be valued in {1}'.format(
+            report['records'], report['valuationCurrency'])
+    span = report['end'] - report['start']
+    lines = [
+        '{0} records replayed in {1:.2f} s ({2:.0f} per second), {3:.0f} s of market data ({4:.0f}x real time)'.format(
+            report['records'], report['wallTime'], report['records'] / report['wallTime'], span,
+            span / report['wallTime']),
+        '{0} evaluations: {1} opportunities ({2} bid route, {3} ask route), {4} errors'.format(
+            report['ticks'], report['opportunities'], report['routes'][1], report['routes'][2], report['errors']),
+        '{0} orders placed: {1} filled, {2} cancelled, {3} still open; {4} fills; {5} rejected'.format(
+            report['orders'], report['filledOrders'], report['cancelledOrders'], report['openOrders'], report['fills'],
+            report['rejectedOrders']),
+        'Fees: {0} ({1} {2})'.format(', '.join('{0:.8f} {1}'.format(fee, currency) for currency, fee in report['fees'].items()) or 'none',
+                                     value(report['feesValue']), report['valuationCurrency'])
+    ]
+    for ticker, pnl in report['pnl'].items():
+        lines.append('{0}: {1:.8f} -> {2:.8f}, {3:+.8f} ({4} {5})'.format(
+            ticker, pnl['start'], pnl['end'], pnl['change'], value(pnl['value']), report['valuationCurrency']))
+    lines.append('PnL: {0} {1} at the last prices replayed'.format(value(report['pnlValue']), report['valuationCurrency']))
+    return '\n'.join(lines)
+
+
+
+if __name__ == '__main__':
+    import asyncio
+    import logging
+    import random
+    import shutil
+    import tempfile
+    from engines.tick_recorder import TickRecorder
+
+    # An hour of books of a triangle polled every 0.5 s, the ADA-BTC bid jumping
+    # above the price of the route from time to time
+    directory = tempfile.mkdtemp()
+    recorder = TickRecorder(directory)
+    recorder.start()
+    random.seed(0)
+    ethBtc, adaBtc, btcEur = 0.07, 0.00001, 30000.0
+    for step in range(7200):
+        now = 1700000000 + step * 0.5
+        ethBtc *= random.gauss(1, 0.0002)
+        btcEur *= random.gauss(1, 0.0002)
+        adaBtc *= random.gauss(1, 0.0002)
+        adaEth = adaBtc / ethBtc
+        jump = 1.02 if step % 600 == 300 else 1.0
+        for pair, mid, size in [('ADA-ETH', adaEth, 5000.0), ('ETH-BTC', ethBtc, 20.0),
+                                ('ADA-BTC', adaBtc * jump, 5000.0), ('BTC-EUR', btcEur, 2.0)]:
+            recorder.record('coinbase_pro:' + pair, {'bid': {'price': mid * 0.9995, 'amount': size},
+                                                     'ask': {'price': mid * 1.0005, 'amount': size}}, now)
+    recorder.stop()
+
+    config = {'tickerPairA': 'ADA-ETH', 'tickerPairB': 'ETH-BTC', 'tickerPairC': 'ADA-BTC',
+              'tickerA': 'ADA', 'tickerB': 'ETH', 'tickerC': 'BTC'}
+
+    async def main():
+        backtest = TriangularBacktest(config, directory)
+        try:
+            return await backtest.run()
+        finally:
+            await backtest.end_engine()
+
+    logging.getLogger('crypto-arbitrage').setLevel(logging.WARNING)
+    print(format_report(asyncio.run(main())))
+    shutil.rmtree(directory)
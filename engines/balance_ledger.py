@@ -0,0 +1,153 @@
+'''
+Local ledger of the balances of an exchange account.
+
+The balances are loaded once at startup, then kept up to date from the orders
+placed by the engine: the funds of an order are put on hold when it is placed,
+and the hold is turned into a fill when the order is not open anymore. The
+exchange is only asked again by a slow background reconciliation, or right away
+when a drift is suspected (e.g. orders cancelled after a partial fill). The
+engines read the available balances with plain dict lookups.
+'''
+
+import asyncio
+import itertools
+from typing import Dict, List, Optional, Tuple
+# Puts the modules of the adapters on the path
+import engines.exchanges.loader
+from base import ExchangeException
+from utils.logging import crypto_arb_log
+
+
+class BalanceLedger(object):
+    def __init__(self, engine, currencies: List[str], pairs: Dict[str, Tuple[str, str]],
+                 reconcileInterval: float = 300, driftTolerance: float = 1e-8):
+        '''
+        currencies: the currencies to follow, e.g. ['ADA', 'ETH', 'BTC']
+        pairs: the (base, quote) currencies of each ticker pair traded
+        '''
+        self.engine = engine
+        self.currencies = list(currencies)
+        self.pairs = pairs
+        self.reconcileInterval = reconcileInterval
+        self.driftTolerance = driftTolerance
+
+        # Total balance of each currency, and what is left once the holds are removed
+        self.balances = {currency: 0.0 for currency in self.currencies}
+        self.available = dict(self.balances)
+        # Order ID -> order placed, with the currency and amount held for it
+        self.holds = {}
+        self._orderIds = itertools.count()
+
+        self.reconcileNeeded = asyncio.Event()
+        self.task = None
+
+    async def load(self):
+        '''
+        Get the balances from the exchange, done at startup and on reconciliation.
+
+        The totals of the exchange already include the fills of the orders that are
+        not open anymore: their holds are dropped here instead of being settled later
+        on top of the totals.
+        '''
+        placed = list(self.holds)
+        balances = await self.engine.get_balance(self.currencies)
+        if placed:
+            openOrderIds = {order['orderId'] for order in await self.engine.get_open_order()}
+            for orderId in placed:
+                if orderId not in openOrderIds:
+                    self.holds.pop(orderId, None)
+        for currency in self.currencies:
+            expected = self.balances[currency]
+            received = float(balances.get(currency, 0.0))
+            if self.task is not None and abs(received - expected) > self.driftTolerance:
+                crypto_arb_log.info('Balance drift on {0}: ledger {1}, exchange {2}'.format(
+                    currency, expected, received))
+            self.balances[currency] = received
+        self._update_available()
+
+    def _update_available(self):
+        held = dict.fromkeys(self.currencies, 0.0)
+        for hold in self.holds.values():
+            held[hold['currency']] += hold['held']
+        # Update the dict in place, the engines keep a reference to it
+        for currency in self.currencies:
+            self.available[currency] = self.balances[currency] - held[currency]
+
+    def hold_order(self, orderId: Optional[str], tickerPair: str, action: str, amount: float, price: float):
+        '''
+        Put on hold the funds of an order just placed: the quote currency for a
+        'bid', the base currency for an 'ask'
+        '''
+        base, quote = self.pairs[tickerPair]
+        if orderId is None:
+            orderId = 'local-{0}'.format(next(self._orderIds))
+        if action == 'bid':
+            currency, held = quote, amount * price * (1 + self.engine.feeRatio)
+        else:
+            currency, held = base, amount
+        self.holds[orderId] = {
+            'tickerPair': tickerPair, 'action': action, 'amount': amount, 'price': price,
+            'currency': currency, 'held': held
+        }
+        if currency in self.available:
+            self.available[currency] -= held
+
+    def apply_fill(self, tickerPair: str, action: str, amount: float, price: float, fee: Optional[float] = None):
+        '''
+        Apply a fill to the balances, the fee being paid in the quote currency
+        '''
+        base, quote = self.pairs[tickerPair]
+        if fee is None:
+            fee = amount * price * self.engine.feeRatio
+        sign = 1 if action == 'bid' else -1
+        for currency, change in ((base, sign * amount), (quote, -sign * amount * price - fee)):
+            if currency in self.balances:
+                self.balances[currency] += change
+
+    def settle_orders(self, openOrderIds: List[str]):
+        '''
+        Turn into fills the holds of the orders that are not open anymore
+        '''
+        openOrderIds = set(openOrderIds)
+        for orderId in [orderId for orderId in self.holds if orderId not in openOrderIds]:
+            hold = self.holds.pop(orderId)
+            self.apply_fill(hold['tickerPair'], hold['action'], hold['amount'], hold['price'])
+        self._update_available()
+
+    def release_orders(self):
+        '''
+        Release all the holds, after the open orders got cancelled. Some of them may
+        have been partially filled, so a reconciliation is asked.
+        '''
+        self.holds = {}
+        self._update_available()
+        self.reconcileNeeded.set()
+
+    def start(self):
+        '''
+        Start the background reconciliation with the exchange
+        '''
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self.reconcileNeeded.wait(), self.reconcileInterval)
+            except asyncio.TimeoutError:
+                pass
+            self.reconcileNeeded.clear()
+            try:
+                await self.load()
+            except (Exception, ExchangeException) as e:
+                crypto_arb_log.error('Balance reconciliation failed: {0}'.format(e))
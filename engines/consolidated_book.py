@@ -0,0 +1,261 @@
+'''
+Order book of one asset consolidated across several venues.
+
+The levels of each venue are kept sorted by price net of the venue fee (the ask
+paid or the bid received per unit of asset), each level tagged with its venue.
+The consolidated side is the k-way merge of the venue sides; when a venue is
+updated, only its levels are taken out of the merged list and its new levels
+merged back in, in a single linear pass, so that the view can be refreshed on
+every update.
+
+On top of it, the router splits a quantity across the venues at the lowest cost
+(or the highest proceeds) fees included, taking the levels from the best one
+and stopping on a venue when its balance is used up. As the cost of each level
+is linear and the balances are per venue, taking the best levels first is optimal.
+'''
+
+import heapq
+from typing import Dict, List, Optional, Tuple
+
+
+class ConsolidatedBook(object):
+    # Relative amount left by the rounding of the floats, ignored by the router
+    epsilon = 1e-9
+
+    def __init__(self, feeRatios: Dict[str, float]):
+        '''
+        feeRatios: fee of each venue, e.g. {'exchangeA': 0.0025, 'exchangeB': 0.001}
+        '''
+        self.feeRatios = dict(feeRatios)
+        # Levels of each side: (sort key, price, amount, venue), best level first. The
+        # sort key is the ask paid per unit, or minus the bid received per unit.
+        self.venueLevels = {'bids': {}, 'asks': {}}
+        self.levels = {'bids': [], 'asks': []}
+
+    def _side_levels(self, side: str, venue: str, levels: List[List[float]]) -> List[Tuple[float, float, float, str]]:
+        feeRatio = self.feeRatios[venue]
+        if side == 'asks':
+            result = [(price * (1 + feeRatio), price, amount, venue) for price, amount in levels if amount > 0]
+        else:
+            result = [(-price * (1 - feeRatio), price, amount, venue) for price, amount in levels if amount > 0]
+        result.sort()
+        return result
+
+    def update_side(self, side: str, venue: str, levels: List[List[float]]):
+        '''
+        Replace the levels of a venue on one side: [[price, amount], ...] in any order
+        '''
+        new = self._side_levels(side, venue, levels)
+        self.venueLevels[side][venue] = new
+        others = [level for level in self.levels[side] if level[3] != venue]
+        self.levels[side] = list(heapq.merge(others, new))
+
+    def update(self, venue: str, book: Dict[str, List[List[float]]]):
+        '''
+        Replace the levels of a venue from its book, as returned by get_ticker_orderBook_depth
+        '''
+        self.update_side('bids', venue, book['bids'])
+        self.update_side('asks', venue, book['asks'])
+
+    def clear(self, venue: str):
+        self.update_side('bids', venue, [])
+        self.update_side('asks', venue, [])
+
+    def rebuild(self):
+        '''
+        Merge all the venue sides again from scratch
+        '''
+        for side, venues in self.venueLevels.items():
+            self.levels[side] = list(heapq.merge(*venues.values()))
+
+    def best(self, side: str) -> Optional[Dict]:
+        if not self.levels[side]:
+            return None
+        key, price, amount, venue = self.levels[side][0]
+        return {'venue': venue, 'price': price, 'amount': amount, 'net': abs(key)}
+
+    def route(self, side: str, quantity: float, limits: Optional[Dict[str, float]] = None,
+              limitPrice: Optional[float] = None) -> Dict:
+        '''
+        Split a quantity of asset across the venues at the best price, fees included.
+
+        side: 'asks' to buy the asset, 'bids' to sell it
+        limits: balance available on each venue, in the currency paid when buying and in
+                the asset when selling; a venue missing from it is not limited
+        limitPrice: worst price per unit net of fees that can be taken
+
+        The result is a dictionnary, looking like the following:
+
+        {
+            'amount': 1.5,      # amount of asset routed, up to quantity
+            'net': 0.1067,      # total paid (asks) or received (bids), fees included
+            'venues': {'exchangeA': {'amount': 1.0, 'price': 0.0711, 'net': 0.0712}, ...}
+        }
+
+        'price' is the worst price reached on each venue, as needed to place a limit order.
+        '''
+        remaining = quantity
+        left = dict(limits) if limits is not None else {}
+        result = {'amount': 0.0, 'net': 0.0, 'venues': {}}
+        for key, price, amount, venue in self.levels[side]:
+            if remaining <= quantity * self.epsilon:
+                break
+            net = abs(key)
+            if limitPrice is not None and (net > limitPrice if side == 'asks' else net < limitPrice):
+                break
+            take = min(amount, remaining)
+            if venue in left:
+                # The balance limits the amount paid when buying, the amount sold when selling
+                available = left[venue] / net if side == 'asks' else left[venue]
+                if available <= 0:
+                    continue
+                if available <= take:
+                    take, left[venue] = available, 0
+                else:
+                    left[venue] -= take * net if side == 'asks' else take
+            order = result['venues'].setdefault(venue, {'amount': 0.0, 'price': price, 'net': 0.0})
+            order['amount'] += take
+            order['price'] = price
+            order['net'] += take * net
+            result['amount'] += take
+            result['net'] += take * net
+            remaining -= take
+        return result
+
+    def match(self, buyLimits: Optional[Dict[str, float]] = None,
+              sellLimits: Optional[Dict[str, float]] = None) -> Dict:
+        '''
+        Find the amount of asset that can be bought on the asks and sold on the bids
+        of the other venues at a profit, fees included, and how to split it.
+
+        buyLimits: balance of the currency paid available on each venue
+        sellLimits: balance of the asset available on each venue
+
+        Both sides are walked together while the next bid received is above the next
+        ask paid. The result holds the amount, the profit in the currency paid, and the
+        'buy' and 'sell' routes as returned by route.
+        '''
+        buyLeft = dict(buyLimits) if buyLimits is not None else {}
+        sellLeft = dict(sellLimits) if sellLimits is not None else {}
+        asks, bids = self.levels['asks'], self.levels['bids']
+        a = b = 0
+        askLeft = asks[0][2] if asks else 0
+        bidLeft = bids[0][2] if bids else 0
+        amount = 0.0
+        while a < len(asks) and b < len(bids):
+            askNet, askPrice, _, askVenue = asks[a]
+            bidKey, bidPrice, _, bidVenue = bids[b]
+            if -bidKey <= askNet:
+                break
+            if buyLeft.get(askVenue, 1) <= 0:
+                a += 1
+                askLeft = asks[a][2] if a < len(asks) else 0
+                continue
+            if sellLeft.get(bidVenue, 1) <= 0:
+                b += 1
+                bidLeft = bids[b][2] if b < len(bids) else 0
+                continue
+            buyable = buyLeft[askVenue] / askNet if askVenue in buyLeft else askLeft
+            sellable = sellLeft.get(bidVenue, bidLeft)
+            take = min(askLeft, bidLeft, buyable, sellable)
+            amount += take
+            askLeft -= take
+            bidLeft -= take
+            if askVenue in buyLeft:
+                buyLeft[askVenue] = 0 if take >= buyable else buyLeft[askVenue] - take * askNet
+            if bidVenue in sellLeft:
+                sellLeft[bidVenue] = 0 if take >= sellable else sellLeft[bidVenue] - take
+            if askLeft <= 0:
+                a += 1
+                askLeft = asks[a][2] if a < len(asks) else 0
+            if bidLeft <= 0:
+                b += 1
+                bidLeft = bids[b][2] if b < len(bids) else 0
+
+        buy = self.route('asks', amount, buyLimits)
+        sell = self.route('bids', amount, sellLimits)
+        return {'amount': amount, 'profit': sell['net'] - buy['net'], 'buy': buy, 'sell': sell}
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    def close(value, expected):
+        return abs(value - expected) <= 1e-9 * max(1, abs(expected))
+
+    # Edge cases of the router and of the matching, checked before the timings
+    check = ConsolidatedBook({'A': 0.0, 'B': 0.0, 'C': 0.01})
+    check.update('A', {'bids': [[99, 1]], 'asks': [[100, 1]]})
+    check.update('B', {'bids': [[98, 3]], 'asks': [[101, 5]]})
+    check.update('C', {'bids': [[104, 2]], 'asks': [[102, 0]]})
+    # Exhausted balance: the venue is skipped, the next one takes the whole quantity
+    route = check.route('asks', 2, {'A': 0, 'B': 1000})
+    assert close(route['amount'], 2) and list(route['venues']) == ['B'] and close(route['net'], 202), route
+    # Balance used up during the walk: the rest goes to the next venue
+    route = check.route('asks', 2, {'A': 50, 'B': 1000})
+    assert close(route['venues']['A']['amount'], 0.5) and close(route['venues']['B']['amount'], 1.5), route
+    assert close(route['net'], 50 + 1.5 * 101), route
+    # Missing balance on every venue: nothing routed
+    route = check.route('asks', 2, {'A': 0, 'B': 0})
+    assert route['amount'] == 0 and not route['venues'], route
+    # Quantity stopped at the limit price, net of fees, the limit itself being taken
+    route = check.route('asks', 3, limitPrice=100)
+    assert close(route['amount'], 1) and list(route['venues']) == ['A'], route
+    route = check.route('bids', 5, limitPrice=104 * 0.99)
+    assert close(route['amount'], 2) and route['venues']['C']['price'] == 104, route
+    # Selling limited by the asset held, the worst price reached being the order price
+    route = check.route('bids', 4, {'C': 1, 'A': 0})
+    assert close(route['venues']['C']['amount'], 1) and close(route['venues']['B']['amount'], 3), route
+    assert 'A' not in route['venues'] and route['venues']['B']['price'] == 98, route
+    # Only the bid of C (102.96 net) is above the asks of A (100) and B (101)
+    match = check.match()
+    assert close(match['amount'], 2) and close(match['profit'], 2 * 102.96 - 100 - 101), match
+    match = check.match({'A': 0, 'B': 1000})
+    assert close(match['amount'], 2) and close(match['profit'], 2 * (102.96 - 101)), match
+    match = check.match({'A': 0, 'B': 0})
+    assert match['amount'] == 0 and match['profit'] == 0, match
+    match = check.match(sellLimits={'C': 0.5})
+    assert close(match['amount'], 0.5) and close(match['profit'], 0.5 * (102.96 - 100)), match
+    check.clear('C')
+    assert check.match()['amount'] == 0
+
+    # 5 venues of 50 levels each around the same mid price, one venue updated at a time
+    random.seed(0)
+    venues = ['venue{0}'.format(v) for v in range(5)]
+    book = ConsolidatedBook(dict(zip(venues, [0.001, 0.002, 0.0026, 0.0026, 0.005])))
+
+    def random_book(mid):
+        return {'bids': [[mid * (1 - 0.0005 - i * 1e-4), random.uniform(0.1, 5)] for i in range(50)],
+                'asks': [[mid * (1 + 0.0005 + i * 1e-4), random.uniform(0.1, 5)] for i in range(50)]}
+
+    updates = [(random.choice(venues), random_book(100 * random.gauss(1, 0.003))) for _ in range(2000)]
+    for venue in venues:
+        book.update(venue, random_book(100))
+
+    start = time.perf_counter()
+    for venue, venueBook in updates:
+        book.update(venue, venueBook)
+    updateTime = (time.perf_counter() - start) / len(updates)
+
+    start = time.perf_counter()
+    for venue, venueBook in updates:
+        book.venueLevels['bids'][venue] = book._side_levels('bids', venue, venueBook['bids'])
+        book.venueLevels['asks'][venue] = book._side_levels('asks', venue, venueBook['asks'])
+        book.rebuild()
+    rebuildTime = (time.perf_counter() - start) / len(updates)
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        match = book.match({venue: 200.0 for venue in venues}, {venue: 2.0 for venue in venues})
+    matchTime = (time.perf_counter() - start) / 1000
+
+    print('{0} venues x 50 levels: incremental merge {1:.1f} us, full k-way merge {2:.1f} us, match {3:.1f} us'.format(
+        len(venues), updateTime * 1e6, rebuildTime * 1e6, matchTime * 1e6))
+
+    # Buying 20 units: the innermost level of a single venue against the split across the venues
+    best = book.best('asks')
+    route = book.route('asks', 20, {venue: 1000.0 for venue in venues})
+    print('best level: {0} units on {1}; routed {2:.2f} units on {3} venues at {4:.4f} per unit fees included'.format(
+        round(best['amount'], 2), best['venue'], route['amount'], len(route['venues']), route['net'] / route['amount']))
+    print('crossed venues: {0:.4f} units, profit {1:.6f}'.format(match['amount'], match['profit']))
@@ -0,0 +1,149 @@
+'''
+Sizing of a route against several levels of the order books of its legs.
+
+Walking the book, each leg converts an input amount into an output amount with
+a piecewise linear concave function: its breakpoints are the cumulative sums of
+the levels. Chaining the legs gives the output of the route for any input, and
+the profit (output - input) is concave, so the best size is one of the merged
+breakpoints of the legs expressed in the first currency of the route. The whole
+computation is done on cumulative-sum arrays with np.interp, without any loop
+over the levels.
+'''
+
+from typing import Dict, List, Optional
+import numpy as np
+
+
+def leg_curve(action: str, levels, feeRatio: float):
+    '''
+    Return the cumulative input, output and base amounts of a leg walking its levels.
+
+    action: 'bid' when buying the base currency with the quote one (levels are the asks),
+            'ask' when selling the base currency for the quote one (levels are the bids)
+    levels: [[price, amount], ...], best level first
+    '''
+    levels = np.asarray(levels, dtype=float).reshape(-1, 2)
+    prices, amounts = levels[:, 0], levels[:, 1]
+    if action == 'bid':
+        spent = prices * amounts
+        received = amounts * (1 - feeRatio)
+    else:
+        spent = amounts
+        received = prices * amounts * (1 - feeRatio)
+
+    zero = np.zeros(1)
+    return (np.concatenate((zero, np.cumsum(spent))),
+            np.concatenate((zero, np.cumsum(received))),
+            np.concatenate((zero, np.cumsum(amounts))))
+
+
+class DepthSizer(object):
+    def __init__(self, feeRatio: float):
+        self.feeRatio = feeRatio
+
+    def optimize(self, legs: List[Dict], balances: Optional[List[float]] = None) -> Dict:
+        '''
+        Find the input amount maximizing the profit of a route.
+
+        legs: the legs in the order they are chained, the output currency of a leg being
+              the input currency of the next one, e.g.
+              [{'action': 'bid', 'levels': [[0.071, 2.5], [0.0711, 4.0]]}, ...]
+        balances: the maximum amount of input currency available for each leg, all the
+                  legs being placed at the same time
+
+        The result is a dictionnary, looking like the following:
+
+        {
+            'input': 0.5,           # amount of the first currency put in the route
+            'profit': 0.0012,       # output - input, fees included, in the first currency
+            'legs': [{'input': 0.5, 'output': 7.02, 'amount': 7.05, 'price': 0.0711}, ...],
+            'curve': {
+                'inputs': [...],    # breakpoints of the route in the first currency
+                'profits': [...],   # profit at each breakpoint
+                'marginals': [...]  # marginal profit per unit between two breakpoints
+            }
+        }
+
+        'amount' is the base currency amount and 'price' the worst price reached by each
+        leg, as needed to place a limit order.
+        '''
+        curves = [leg_curve(leg['action'], leg['levels'], self.feeRatio) for leg in legs]
+
+        # Express the limit of each leg (depth and balance) and its breakpoints in the first currency
+        maxInput = np.inf
+        breakpoints = []
+        for index, (cumIn, cumOut, cumBase) in enumerate(curves):
+            limit = cumIn[-1]
+            if balances is not None:
+                limit = min(limit, balances[index])
+            points = np.append(cumIn, limit)
+            for prevIn, prevOut, _ in reversed(curves[:index]):
+                points = np.interp(points, prevOut, prevIn)
+            maxInput = min(maxInput, points[-1])
+            breakpoints.append(points[:-1])
+
+        # Merge the breakpoints of all the legs
+        inputs = np.unique(np.concatenate(breakpoints))
+        inputs = np.append(inputs[inputs < maxInput], maxInput)
+
+        # Chain the legs on all the breakpoints at once
+        outputs = inputs
+        for cumIn, cumOut, _ in curves:
+            outputs = np.interp(outputs, cumIn, cumOut)
+        profits = outputs - inputs
+        with np.errstate(divide='ignore', invalid='ignore'):
+            marginals = np.diff(profits) / np.diff(inputs)
+
+        best = int(np.argmax(profits))
+        legsResult = []
+        amount = inputs[best]
+        for (cumIn, cumOut, cumBase), leg in zip(curves, legs):
+            levels = np.asarray(leg['levels'], dtype=float).reshape(-1, 2)
+            output = float(np.interp(amount, cumIn, cumOut))
+            # Level reached by the leg, its price is the limit price of the order
+            reached = min(max(int(np.searchsorted(cumIn, amount, side='left')) - 1, 0), len(levels) - 1)
+            legsResult.append({
+                'input': float(amount),
+                'output': output,
+                'amount': float(np.interp(amount, cumIn, cumBase)) if leg['action'] == 'bid' else float(amount),
+                'price': float(levels[reached, 0]) if len(levels) else 0.0
+            })
+            amount = output
+
+        return {
+            'input': float(inputs[best]),
+            'profit': float(profits[best]),
+            'legs': legsResult,
+            'curve': {
+                'inputs': inputs,
+                'profits': profits,
+                'marginals': marginals
+            }
+        }
+
+
+if __name__ == '__main__':
+    import time
+
+    # Route BTC -> ETH -> ADA -> BTC with 20 levels per leg, deep enough to be profitable
+    rng = np.random.default_rng(0)
+
+    def levels(best, step, amount):
+        return np.column_stack((best + step * np.arange(20), rng.uniform(0.5, 1.5, 20) * amount))
+
+    legs = [
+        {'action': 'bid', 'levels': levels(0.070, 0.00002, 5)},     # ETH-BTC asks
+        {'action': 'bid', 'levels': levels(0.00070, 0.0000002, 500)},  # ADA-ETH asks
+        {'action': 'ask', 'levels': levels(0.0000500, -0.00000002, 500)}  # ADA-BTC bids
+    ]
+    sizer = DepthSizer(0.001)
+    result = sizer.optimize(legs, balances=[1.0, 10.0, 5000.0])
+
+    loops = 1000
+    start = time.perf_counter()
+    for _ in range(loops):
+        sizer.optimize(legs, balances=[1.0, 10.0, 5000.0])
+    print('optimize {0:.3f} ms'.format((time.perf_counter() - start) / loops * 1000))
+    print('input {0:.6f} BTC, profit {1:.8f} BTC'.format(result['input'], result['profit']))
+    for leg in result['legs']:
+        print(leg)
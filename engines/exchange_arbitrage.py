@@ -1,223 +1,354 @@
 import time
 from time import strftime
-import grequests
-from exchanges.loader import EngineLoader
+import asyncio
+from engines.exchanges.loader import EngineLoader
+# Module of the adapters, on the path set by the engine loader
+from base import ExchangeException
+from engines.balance_ledger import BalanceLedger
+from engines.spread_matrix import SpreadMatrix
+from engines.consolidated_book import ConsolidatedBook
+from engines.symbol_registry import SymbolRegistry
+from engines.product_metadata import ProductMetadataCache
+from engines.tick_recorder import TickRecorder
+from utils.logging import crypto_arb_log
 
 class CryptoEngineExArbitrage(object):
     def __init__(self, exParams, mock=False):
+        '''
+        exParams: one entry per venue trading the same asset pair, e.g.
+        {'exchangeA': {'exchange': 'bittrex', 'keyFile': ..., 'tickerPair': 'BTC-ETH',
+        'tickerA': 'BTC', 'tickerB': 'ETH'}, 'exchangeB': {...}, ...}, tickerA being
+        the currency paid and tickerB the asset traded. The other keys are options.
+        A venue can also list other pairs to monitor, by asset: 'monitorPairs':
+        {'LTC': 'BTC-LTC', ...}; their spreads are only logged.
+
+        With the top-level 'base' and 'quote' currencies, e.g. 'ETH' and 'BTC', the
+        pair and the tickers of a venue can be left out and are found in the symbol
+        registry, as are the pairs of the 'monitorAssets' on every venue.
+        '''
         self.exParams = exParams
         self.mock = mock
-        self.minProfit = 0.00005 # This may not be accurate as coins have different value        
+        self.minProfit = exParams.get('minProfit', 0.00005) # This may not be accurate as coins have different value
+        self.sleepTime = exParams.get('sleepTime', 0.5)
+        # Levels of the book of each venue merged into the consolidated book
+        self.depth = exParams.get('depth', 10)
         self.hasOpenOrder = True # always assume there are open orders first
         self.openOrderCheckCount = 0
 
-        self.engineA = EngineLoader.getEngine(self.exParams['exchangeA']['exchange'], self.exParams['exchangeA']['keyFile'])
-        self.engineB = EngineLoader.getEngine(self.exParams['exchangeB']['exchange'], self.exParams['exchangeB']['keyFile'])
+        self.venues = sorted(name for name, params in self.exParams.items() if isinstance(params, dict))
+        self.engines = {}
+        for venue in self.venues:
+            params = self.exParams[venue]
+            self.engines[venue] = EngineLoader.getEngine(params['exchange'], params['keyFile'])
+            self.engines[venue].openOrders = []
+        # Tick and lot sizes and status of the products of each venue
+        self.productRules = {venue: ProductMetadataCache(self.engines[venue], exParams.get('productRefreshInterval', 3600))
+                             for venue in self.venues}
+        # Books received from all the venues written to binary files, when a directory is given
+        self.recorder = None
+        if exParams.get('record'):
+            self.recorder = TickRecorder(exParams['record'], exParams.get('recordDepth', 0))
+            for venue in self.venues:
+                self.recorder.attach(self.engines[venue], self.exParams[venue]['exchange'])
+
+        # Symbols of the venues whose pair is not configured, and of the monitored assets
+        self.registry = SymbolRegistry(exParams.get('symbolCache', SymbolRegistry.cacheFile))
+        self.monitorAssets = exParams.get('monitorAssets', [])
+        self.ledgers = {}
+        if not self.needs_symbols():
+            self.init_markets()
+
+    def needs_symbols(self):
+        return bool(self.monitorAssets) or any('tickerPair' not in self.exParams[venue] for venue in self.venues)
+
+    def resolve_symbols(self):
+        '''
+        Fill the pair and the currencies of the venues configured with the top-level
+        'base' and 'quote' only, and the pairs of the monitored assets, from the registry
+        '''
+        for venue in self.venues:
+            params = self.exParams[venue]
+            exchange = params['exchange']
+            if 'tickerPair' not in params:
+                base, quote = self.exParams['base'], self.exParams['quote']
+                params['tickerPair'] = self.registry.symbol(exchange, base, quote)
+                if params['tickerPair'] is None:
+                    raise ValueError('{0} does not list {1}/{2}'.format(exchange, base, quote))
+                params['tickerA'] = self.registry.currency(exchange, quote)
+                params['tickerB'] = self.registry.currency(exchange, base)
+            quote = self.registry.canonical(exchange, params['tickerA']) or params['tickerA'].upper()
+            monitorPairs = params.setdefault('monitorPairs', {})
+            for asset in self.monitorAssets:
+                pair = self.registry.symbol(exchange, asset, quote)
+                if pair is not None:
+                    monitorPairs.setdefault(asset, pair)
 
-    def start_engine(self):
-        print(strftime('%Y%m%d%H%M%S') + ' starting Exchange Arbitrage Engine...')
+    def init_markets(self):
+        for venue in self.venues:
+            params = self.exParams[venue]
+            # Balances kept locally from the orders placed, reconciled with the exchange in the background
+            self.ledgers[venue] = BalanceLedger(self.engines[venue], [params['tickerA'], params['tickerB']],
+                                                {params['tickerPair']: (params['tickerB'], params['tickerA'])},
+                                                self.exParams.get('reconcileInterval', 300))
+
+        # Spreads of the traded asset and of the monitored ones across all the venues
+        self.asset = self.exParams.get('base', self.exParams[self.venues[0]]['tickerB']).upper()
+        self.tickerPairs = {venue: {self.asset: self.exParams[venue]['tickerPair']} for venue in self.venues}
+        for venue in self.venues:
+            self.tickerPairs[venue].update(self.exParams[venue].get('monitorPairs', {}))
+        assets = [self.asset] + sorted({asset for pairs in self.tickerPairs.values() for asset in pairs} - {self.asset})
+        self.spreads = SpreadMatrix(self.venues, assets, [self.engines[venue].feeRatio for venue in self.venues])
+        self.book = ConsolidatedBook({venue: self.engines[venue].feeRatio for venue in self.venues})
+
+    async def start_engine(self):
+        crypto_arb_log.info(strftime('%Y%m%d%H%M%S') + ' starting Exchange Arbitrage Engine on {0}...'.format(
+            ', '.join(self.exParams[venue]['exchange'] for venue in self.venues)))
         if self.mock:
-            print('---------------------------- MOCK MODE ----------------------------')
-        
-        #Send the request asynchronously
+            crypto_arb_log.info('---------------------------- MOCK MODE ----------------------------')
+        await asyncio.gather(*[engine.warm_up() for engine in self.engines.values()])
+        if self.recorder is not None:
+            self.recorder.start()
+        if self.needs_symbols():
+            await self.registry.load({self.exParams[venue]['exchange']: self.engines[venue] for venue in self.venues})
+            self.resolve_symbols()
+            self.init_markets()
+        responses = await asyncio.gather(*[rules.load() for rules in self.productRules.values()], return_exceptions=True)
+        for venue, res in zip(self.venues, responses):
+            if isinstance(res, BaseException):
+                crypto_arb_log.error('Product rules of {0} not loaded, orders placed unrounded: {1}'.format(
+                    self.exParams[venue]['exchange'], res))
+            self.productRules[venue].start()
+        await asyncio.gather(*[ledger.load() for ledger in self.ledgers.values()])
+        for ledger in self.ledgers.values():
+            ledger.start()
+
         while True:
             try:
                 if not self.mock and self.hasOpenOrder:
-                    self.check_openOrder()
+                    await self.check_openOrder()
                 else:
-                    if self.check_balance():
-                        bookStatus = self.check_orderBook()
+                    if await self.check_balance():
+                        bookStatus = await self.check_orderBook()
                         if bookStatus['status']:
-                            self.place_order(bookStatus['status'], bookStatus['ask'], bookStatus['bid'], bookStatus['maxAmount'])
+                            await self.place_order(bookStatus)
                     else:
                         self.rebalance()
-            except Exception as e:
-                print(e)
+            except (Exception, ExchangeException) as e:
+                crypto_arb_log.error(e)
 
-            #time.sleep(self.engineA.sleepTime)
-            time.sleep(self.engineA.sleepTime + 10)
-            
-    def check_openOrder(self):
+            await asyncio.sleep(self.sleepTime)
+
+    async def check_openOrder(self):
         if self.openOrderCheckCount >= 5:
-            self.cancel_allOrders()
+            await self.cancel_allOrders()
         else:
-            print('Checking open orders...')
-            rs = [self.engineA.get_open_order(),
-                  self.engineB.get_open_order()]
-            responses = self.send_request(rs)
-
-            if not responses[0] or not responses[1]:
-                print(responses)
-                return False
-            
-            if responses[0].parsed or responses[1].parsed:
-                self.engineA.openOrders = responses[0].parsed
-                self.engineB.openOrders = responses[1].parsed
-                print(self.engineA.openOrders, self.engineB.openOrders)
+            crypto_arb_log.info('Checking open orders...')
+            responses = await asyncio.gather(*[self.engines[venue].get_open_order() for venue in self.venues])
+            for venue, orders in zip(self.venues, responses):
+                self.engines[venue].openOrders = orders
+                self.ledgers[venue].settle_orders([order['orderId'] for order in orders])
+
+            if any(responses):
+                crypto_arb_log.info({venue: orders for venue, orders in zip(self.venues, responses) if orders})
                 self.openOrderCheckCount += 1
             else:
                 self.hasOpenOrder = False
-                print('No open orders')
-                print('Starting to check order book...')
-    
-    def cancel_allOrders(self):
-        print('Cancelling all open orders...')
-        rs = []
-        print(self.exParams['exchangeA']['exchange'])
-        for order in self.engineA.openOrders:
-            print(order)
-            rs.append(self.engineA.cancel_order(order['orderId']))
-
-        print(self.exParams['exchangeB']['exchange'])
-        for order in self.engineB.openOrders:
-            print(order)
-            rs.append(self.engineB.cancel_order(order['orderId']))
-
-        responses = self.send_request(rs)
-        
-        self.engineA.openOrders = []
-        self.engineB.openOrders = []
-        self.hasOpenOrder = False
-        
+                crypto_arb_log.info('No open orders')
+                crypto_arb_log.info('Starting to check order book...')
 
-    #Check and set current balance
-    def check_balance(self):
-        rs = [self.engineA.get_balance([self.exParams['exchangeA']['tickerA'], self.exParams['exchangeA']['tickerB']]),
-              self.engineB.get_balance([self.exParams['exchangeB']['tickerA'], self.exParams['exchangeB']['tickerB']])]
+    async def cancel_allOrders(self):
+        crypto_arb_log.info('Cancelling all open orders...')
+        coros = []
+        cancelled = []
+        for venue in self.venues:
+            crypto_arb_log.info(self.exParams[venue]['exchange'])
+            for order in self.engines[venue].openOrders:
+                crypto_arb_log.info(order)
+                coros.append(self.engines[venue].cancel_order(order['orderId']))
+                cancelled.append((venue, order))
 
-        responses = self.send_request(rs)
+        # An order filled meanwhile cannot be cancelled anymore, the others are cancelled all the same
+        responses = await asyncio.gather(*coros, return_exceptions=True)
+        for (venue, order), res in zip(cancelled, responses):
+            if isinstance(res, BaseException):
+                crypto_arb_log.info('Order {0} on {1} not cancelled: {2}'.format(
+                    order['orderId'], self.exParams[venue]['exchange'], res))
 
-        self.engineA.balance = responses[0].parsed
-        self.engineB.balance = responses[1].parsed
-        
-        if not self.mock:
-            for res in responses:
-                for ticker in res.parsed:
-                    # This may not be accurate
-                    if res.parsed[ticker] < 0.05:
-                        print(ticker, res.parsed[ticker], '- Not Enough')
-                        return False
+        for venue in self.venues:
+            self.engines[venue].openOrders = []
+            self.ledgers[venue].release_orders()
+        self.hasOpenOrder = False
+
+    #Check and set current balance
+    async def check_balance(self):
+        '''
+        Read the balances from the local ledgers. Return False when no venue can buy
+        while another one can sell.
+        '''
+        canBuy, canSell = set(), set()
+        for venue in self.venues:
+            params = self.exParams[venue]
+            balance = self.engines[venue].balance = self.ledgers[venue].available
+            # This may not be accurate
+            if self.mock or balance[params['tickerA']] >= 0.05:
+                canBuy.add(venue)
+            if self.mock or balance[params['tickerB']] >= 0.05:
+                canSell.add(venue)
+        if not any(buyVenue != sellVenue for buyVenue in canBuy for sellVenue in canSell):
+            crypto_arb_log.info('Not enough balance to buy on one venue and sell on another one')
+            return False
         return True
-    
+
     def rebalance(self):
-        print('Rebalancing...')
-
-    def check_orderBook(self):
-        rs = [self.engineA.get_ticker_orderBook_innermost(self.exParams['exchangeA']['tickerPair']),
-              self.engineB.get_ticker_orderBook_innermost(self.exParams['exchangeB']['tickerPair'])]
-
-        responses = self.send_request(rs)
-        
-        print("{0} - {1}; {2} - {3}".format(
-            self.exParams['exchangeA']['exchange'],
-            responses[0].parsed,
-            self.exParams['exchangeB']['exchange'],
-            responses[1].parsed
-            ))
-
-        diff_A = responses[0].parsed['ask']['price'] - responses[1].parsed['bid']['price']
-        diff_B = responses[1].parsed['ask']['price'] - responses[0].parsed['bid']['price']
-        if diff_A < 0 and diff_B < 0 and abs(diff_A) < abs(diff_B):
-            diff_A = 0
-        # Buy from Exchange A, Sell to Exchange B
-        if diff_A < 0:
-            maxAmount = self.getMaxAmount(responses[0].parsed['ask'], responses[1].parsed['bid'], 1)
-            fee = self.engineA.feeRatio * maxAmount * responses[0].parsed['ask']['price'] + self.engineB.feeRatio * maxAmount * responses[1].parsed['bid']['price']
-
-            if abs(diff_A * maxAmount) - fee > self.minProfit:
-                print("{0}'s Ask {1} - {2}'s Bid {3} < 0".format(
-                    self.exParams['exchangeA']['exchange'], 
-                    responses[0].parsed['ask']['price'],
-                    self.exParams['exchangeB']['exchange'], 
-                    responses[1].parsed['bid']['price']))    
-                print('{0} (diff) * {1} (amount) = {2}, commission fee: {3}'.format(diff_A, maxAmount, abs(diff_A * maxAmount), fee))           
-                return {'status': 1, 'ask': responses[0].parsed['ask']['price'], 'bid': responses[1].parsed['bid']['price'], 'maxAmount': maxAmount}
-            else:
-                return {'status': 0}
-
-        # Buy from Exchange B, Sell to Exchange A
-        elif diff_B < 0:
-            maxAmount = self.getMaxAmount(responses[1].parsed['ask'], responses[0].parsed['bid'], 2)
-            fee = self.engineB.feeRatio * maxAmount * responses[1].parsed['ask']['price'] + self.engineA.feeRatio * maxAmount * responses[0].parsed['bid']['price']
-
-            if abs(diff_B * maxAmount) - fee > self.minProfit:
-                print("{0}'s Ask {1} - {2}'s Bid {3} < 0".format(
-                    self.exParams['exchangeB']['exchange'], 
-                    responses[1].parsed['ask']['price'], 
-                    self.exParams['exchangeA']['exchange'], 
-                    responses[0].parsed['bid']['price']))
-                print('{0} (diff) * {1} (amount) = {2}, commission fee: {3}'.format(diff_B, maxAmount, abs(diff_B * maxAmount), fee))
-                return {'status': 2, 'ask': responses[1].parsed['ask']['price'], 'bid': responses[0].parsed['bid']['price'], 'maxAmount': maxAmount}
+        crypto_arb_log.info('Rebalancing...')
+
+    async def check_orderBook(self):
+        '''
+        Get the books of all the venues at once and merge them into one consolidated
+        book, then find the amount that can be bought on some venues and sold on the
+        others at a profit, fees included, split across the venues within their
+        balances. The spreads of the monitored assets are computed for all the venue
+        pairs at once.
+        '''
+        # The venues where trading is disabled are left out of the consolidated book, without a request
+        tradable = []
+        for venue in self.venues:
+            if self.productRules[venue].tradable(self.exParams[venue]['tickerPair']):
+                tradable.append(venue)
             else:
-                return {'status': 0}
-
-        return {'status': 0}
-
-    def getMaxAmount(self, askOrder, bidOrder, type):
-        amount = 0
-        # Buy from Exchange A, Sell to Exchange B
-        if type == 1:
-            maxOwnAmountA = self.engineA.balance[self.exParams['exchangeA']['tickerA']] / ((1 + self.engineA.feeRatio) * askOrder['price'])
-            maxOwnAmountB = self.engineB.balance[self.exParams['exchangeB']['tickerB']]
-            amount = min(maxOwnAmountA, maxOwnAmountB, askOrder['amount'], bidOrder['amount'])
-        # Buy from Exchange B, Sell to Exchange A
-        elif type == 2:
-            maxOwnAmountA = self.engineA.balance[self.exParams['exchangeA']['tickerB']]
-            maxOwnAmountB = self.engineB.balance[self.exParams['exchangeB']['tickerA']] / ((1 + self.engineB.feeRatio) * askOrder['price'])
-            amount = min(maxOwnAmountA, maxOwnAmountB, askOrder['amount'], bidOrder['amount'])
-
-        return amount
-
-    def place_order(self, status, ask, bid, amount):
-        print('Placing order...')
-        # Buy from Exchange A, Sell to Exchange B                
-        if status == 1:
-            print(strftime('%Y%m%d%H%M%S') + ' Buy at {0} @ {1} & Sell at {2} @ {3} for {4}'.format(ask, self.exParams['exchangeA']['exchange'], bid, self.exParams['exchangeB']['exchange'], amount))
-            rs = [
-                self.engineA.place_order(self.exParams['exchangeA']['tickerPair'], 'bid', amount, ask),
-                self.engineB.place_order(self.exParams['exchangeB']['tickerPair'], 'ask', amount, bid),                
-            ]
-        # Buy from Exchange B, Sell to Exchange A
-        elif status == 2:
-            print(strftime('%Y%m%d%H%M%S') + ' Buy at {0} @ {1} & Sell at {2} @ {3} for {4}'.format(ask, self.exParams['exchangeB']['exchange'], bid, self.exParams['exchangeA']['exchange'], amount))
-            rs = [
-                self.engineB.place_order(self.exParams['exchangeB']['tickerPair'], 'bid', amount, ask),
-                self.engineA.place_order(self.exParams['exchangeA']['tickerPair'], 'ask', amount, bid),                
-            ]
+                self.book.clear(venue)
+                self.spreads.clear(venue, self.asset)
+        # The monitored pairs of a venue are requested together, in one request when the exchange allows it
+        monitored = {venue: {pair: asset for asset, pair in self.tickerPairs[venue].items() if asset != self.asset}
+                     for venue in self.venues}
+        monitoredVenues = [venue for venue in self.venues if monitored[venue]]
+        depthBooks, tickerBatches = await asyncio.gather(
+            asyncio.gather(*[self.engines[venue].get_ticker_orderBook_depth(self.exParams[venue]['tickerPair'], self.depth)
+                             for venue in tradable], return_exceptions=True),
+            asyncio.gather(*[self.engines[venue].get_tickers_batch(list(monitored[venue])) for venue in monitoredVenues],
+                           return_exceptions=True))
+
+        results = [(venue, self.asset, self.exParams[venue]['tickerPair'], book) for venue, book in zip(tradable, depthBooks)]
+        for venue, batch in zip(monitoredVenues, tickerBatches):
+            results += [(venue, asset, pair, batch if isinstance(batch, BaseException) else batch[pair])
+                        for pair, asset in monitored[venue].items()]
+
+        books = {}
+        for venue, asset, pair, book in results:
+            # ExchangeException derives from BaseException
+            if isinstance(book, BaseException) or (asset == self.asset and not (book['bids'] and book['asks'])):
+                crypto_arb_log.error('{0} {1}: {2}'.format(self.exParams[venue]['exchange'], pair, book))
+                self.spreads.clear(venue, asset)
+                if asset == self.asset:
+                    self.book.clear(venue)
+                continue
+            if asset != self.asset:
+                self.spreads.update_book(venue, asset, book)
+                continue
+            books[venue] = book
+            self.book.update(venue, book)
+            self.spreads.update(venue, asset, book['bids'][0][0], book['asks'][0][0])
+        if self.mock:
+            crypto_arb_log.info('; '.join('{0} - bid {1} ask {2}'.format(
+                self.exParams[venue]['exchange'], book['bids'][0], book['asks'][0]) for venue, book in books.items()))
+        if len(self.spreads.assets) > 1:
+            for opportunity in self.spreads.opportunities():
+                if opportunity['asset'] != self.asset:
+                    crypto_arb_log.info('{0}: buy on {1} at {2}, sell on {3} at {4}, {5:.3%} after fees'.format(
+                        opportunity['asset'], self.exParams[opportunity['buyVenue']]['exchange'], opportunity['ask'],
+                        self.exParams[opportunity['sellVenue']]['exchange'], opportunity['bid'], opportunity['spread']))
+
+        # Balance of the currency paid and of the asset sold available on each venue
+        buyLimits = {venue: self.engines[venue].balance[self.exParams[venue]['tickerA']] for venue in self.venues}
+        sellLimits = {venue: self.engines[venue].balance[self.exParams[venue]['tickerB']] for venue in self.venues}
+        match = self.book.match(buyLimits, sellLimits)
+        if match['amount'] <= 0 or match['profit'] <= self.minProfit:
+            return {'status': 0}
+
+        for action, route in [('Buy', match['buy']), ('Sell', match['sell'])]:
+            crypto_arb_log.info('{0} {1}'.format(action, ', '.join('{0} on {1} up to {2}'.format(
+                order['amount'], self.exParams[venue]['exchange'], order['price']) for venue, order in route['venues'].items())))
+        crypto_arb_log.info('{0} (sold after fees) - {1} (paid after fees) = {2}'.format(
+            match['sell']['net'], match['buy']['net'], match['profit']))
+        return {'status': 1, 'buy': match['buy']['venues'], 'sell': match['sell']['venues'],
+                'amount': match['amount'], 'profit': match['profit']}
+
+    async def place_order(self, bookStatus):
+        '''
+        Place a limit order on each venue of the split, at the worst price reached on it
+        '''
+        crypto_arb_log.info('Placing order...')
+        orders = []
+        for action, route in [('bid', bookStatus['buy']), ('ask', bookStatus['sell'])]:
+            for venue, order in route.items():
+                # Amount and price written in decimal to the tick and lot of the product
+                rounded = self.productRules[venue].round_order(self.exParams[venue]['tickerPair'], action, order['amount'], order['price'])
+                if rounded is None:
+                    crypto_arb_log.info('{0} of {1} on {2} below the rules of the product, nothing placed'.format(
+                        action, order['amount'], self.exParams[venue]['exchange']))
+                    return
+                orders.append((venue, action, rounded['price'], rounded['amount']))
+        for venue, action, price, amount in orders:
+            crypto_arb_log.info(strftime('%Y%m%d%H%M%S') + ' {0} at {1} @ {2} for {3}'.format(
+                'Buy' if action == 'bid' else 'Sell', price, self.exParams[venue]['exchange'], amount))
 
         if not self.mock:
-            responses = self.send_request(rs)
+            # The orders accepted are held and followed even when another venue rejects its order
+            responses = await asyncio.gather(*[
+                self.engines[venue].place_order(self.exParams[venue]['tickerPair'], action, amount, price)
+                for venue, action, price, amount in orders], return_exceptions=True)
+            placed = 0
+            for (venue, action, price, amount), res in zip(orders, responses):
+                if isinstance(res, BaseException):
+                    crypto_arb_log.error('{0} on {1} rejected: {2}'.format(action, self.exParams[venue]['exchange'], res))
+                    continue
+                orderId = res.get('orderId') if isinstance(res, dict) else None
+                self.ledgers[venue].hold_order(orderId, self.exParams[venue]['tickerPair'], action, float(amount), float(price))
+                placed += 1
+            if not placed:
+                return
         self.hasOpenOrder = True
         self.openOrderCheckCount = 0
 
-    def send_request(self, rs):
-        responses = grequests.map(rs)
-        for res in responses:
-            if not res:
-                print(responses)
-                raise Exception
-        return responses
+    async def run(self):
+        await self.start_engine()
 
-    def run(self):
-        self.start_engine()
+    async def end_engine(self):
+        '''
+        Stop the background tasks and close the connections to the exchanges
+        '''
+        for ledger in self.ledgers.values():
+            await ledger.stop()
+        for rules in self.productRules.values():
+            await rules.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        await asyncio.gather(*[engine.end_engine() for engine in self.engines.values()])
 
 if __name__ == '__main__':
     exParams = {
         'exchangeA': {
             'exchange': 'bittrex',
-            'keyFile': '../keys/bittrex.key',
+            'keyFile': 'keys/bittrex.key',
             'tickerPair': 'BTC-ETH',
             'tickerA': 'BTC',
-            'tickerB': 'ETH'        
+            'tickerB': 'ETH'
         },
         'exchangeB': {
             'exchange': 'bitstamp',
-            'keyFile': '../keys/bitstamp.key',
+            'keyFile': 'keys/bitstamp.key',
             'tickerPair': 'ethbtc',
             'tickerA': 'btc',
-            'tickerB': 'eth'         
+            'tickerB': 'eth'
         }
     }
-    engine = CryptoEngineExArbitrage(exParams, True)
-    #engine = CryptoEngineExArbitrage(exParams)
-    engine.run()
+
+    async def main():
+        engine = CryptoEngineExArbitrage(exParams, True)
+        #engine = CryptoEngineExArbitrage(exParams)
+        try:
+            await engine.run()
+        finally:
+            await engine.end_engine()
+
+    asyncio.run(main())
@@ -1,11 +1,40 @@
 from abc import ABC, abstractmethod
 import asyncio
 import json
+import re
+import time
+import aiohttp
+from typing import Dict, List
+from engines.market_events import LatencyTracker
+from engines.exchanges.rate_limit import TokenBucket
+from utils.logging import crypto_arb_log
 
 class ExchangeException(BaseException):
     pass
 
 class ExchangeEngineBase(ABC):
+    # Settings of the HTTP transport shared by all the requests of an engine
+    connectionLimit = 100
+    connectionLimitPerHost = 20
+    dnsCacheTtl = 300
+    keepaliveTimeout = 30
+    requestTimeout = 10
+    # Connections opened at engine start, and the path requested to open them
+    warmUpConnections = 4
+    warmUpPath = '/'
+    # Rate limits of the exchange: bucket name -> (requests per second, burst), the
+    # 'rate_limits' entry of the key file overrides them (None disabling a bucket)
+    rateLimits = {}
+    # Bucket of the order book requests, used to pace the polling
+    marketDataBucket = 'public'
+    # Number of times a request answered with a 429 is sent again
+    maxRetries = 3
+    # Lanes of the requests by decreasing priority, the orders have their own connections
+    lanes = ('orders', 'account', 'marketData')
+    reservedConnections = 2
+    # Path segments followed by a product, masked in the latency labels
+    productPaths = ()
+
     @abstractmethod
     def __init__(self, filename):
         pass
@@ -13,7 +42,187 @@ class ExchangeEngineBase(ABC):
     def load_key(self, filename):
         with open(filename) as f:    
             self.key = json.load(f)
+
+    def _create_session(self, limit: int, limitPerHost: int) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=limit,
+            limit_per_host=limitPerHost,
+            ttl_dns_cache=self.dnsCacheTtl,
+            keepalive_timeout=self.keepaliveTimeout)
+        # Measure the time spent waiting for a free connection of the pool
+        trace = aiohttp.TraceConfig()
+        trace.on_connection_queued_start.append(self._on_connection_queued)
+        trace.on_connection_queued_end.append(self._on_connection_dequeued)
+        return aiohttp.ClientSession(
+            connector=connector,
+            headers=getattr(self, 'sessionHeaders', None),
+            timeout=aiohttp.ClientTimeout(total=self.requestTimeout),
+            trace_configs=[trace])
+
+    @staticmethod
+    async def _on_connection_queued(session, context, params):
+        context.queued = time.perf_counter()
+
+    @staticmethod
+    async def _on_connection_dequeued(session, context, params):
+        context.trace_request_ctx['connection'] += time.perf_counter() - context.queued
+
+    def open_session(self, lane: str = 'marketData') -> aiohttp.ClientSession:
+        '''
+        Return the client session of a lane, creating the sessions on first use: the
+        connections are kept alive and reused by all the requests, and the DNS
+        resolutions are cached. The orders lane has its own connections, so that an
+        order never waits for a connection used by a read.
+        '''
+        if getattr(self, 'client_session', None) is None:
+            self.client_session = self._create_session(self.connectionLimit, self.connectionLimitPerHost)
+            self.reserved_session = self._create_session(self.reservedConnections, self.reservedConnections)
+            self.requestLatency = {}
+            # Time spent by the requests of each lane waiting for a token and a connection
+            self.laneWait = {name: LatencyTracker(1000) for name in self.lanes}
+        return self.reserved_session if lane == 'orders' else self.client_session
+
+    def get_rateLimiter(self, bucket: str) -> TokenBucket:
+        '''
+        Return the token bucket limiting the requests of a bucket name, None when not limited
+        '''
+        if not hasattr(self, 'rateLimiters'):
+            limits = dict(self.rateLimits)
+            limits.update(getattr(self, 'key', {}).get('rate_limits', {}))
+            self.rateLimiters = {name: TokenBucket(*limit) for name, limit in limits.items() if limit is not None}
+        return self.rateLimiters.get(bucket)
+
+    async def warm_up(self):
+        '''
+        Open the connections to the exchange before the first tick, so that it does
+        not pay the DNS, TCP and TLS setup. The status of the answers is not checked.
+        '''
+        async def connect(session):
+            async with session.head(self.API_URL + self.warmUpPath, trace_request_ctx={'connection': 0.0}) as response:
+                await response.read()
+
+        sessions = [self.open_session()] * self.warmUpConnections + [self.open_session('orders')] * self.reservedConnections
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[connect(session) for session in sessions], return_exceptions=True)
+        errors = [res for res in responses if isinstance(res, Exception)]
+        if errors:
+            crypto_arb_log.error('Warm-up of {0} failed: {1}'.format(self.API_URL, errors[0]))
+        else:
+            crypto_arb_log.info('{0} connections to {1} opened in {2:.1f} ms'.format(
+                len(sessions), self.API_URL, (time.perf_counter() - start) * 1000))
+
+    async def request(self, httpMethod: str, url: str, bucket: str = None, lane: str = 'marketData',
+                      cost: float = 1, **kwargs):
+        '''
+        Send a request and return its JSON content. The request first waits for a
+        token of its rate limit bucket, the lanes listed first being served first,
+        and is sent again when the exchange answers with a 429, its connection being
+        released while waiting. The time taken is recorded per endpoint, the products
+        and IDs in the path being masked, and the time spent waiting for a token or a
+        connection is recorded per lane.
+        '''
+        priority = self.lanes.index(lane)
+        session = self.open_session(lane)
+        limiter = self.get_rateLimiter(bucket)
+        waited = {'connection': 0.0}
+        queueWait = 0.0
+        for attempt in range(self.maxRetries + 1):
+            if limiter is not None:
+                queued = time.perf_counter()
+                await limiter.acquire(cost, priority)
+                queueWait += time.perf_counter() - queued
+            start = time.perf_counter()
+            retryAfter = None
+            async with session.request(httpMethod, url, trace_request_ctx=waited, **kwargs) as response:
+                if response.status == 429 and attempt < self.maxRetries:
+                    retryAfter = self._retry_after(response.headers.get('Retry-After'))
+                else:
+                    content = await response.json(content_type=None)
+            if retryAfter is None:
+                break
+            # The connection is back in the pool while waiting
+            crypto_arb_log.info('{0} {1} rate limited, retrying in {2} s'.format(httpMethod, url, retryAfter))
+            if limiter is not None:
+                limiter.penalize(retryAfter)
+            else:
+                await asyncio.sleep(retryAfter or 1)
+        self.laneWait[lane].record(queueWait + waited['connection'])
+
+        label = self._latency_label(httpMethod, url)
+        if label not in self.requestLatency:
+            self.requestLatency[label] = LatencyTracker(1000)
+        self.requestLatency[label].record(time.perf_counter() - start)
+        return content
+
+    def _latency_label(self, httpMethod: str, url: str) -> str:
+        '''
+        Return the endpoint of a request, its products and IDs masked, so that the
+        requests of all the products share one latency tracker
+        '''
+        path = url.split('?')[0]
+        for segment in self.productPaths:
+            path = re.sub(r'/{0}/[^/]+'.format(re.escape(segment)), '/{0}/{{product}}'.format(segment), path)
+        return '{0} {1}'.format(httpMethod.upper(), re.sub(r'/[0-9a-fA-F-]{8,}', '/{id}', path))
+
+    @staticmethod
+    def _retry_after(value) -> float:
+        try:
+            return max(float(value), 0)
+        except (TypeError, ValueError):
+            return 0
+
+    def log_requestLatency(self):
+        for label, tracker in getattr(self, 'requestLatency', {}).items():
+            tracker.log(label)
+
+    def log_laneWait(self):
+        for name, tracker in getattr(self, 'laneWait', {}).items():
+            if tracker.count:
+                tracker.log('{0} lane queue wait'.format(name))
+
+    def log_rateLimits(self):
+        for name, limiter in getattr(self, 'rateLimiters', {}).items():
+            usage = limiter.usage()
+            if not usage['requests']:
+                continue
+            crypto_arb_log.info('{0} {1} rate limit: {2} requests, {3:.0%} of the budget used, '
+                                '{4:.1f} s waited in total, {5} rejected'.format(
+                                    self.API_URL, name, usage['requests'], usage['ratio'],
+                                    usage['waited'], usage['rejected']))
+
+    async def end_engine(self):
+        '''
+        Close the session and its connections, to be called once the engine is stopped
+        '''
+        if getattr(self, 'client_session', None) is not None:
+            self.log_requestLatency()
+            self.log_rateLimits()
+            self.log_laneWait()
+            await self.client_session.close()
+            await self.reserved_session.close()
+            self.client_session = None
             
+    async def get_tickers_batch(self, pairs: List[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        '''
+        Return the innermost order book of several ticker pairs: {pair: book}, a pair
+        whose request failed getting the exception instead. The adapters of the
+        exchanges giving the tickers of many pairs in one request override it, the
+        pairs are requested concurrently otherwise.
+        '''
+        responses = await asyncio.gather(
+            *[self.get_ticker_orderBook_innermost(pair) for pair in pairs], return_exceptions=True)
+        return dict(zip(pairs, responses))
+
+    async def get_books_batch(self, pairs: List[str], depth: int) -> Dict[str, Dict[str, List[List[float]]]]:
+        '''
+        Return the first levels of the order book of several ticker pairs, like
+        get_tickers_batch: {pair: book}, a pair whose request failed getting the
+        exception instead.
+        '''
+        responses = await asyncio.gather(
+            *[self.get_ticker_orderBook_depth(pair, depth) for pair in pairs], return_exceptions=True)
+        return dict(zip(pairs, responses))
+
     @abstractmethod
     async def _send_request(self):
         pass
@@ -13,99 +13,91 @@ $25,000,000.00 or more traded                      0.000%        0.120%
 $30,000,000.00 or more traded                      0.000%        0.100%
 '''
 
+import asyncio
+from base import ExchangeException
 from mod_imports import *
+from typing import Dict, List
+
 class ExchangeEngine(ExchangeEngineBase):
-    def __init__(self):
-        self.API_URL = 'https://api.bitfinex.com'
+    # Between 10 and 90 requests per minute depending on the endpoint
+    rateLimits = {'public': (1, 10), 'private': (1.5, 15)}
+    productPaths = ('book', 'pubticker')
+
+    def __init__(self, filename):
         self.apiVersion = 'v1'
         self.sleepTime = 5
         self.feeRatio = 0.002
-        self.async = True
-        
-    def _send_request(self, command, httpMethod, params={}, hook=None):          
-        command = '/{0}/{1}'.format(self.apiVersion, command)
 
+        self.load_key(filename)
+        self.API_URL = self.key.get('api_url', 'https://api.bitfinex.com')
+
+        self.signer = hmac.new(self.key['private'].encode('utf8'), digestmod=hashlib.sha384)
+        self.warmUpPath = '/v1/symbols'
+
+        # Creation of the client session to use
+        self.client_session = None
+
+    async def _send_request(self, command: str, httpMethod: str, params={}, lane: str = 'marketData'):
+        command = '/{0}/{1}'.format(self.apiVersion, command)
         url = self.API_URL + command
+
         headers = {}
-        if httpMethod == "GET":
-            R = grequests.get
-        elif httpMethod == "POST":
-            R = grequests.post          
-            
-            secret = self.key['private']
+        body = None
+        if httpMethod == 'POST':
+            params = dict(params)
             params['request'] = command
-            params['nonce'] = str(long(1000000*time.time()))
-            
-            j = json.dumps(params)
-            message = base64.standard_b64encode(j.encode('utf8'))
-            
-            signature = hmac.new(secret.encode('utf8'), message, hashlib.sha384)
-            signature = signature.hexdigest()
-            
+            params['nonce'] = str(int(1000000*time.time()))
+            body = json.dumps(params)
+
+            # The payload is the base64 encoded JSON body, signed with HMAC-SHA384
+            payload = base64.standard_b64encode(body.encode('utf8'))
+            signature = self.signer.copy()
+            signature.update(payload)
+
             headers = {
+                'Content-Type': 'application/json',
                 'X-BFX-APIKEY': self.key['public'],
-                'X-BFX-PAYLOAD': message,
-                'X-BFX-SIGNATURE': signature
-            }       
-               
-        args = {'data': params, 'headers': headers}
-        if hook:
-            args['hooks'] = dict(response=hook)
-            
-        req = R(url, **args)
-        if self.async:
-            return req
-        else:
-            response = grequests.map([req])[0].json()
-            
-            if 'error' in response:
-                print(response)
-            return response    
-    
-    
-    '''
-        return in r.parsed, showing all and required tickers
+                'X-BFX-PAYLOAD': payload.decode(),
+                'X-BFX-SIGNATURE': signature.hexdigest()
+            }
+
+        content = await self.request(httpMethod, url, 'private' if httpMethod == 'POST' else 'public', lane, data=body, headers=headers)
+
+        if isinstance(content, dict) and ('message' in content or 'error' in content):
+            raise ExchangeException(content.get('message', content.get('error')))
+        return content
+
+    async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
+        '''
+        Return the balance of the tickers given by the caller, or of all the tickers
+        when none is given.
+
         {
             'ETH': 0.005,
             'OMG': 0
         }
-    '''
-    def get_balance(self, tickers=[]):
-        return self._send_request('balances', 'POST', {}, [self.hook_getBalance(tickers=tickers)])
-    
-    def hook_getBalance(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            
-            if factory_kwargs['tickers']:
-                json = filter(lambda ticker: ticker['currency'].upper() in factory_kwargs['tickers'], json)
-                
-            for ticker in json:
-                r.parsed[ticker['currency'].upper()] = float(ticker['amount'])
-                    
-                                  
-        return res_hook    
+        '''
+        balances = await self._send_request('balances', 'POST', lane='account')
+
+        return {balance['currency'].upper(): float(balance['amount']) for balance in balances
+                if not tickers or balance['currency'].upper() in tickers}
+
+    async def get_ticker_lastPrice(self, ticker: str) -> Dict[str, float]:
+        '''
+        Get the last price of a ticker pair
 
-    '''
-        return USDT in r.parsed
         {
-            'BTC': 18000    
+            'BTCUSD': 18000
         }
-    '''       
-    def get_ticker_lastPrice(self, ticker):
-         return self._send_request('pubticker/{0}'.format(ticker), 'GET', {}, [self.hook_lastPrice(ticker=ticker)])
-
-    def hook_lastPrice(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            r.parsed[factory_kwargs['ticker']] = float(json['last_price'])
-                                  
-        return res_hook    
+        '''
+        result = await self._send_request('pubticker/{0}'.format(ticker), 'GET')
+
+        return {ticker: float(result['last_price'])}
+
+    async def get_ticker_orderBook_innermost(self, ticker: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Get the best bid and ask of a ticker pair
 
-    '''
-        return in r.parsed
         {
             'bid': {
                 'price': 0.02202,
@@ -114,84 +106,136 @@ class ExchangeEngine(ExchangeEngineBase):
             'ask': {
                 'price': 0.02400,
                 'amount': 103.2
-            },           
+            }
         }
-    '''
-    def get_ticker_orderBook_innermost(self, ticker): 
-        return self._send_request('book/{0}'.format(ticker), 'GET', {}, self.hook_orderBook)  
-    
-    def hook_orderBook(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        r.parsed = {
-                    'bid':  {
-                             'price': float(json['bids'][0]['price']),
-                             'amount': float(json['bids'][0]['amount'])
-                            },
-                    'ask':  {
-                             'price': float(json['asks'][0]['price']),
-                             'amount': float(json['asks'][0]['amount'])
-                            }
-                    }
-    
-    '''
-        return in r.parsed
+        '''
+        book = await self._send_request('book/{0}?limit_bids=1&limit_asks=1'.format(ticker), 'GET')
+
+        return {
+            'bid': {
+                'price': float(book['bids'][0]['price']),
+                'amount': float(book['bids'][0]['amount'])
+            },
+            'ask': {
+                'price': float(book['asks'][0]['price']),
+                'amount': float(book['asks'][0]['amount'])
+            }
+        }
+
+    async def get_ticker_orderBook_depth(self, ticker: str, count: int) -> Dict[str, List[List[float]]]:
+        '''
+        Get the first levels of the order book of a ticker pair, best level first
+
+        {
+            'bids': [[0.02202, 1103.5148], [0.02201, 12.5]],
+            'asks': [[0.02400, 103.2], [0.02410, 50.0]]
+        }
+        '''
+        book = await self._send_request('book/{0}?limit_bids={1}&limit_asks={1}'.format(ticker, count), 'GET')
+
+        return {
+            'bids': [[float(level['price']), float(level['amount'])] for level in book['bids']],
+            'asks': [[float(level['price']), float(level['amount'])] for level in book['asks']]
+        }
+
+    async def get_products(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of the products that can be traded on the exchange, the
+        currencies being named as in the balances
+
         [
             {
-                'orderId': 1242424
+                'pair': 'ethbtc',
+                'base': 'ETH',
+                'quote': 'BTC'
             }
         ]
-    '''        
-    def get_open_order(self):
-        return self._send_request('orders', 'POST', {}, self.hook_openOrder) 
-       
-    def hook_openOrder(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        r.parsed = []
-        for order in json:
-            r.parsed.append({'orderId': order['id'], 'created': order['timestamp']})
-        
-    '''
+        '''
+        symbols = await self._send_request('symbols', 'GET')
+
+        result = []
+        for symbol in symbols:
+            # Symbols are 6 letters, or use a colon when a currency is longer: 'dusk:btc'
+            base, quote = symbol.split(':') if ':' in symbol else (symbol[:3], symbol[3:])
+            result.append({'pair': symbol, 'base': base.upper(), 'quote': quote.upper()})
+        return result
+
+    async def get_tickers_batch(self, pairs: List[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        '''
+        Get the best bid and ask of several ticker pairs in one request, with the
+        tickers endpoint of the v2 API
+
+        {
+            'ethbtc': {'bid': {'price': 0.02202, 'amount': 3}, 'ask': {'price': 0.02400, 'amount': 1}}
+        }
+        '''
+        symbols = {'t' + pair.upper(): pair for pair in pairs}
+        url = '{0}/v2/tickers?symbols={1}'.format(self.API_URL, ','.join(symbols))
+        try:
+            tickers = await self.request('GET', url, 'public')
+        except (Exception, ExchangeException) as e:
+            return dict.fromkeys(pairs, e)
+
+        # [SYMBOL, BID, BID_SIZE, ASK, ASK_SIZE, ...]
+        result = {symbols[ticker[0]]: {
+            'bid': {'price': float(ticker[1]), 'amount': float(ticker[2])},
+            'ask': {'price': float(ticker[3]), 'amount': float(ticker[4])}
+        } for ticker in tickers if ticker[0] in symbols}
+        return {pair: result.get(pair, ExchangeException('No ticker for {0}'.format(pair))) for pair in pairs}
+
+    async def get_open_order(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of open orders currently existing
+
+        [
+            {
+                'orderId': '1242424'
+            }
+        ]
+        '''
+        orders = await self._send_request('orders', 'POST', lane='account')
+
+        return [{'orderId': str(order['id']), 'created': order['timestamp']} for order in orders]
+
+    async def place_order(self, ticker: str, action: str, amount: float, price: float):
+        '''
         ticker: 'OMGETH'
         action: 'bid' or 'ask'
         amount: 700
         price: 0.2
-    '''
-    def place_order(self, ticker, action, amount, price):
+
+        Return the ID of the order as listed by get_open_order: {'orderId': '1242424'}
+        '''
         action = 'buy' if action == 'bid' else 'sell'
         data = {'symbol': ticker, 'side': action, 'amount': str(amount), 'price': str(price), 'exchange': 'bitfinex', 'type': 'exchange limit'}
-        return self._send_request('order/new', 'POST', data)
-  
-    def cancel_order(self, orderID):
-        return self._send_request('order/cancel', 'POST', {'order_id': long(orderID)})    
-    
-    
-    
+        order = await self._send_request('order/new', 'POST', data, 'orders')
+        return {'orderId': str(order['id'])}
+
+    async def cancel_order(self, orderID):
+        return await self._send_request('order/cancel', 'POST', {'order_id': int(orderID)}, 'orders')
+
     ''' bitfinex doesn't provide external withdrawal api
     def withdraw(self, amount, address):
         data = {'withdraw_type': 'OMG', 'walletselected': 'exchange', 'amount': amount, 'address': address}
         return self._send_request('account_infos', data)
     '''
-    
-   
-    
+
+    async def get_ticker_history(self, ticker):
+        raise NotImplementedError("This function seems not needed for Triangular arbitrage")
+
+
 if __name__ == "__main__":
-    engine = ExchangeEngine()
-    engine.load_key('../../keys/bitfinex.key')
-    #print(engine.get_balance()
-    for res in grequests.map([engine.get_ticker_lastPrice('BTCUSD')]):
-        print(res.parsed)
-        pass    
-
-    # for res in grequests.map([engine.cancel_order('525113932211')]):
-    #     print(res.json()
-    #     pass    
-
-#     for res in grequests.map([engine.place_order('OMGETH', 'bid', 5, 0.02)]):
-#         print(res.json()
-#         pass
-#        
-    #print(engine.get_open_order()
-    #engine.place_order('OMGETH', 'bid', 40, 0.01)
-    #print(engine.get_ticker_orderBook('OMGETH')
-    #print(engine.place_order('OMGETH', 'bid', 850, 0.02)
-    #print(engine.cancel_order(446915287)
\ No newline at end of file
+    engine = ExchangeEngine('../../keys/bitfinex.key')
+
+    async def main():
+        try:
+            print(await engine.get_ticker_lastPrice('BTCUSD'))
+            # print(await engine.get_balance())
+            # print(await engine.get_ticker_orderBook_innermost('OMGETH'))
+            # print(await engine.get_open_order())
+            # print(await engine.place_order('OMGETH', 'bid', 5, 0.02))
+            # print(await engine.cancel_order('525113932211'))
+        finally:
+            await engine.end_engine()
+
+    asyncio.run(main())
@@ -3,101 +3,87 @@
 
 '''
 
+import asyncio
+from base import ExchangeException
 from mod_imports import *
+from typing import Dict, List
 
 class ExchangeEngine(ExchangeEngineBase):
-    def __init__(self):
-        self.API_URL = 'https://www.bitstamp.net/api'
+    # 8000 requests per 10 minutes
+    rateLimits = {'api': (13, 13)}
+    marketDataBucket = 'api'
+    productPaths = ('order_book', 'ticker')
+
+    def __init__(self, filename):
         self.apiVersion = 'v2'
         self.sleepTime = 5
         self.feeRatio = 0.0026
-        self.async = True
-                  
-    def _send_request(self, command, httpMethod, params={}, hook=None):          
-        command = '/{0}/{1}'.format(self.apiVersion, command)
 
+        self.load_key(filename)
+        self.API_URL = self.key.get('api_url', 'https://www.bitstamp.net/api')
+
+        self.signer = hmac.new(self.key['private'].encode('utf8'), digestmod=hashlib.sha256)
+        self.warmUpPath = '/v2/trading-pairs-info/'
+
+        # Creation of the client session to use
+        self.client_session = None
+
+    async def _send_request(self, command: str, httpMethod: str, params={}, lane: str = 'marketData'):
+        command = '/{0}/{1}'.format(self.apiVersion, command)
         url = self.API_URL + command
 
-        if httpMethod == "GET":
-            R = grequests.get
-        elif httpMethod == "POST":
-            R = grequests.post       
-        
-        headers = {}
-        
-        if httpMethod == "POST":
+        if httpMethod == 'POST':
+            params = dict(params)
             nonce = int(1000*time.time())
             message = str(nonce) + self.key['customer_id'] + self.key['public']
- 
-            signature = hmac.new(
-                self.key['private'].encode('utf8'),
-                msg=message.encode('utf8'),
-                digestmod=hashlib.sha256
-            ).hexdigest().upper()
+
+            # signature = uppercase hex HMAC-SHA256 of (nonce + customer ID + API key)
+            signature = self.signer.copy()
+            signature.update(message.encode('utf8'))
+            signature = signature.hexdigest().upper()
             params['key'] = self.key['public']
             params['nonce'] = nonce
             params['signature'] = signature
-            
-        args = {'data': params, 'headers': headers}
-        if hook:
-            args['hooks'] = dict(response=hook)
-            
-        req = R(url, **args)
-        
-        if self.async:
-            return req
-        else:
-            response = grequests.map([req])[0].json()
-            
-            if 'error' in response:
-                print(response)
-            return response
-    '''
-        return in r.parsed, showing all and required tickers
+
+        content = await self.request(httpMethod, url, 'api', lane, data=params if httpMethod == 'POST' else None)
+
+        if isinstance(content, dict) and (content.get('status') == 'error' or 'error' in content):
+            raise ExchangeException(content.get('reason', content.get('error')))
+        return content
+
+    async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
+        '''
+        Return the available balance of the tickers given by the caller, or of all
+        the tickers when none is given.
+
         {
-            'ETH': 0.005,
-            'OMG': 0
+            'btc': 0.005,
+            'eth': 0
         }
-    '''    
-    def get_balance(self, tickers=[]):
-        return self._send_request('balance/', 'POST', {}, [self.hook_getBalance(tickers=tickers)])
-    
-    def hook_getBalance(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            suffix = '_available'
-
-            if factory_kwargs['tickers']:
-                for ticker in factory_kwargs['tickers']:
-                    r.parsed[ticker] = float(json[ticker + suffix])
-            else:
-                for k, v in json.iteritems():
-                    if suffix in k:
-                        ticker = k.split(suffix)[0]
-                        r.parsed[ticker] = float(v)
-                                     
-        return res_hook    
-
-    '''
-        return USDT in r.parsed
+        '''
+        balances = await self._send_request('balance/', 'POST', lane='account')
+        suffix = '_available'
+
+        if tickers:
+            return {ticker: float(balances[ticker + suffix]) for ticker in tickers}
+        return {key[:-len(suffix)]: float(value) for key, value in balances.items() if key.endswith(suffix)}
+
+    async def get_ticker_lastPrice(self, ticker: str) -> Dict[str, float]:
+        '''
+        Get the last price of a ticker pair
+
         {
-            'BTC': 18000    
+            'btcusd': 18000
         }
-    '''       
-    def get_ticker_lastPrice(self, ticker):
-         return self._send_request('ticker/{0}/'.format(ticker), 'GET', {}, [self.hook_lastPrice(ticker=ticker)])
-
-    def hook_lastPrice(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            r.parsed[factory_kwargs['ticker']] = float(json['last'])
-                                  
-        return res_hook    
-
-    '''
-        return in r.parsed
+        '''
+        result = await self._send_request('ticker/{0}/'.format(ticker), 'GET')
+
+        return {ticker: float(result['last'])}
+
+    async def get_ticker_orderBook_innermost(self, ticker: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Get the best bid and ask of a ticker pair
+
         {
             'bid': {
                 'price': 0.02202,
@@ -106,96 +92,122 @@ class ExchangeEngine(ExchangeEngineBase):
             'ask': {
                 'price': 0.02400,
                 'amount': 103.2
-            },           
+            }
+        }
+        '''
+        book = await self._send_request('order_book/{0}/'.format(ticker), 'GET')
+
+        return {
+            'bid': {
+                'price': float(book['bids'][0][0]),
+                'amount': float(book['bids'][0][1])
+            },
+            'ask': {
+                'price': float(book['asks'][0][0]),
+                'amount': float(book['asks'][0][1])
+            }
         }
-    '''       
-    def get_ticker_orderBook_innermost(self, ticker):
-        return self._send_request('order_book/{0}/'.format(ticker), 'GET', {}, self.hook_orderBook)     
-     
-    def hook_orderBook(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        #print(json
-        r.parsed = {
-                    'bid':  {
-                             'price': float(json['bids'][0][0]),
-                             'amount': float(json['bids'][0][1])
-                            },
-                    'ask':  {
-                             'price': float(json['asks'][0][0]),
-                             'amount': float(json['asks'][0][1])
-                            }
-                    }    
-        
-    '''
-        return in r.parsed
+
+    async def get_ticker_orderBook_depth(self, ticker: str, count: int) -> Dict[str, List[List[float]]]:
+        '''
+        Get the first levels of the order book of a ticker pair, best level first
+
+        {
+            'bids': [[0.02202, 1103.5148], [0.02201, 12.5]],
+            'asks': [[0.02400, 103.2], [0.02410, 50.0]]
+        }
+        '''
+        book = await self._send_request('order_book/{0}/'.format(ticker), 'GET')
+
+        return {
+            'bids': [[float(level[0]), float(level[1])] for level in book['bids'][:count]],
+            'asks': [[float(level[0]), float(level[1])] for level in book['asks'][:count]]
+        }
+
+    async def get_products(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of the products that can be traded on the exchange, the
+        currencies being named as in the balances
+
         [
             {
-                'orderId': 1242424
+                'pair': 'ethbtc',
+                'base': 'eth',
+                'quote': 'btc'
             }
         ]
-    '''           
-    def get_open_order(self):
-        return self._send_request('open_orders/all/', 'POST', {}, self.hook_openOrder)
-    
-    def hook_openOrder(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        print(json)
-        r.parsed = []
-        for order in json:
-            r.parsed.append({'orderId': str(order['id']), 'created': order['datetime']})
-
-        
-    '''
-        ticker: 'ETH-ETC'
+        '''
+        products = await self._send_request('trading-pairs-info/', 'GET')
+
+        result = []
+        for product in products:
+            if product.get('trading', 'Enabled') != 'Enabled':
+                continue
+            base, quote = product['name'].lower().split('/')
+            result.append({'pair': product['url_symbol'], 'base': base, 'quote': quote})
+        return result
+
+    async def get_open_order(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of open orders currently existing
+
+        [
+            {
+                'orderId': '1242424'
+            }
+        ]
+        '''
+        orders = await self._send_request('open_orders/all/', 'POST', lane='account')
+
+        return [{'orderId': str(order['id']), 'created': order['datetime']} for order in orders]
+
+    async def place_order(self, tickerPair: str, action: str, amount: float, price: float):
+        '''
+        tickerPair: 'ethbtc'
         action: 'bid' or 'ask'
         amount: 700
         price: 0.2
-    '''
-    def place_order(self, tickerPair, action, amount, price):
+
+        Return the ID of the order as listed by get_open_order: {'orderId': '1242424'}
+        '''
         action = 'buy' if action == 'bid' else 'sell'
         cmd = '{0}/{1}/'.format(action, tickerPair)
-        return self._send_request(cmd, 'POST', {"amount": amount, "price": price})    
-    
-    def cancel_order(self, orderID):
-        return self._send_request('cancel_order/', 'POST', {"id": orderID})
-    
-    def withdraw(self, ticker, amount, address):
+        order = await self._send_request(cmd, 'POST', {'amount': amount, 'price': price}, 'orders')
+        return {'orderId': str(order['id'])}
+
+    async def cancel_order(self, orderID):
+        return await self._send_request('cancel_order/', 'POST', {'id': orderID}, 'orders')
+
+    async def withdraw(self, ticker, amount, address):
         if ticker == 'btc':
             urlPart = 'bitcoin_withdrawal'
         elif ticker == 'eth':
             urlPart = 'eth_withdrawal'
         elif ticker == 'ltc':
-            ulrPart = 'ltc_withdrawal'
+            urlPart = 'ltc_withdrawal'
         elif ticker == 'xrp':
             urlPart = 'ripple_withdrawal'
         else:
-            raise Exception('{0} is not implemented for withdrawal'.format(ticker))
-        return self._send_request('{0}/'.format(urlPart), 'POST', {"amount": amount, "address": address})
-    
+            raise ExchangeException('{0} is not implemented for withdrawal'.format(ticker))
+        return await self._send_request('{0}/'.format(urlPart), 'POST', {'amount': amount, 'address': address}, 'orders')
+
+    async def get_ticker_history(self, ticker):
+        raise NotImplementedError("This function seems not needed for Triangular arbitrage")
+
+
 if __name__ == "__main__":
-    engine = ExchangeEngine()
-    engine.load_key('../../keys/bitstamp.key')
-    # for res in grequests.map([engine.get_balance(['btc', 'eth'])]):
-    #     print(res.parsed
-    #     pass    
-    for res in grequests.map([engine.get_ticker_lastPrice('btcusd')]):
-        print(res.parsed)
-    pass    
-    # for res in grequests.map([engine.get_ticker_orderBook_innermost('ethbtc')]):
-    #     print(res.parsed
-    #     pass
-    # for res in grequests.map([engine.get_open_order()]):
-    #     print(res.parsed
-    #     pass    
-    # for res in grequests.map([engine.place_order("ethbtc", "ask", 0.5, 0.5)]):
-    #     print(res.json()
-    #     #print(res.parsed/
-    #     pass    
-    # for res in grequests.map([engine.cancel_order('624731173')]):
-    #     print(res.json()
-    #     #print(res.parsed
-    #     pass       
-    # for res in grequests.map([engine.withdraw('eth', 500, '0xC257274276a4E539741Ca11b590B9447B26A8051')]):
-    #     print(res.json()
-    #     #print(res.parsed
-    #     pass       
\ No newline at end of file
+    engine = ExchangeEngine('../../keys/bitstamp.key')
+
+    async def main():
+        try:
+            print(await engine.get_ticker_lastPrice('btcusd'))
+            # print(await engine.get_balance(['btc', 'eth']))
+            # print(await engine.get_ticker_orderBook_innermost('ethbtc'))
+            # print(await engine.get_open_order())
+            # print(await engine.place_order('ethbtc', 'ask', 0.5, 0.5))
+            # print(await engine.cancel_order('624731173'))
+            # print(await engine.withdraw('eth', 500, '0xC257274276a4E539741Ca11b590B9447B26A8051'))
+        finally:
+            await engine.end_engine()
+
+    asyncio.run(main())
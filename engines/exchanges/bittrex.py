@@ -3,98 +3,83 @@
 
 '''
 
+import asyncio
+from base import ExchangeException
 from mod_imports import *
+from typing import Dict, List
 
 class ExchangeEngine(ExchangeEngineBase):
-    def __init__(self):
-        self.API_URL = 'https://bittrex.com/api'
+    # 60 calls per minute, public and private ones together
+    rateLimits = {'api': (1, 5)}
+    marketDataBucket = 'api'
+
+    def __init__(self, filename):
         self.apiVersion = 'v1.1'
         self.sleepTime = 5
         self.feeRatio = 0.0026
-        self.async = True
-                  
-    def _send_request(self, command, httpMethod, params={}, hook=None):          
-        command = '/{0}/{1}'.format(self.apiVersion, command)
 
+        self.load_key(filename)
+        self.API_URL = self.key.get('api_url', 'https://bittrex.com/api')
+
+        self.signer = hmac.new(self.key['private'].encode('utf8'), digestmod=hashlib.sha512)
+        self.warmUpPath = '/v1.1/public/getmarketsummary?market=BTC-ETH'
+
+        # Creation of the client session to use
+        self.client_session = None
+
+    async def _send_request(self, command: str, httpMethod: str, params={}, lane: str = 'marketData'):
+        command = '/{0}/{1}'.format(self.apiVersion, command)
         url = self.API_URL + command
-        
-        if httpMethod == "GET":
-            R = grequests.get
-        elif httpMethod == "POST":
-            R = grequests.post       
-        
+
         headers = {}
-        
         if not any(x in command for x in ['Public', 'public']):
             nonce = str(int(1000*time.time()))
             url = url + '{0}apikey={1}&nonce={2}'.format('&' if '?' in url else '?', self.key['public'], nonce)
-            
-            secret = self.key['private']
-            
-            signature = hmac.new(secret.encode('utf8'), url.encode('utf8'), hashlib.sha512)
-            signature = signature.hexdigest()
-            
+
+            # apisign = HMAC-SHA512 of the full URL
+            signature = self.signer.copy()
+            signature.update(url.encode('utf8'))
             headers = {
-                'apisign': signature,
-            }        
-
-        args = {'data': params, 'headers': headers}
-        if hook:
-            args['hooks'] = dict(response=hook)
-            
-        req = R(url, **args)
-        
-        if self.async:
-            return req
-        else:
-            response = grequests.map([req])[0].json()
-            
-            if 'error' in response:
-                print(response)
-            return response
-    '''
-        return in r.parsed, showing all and required tickers
+                'apisign': signature.hexdigest(),
+            }
+
+        content = await self.request(httpMethod, url, 'api', lane, data=params if httpMethod == 'POST' else None, headers=headers)
+
+        if not content.get('success', False):
+            raise ExchangeException(content.get('message'))
+        return content['result']
+
+    async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
+        '''
+        Return the available balance of the tickers given by the caller, or of all
+        the tickers when none is given.
+
         {
             'ETH': 0.005,
             'OMG': 0
         }
-    '''    
-    def get_balance(self, tickers=[]):
-        return self._send_request('account/getbalances', 'GET', {}, [self.hook_getBalance(tickers=tickers)])
-    
-    def hook_getBalance(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            
-
-            if factory_kwargs['tickers']:
-                json['result'] = filter(lambda ticker: ticker['Currency'].upper() in factory_kwargs['tickers'], json['result'])
-                
-            for ticker in json['result']:
-                r.parsed[ticker['Currency'].upper()] = float(ticker['Available'])
-                                  
-        return res_hook    
-    
-    '''
-        return USDT in r.parsed
+        '''
+        balances = await self._send_request('account/getbalances', 'GET', lane='account')
+
+        return {balance['Currency'].upper(): float(balance['Available']) for balance in balances
+                if not tickers or balance['Currency'].upper() in tickers}
+
+    async def get_ticker_lastPrice(self, ticker: str) -> Dict[str, float]:
+        '''
+        Get the last price in USDT of a ticker
+
         {
-            'BTC': 18000    
+            'BTC': 18000
         }
-    '''       
-    def get_ticker_lastPrice(self, ticker):
-         return self._send_request('public/getticker?market=USDT-{0}'.format(ticker), 'GET', {}, [self.hook_lastPrice(ticker=ticker)])
-
-    def hook_lastPrice(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            r.parsed[factory_kwargs['ticker']] = json['result']['Last']
-                                  
-        return res_hook    
-
-    '''
-        return in r.parsed
+        '''
+        result = await self._send_request('public/getticker?market=USDT-{0}'.format(ticker), 'GET')
+
+        return {ticker: float(result['Last'])}
+
+    async def get_ticker_orderBook_innermost(self, ticker: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Get the best bid and ask of a ticker pair
+
         {
             'bid': {
                 'price': 0.02202,
@@ -103,77 +88,108 @@ class ExchangeEngine(ExchangeEngineBase):
             'ask': {
                 'price': 0.02400,
                 'amount': 103.2
-            },           
+            }
+        }
+        '''
+        result = await self._send_request('public/getorderbook?type=both&market={0}'.format(ticker), 'GET')
+
+        return {
+            'bid': {
+                'price': float(result['buy'][0]['Rate']),
+                'amount': float(result['buy'][0]['Quantity'])
+            },
+            'ask': {
+                'price': float(result['sell'][0]['Rate']),
+                'amount': float(result['sell'][0]['Quantity'])
+            }
+        }
+
+    async def get_ticker_orderBook_depth(self, ticker: str, count: int) -> Dict[str, List[List[float]]]:
+        '''
+        Get the first levels of the order book of a ticker pair, best level first
+
+        {
+            'bids': [[0.02202, 1103.5148], [0.02201, 12.5]],
+            'asks': [[0.02400, 103.2], [0.02410, 50.0]]
+        }
+        '''
+        result = await self._send_request('public/getorderbook?type=both&market={0}'.format(ticker), 'GET')
+
+        return {
+            'bids': [[float(level['Rate']), float(level['Quantity'])] for level in result['buy'][:count]],
+            'asks': [[float(level['Rate']), float(level['Quantity'])] for level in result['sell'][:count]]
         }
-    '''       
-    def get_ticker_orderBook_innermost(self, ticker):
-        return self._send_request('public/getorderbook?type=both&market={0}'.format(ticker), 'GET', {}, self.hook_orderBook)     
-     
-    def hook_orderBook(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        #print(json
-        r.parsed = {
-                    'bid':  {
-                             'price': float(json['result']['buy'][0]['Rate']),
-                             'amount': float(json['result']['buy'][0]['Quantity'])
-                            },
-                    'ask':  {
-                             'price': float(json['result']['sell'][0]['Rate']),
-                             'amount': float(json['result']['sell'][0]['Quantity'])
-                            }
-                    }    
-        
-    '''
-        return in r.parsed
+
+    async def get_products(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of the products that can be traded on the exchange, the
+        currencies being named as in the balances
+
+        [
+            {
+                'pair': 'BTC-ETH',
+                'base': 'ETH',
+                'quote': 'BTC'
+            }
+        ]
+        '''
+        markets = await self._send_request('public/getmarkets', 'GET')
+
+        return [{'pair': market['MarketName'], 'base': market['MarketCurrency'], 'quote': market['BaseCurrency']}
+                for market in markets if market.get('IsActive', True)]
+
+    async def get_open_order(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of open orders currently existing
+
         [
             {
-                'orderId': 1242424
+                'orderId': '9faa6b5b-6709-4435-aec8-fe96f1fa32bb'
             }
         ]
-    '''           
-    def get_open_order(self):
-        return self._send_request('market/getopenorders', 'GET', {}, self.hook_openOrder)
-    
-    def hook_openOrder(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        r.parsed = []
-        for order in json['result']:
-            r.parsed.append({'orderId': str(order['OrderUuid']), 'created': order['Opened']})
-
-        
-    '''
+        '''
+        orders = await self._send_request('market/getopenorders', 'GET', lane='account')
+
+        return [{'orderId': str(order['OrderUuid']), 'created': order['Opened']} for order in orders]
+
+    async def place_order(self, ticker: str, action: str, amount: float, price: float):
+        '''
         ticker: 'ETH-ETC'
         action: 'bid' or 'ask'
         amount: 700
         price: 0.2
-    '''
-    def place_order(self, ticker, action, amount, price):
-        action = 'buy' if action == 'bid' else 'sell'
-        if action == 'buy':
+
+        Return the ID of the order as listed by get_open_order: {'orderId': '9faa6b5b-6709-4435-aec8-fe96f1fa32bb'}
+        '''
+        if action == 'bid':
             cmd = 'market/buylimit?market={0}&quantity={1}&rate={2}'.format(ticker, amount, price)
         else:
             cmd = 'market/selllimit?market={0}&quantity={1}&rate={2}'.format(ticker, amount, price)
-        return self._send_request(cmd, 'GET')    
-    
-    def cancel_order(self, orderID):
-        return self._send_request('market/cancel?uuid={0}'.format(orderID), 'GET')
-    
-    def withdraw(self, ticker, amount, address):
-        return self._send_request('account/withdraw?currency={0}&quantity={1}&address={2}'.format(ticker, amount, address), 'GET')
-    
-    
+        result = await self._send_request(cmd, 'GET', lane='orders')
+        return {'orderId': str(result['uuid'])}
+
+    async def cancel_order(self, orderID):
+        return await self._send_request('market/cancel?uuid={0}'.format(orderID), 'GET', lane='orders')
+
+    async def withdraw(self, ticker, amount, address):
+        return await self._send_request('account/withdraw?currency={0}&quantity={1}&address={2}'.format(ticker, amount, address), 'GET', lane='orders')
+
+    async def get_ticker_history(self, ticker):
+        raise NotImplementedError("This function seems not needed for Triangular arbitrage")
+
+
 if __name__ == "__main__":
-    engine = ExchangeEngine()
-    engine.load_key('../../keys/bittrex.key')
-    # for res in grequests.map([engine.get_ticker_orderBook_innermost('ETH-OMG')]):
-    #     print(res.parsed
-    #     pass
-    for res in grequests.map([engine.get_ticker_lastPrice('LTC')]):
-        print(res.parsed)
-        pass    
-    #print(engine.get_ticker_orderBook('ETH-OMG')
-    #print(engine.parseTickerData(engine.get_ticker_history('XRPUSD'))
-    #print(engine.place_order('ETH-OMG', 'bid', 10, 0.01)
-    #print(engine.withdraw('ETH', 500, '0x54A82261bAAc1357069E23d953F8dbC8BD2A54F4')
-    #print(engine.get_open_order()
-    #print(engine.cancel_order('9faa6b5b-6709-4435-aec8-fe96f1fa32bb')
\ No newline at end of file
+    engine = ExchangeEngine('../../keys/bittrex.key')
+
+    async def main():
+        try:
+            print(await engine.get_ticker_lastPrice('LTC'))
+            # print(await engine.get_ticker_orderBook_innermost('ETH-OMG'))
+            # print(await engine.place_order('ETH-OMG', 'bid', 10, 0.01))
+            # print(await engine.withdraw('ETH', 500, '0x54A82261bAAc1357069E23d953F8dbC8BD2A54F4'))
+            # print(await engine.get_open_order())
+            # print(await engine.cancel_order('9faa6b5b-6709-4435-aec8-fe96f1fa32bb'))
+        finally:
+            await engine.end_engine()
+
+    asyncio.run(main())
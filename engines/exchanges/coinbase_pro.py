@@ -17,19 +17,24 @@ import asyncio
 from datetime import datetime, timedelta
 import calendar
 from base import ExchangeException
+from coinbase_pro_feed import CoinbaseProFeed
 from mod_imports import *
 from typing import Dict, List
 import time
 
 class ExchangeEngine(ExchangeEngineBase):
+    # Requests per second and burst, by IP for the public endpoints and by profile for the private ones
+    rateLimits = {'public': (10, 15), 'private': (15, 30)}
+    productPaths = ('products',)
+
     def __init__(self, filename):
-        self.API_URL = "https://api.exchange.coinbase.com"
-        # self.API_URL = "https://api-public.sandbox.exchange.coinbase.com"
         self.apiVersion = 'v1.0'
         self.feeRatio = float(0.0050)
         self.sleepTime = 5
 
         self.load_key(filename)
+        # The sandbox (https://api-public.sandbox.exchange.coinbase.com) or a local mock can be used instead
+        self.API_URL = self.key.get('api_url', "https://api.exchange.coinbase.com")
 
         # Try to get the api_key, the passphrase and the secret key
         self.api_key = self.key.get("api_key", "")
@@ -46,14 +51,19 @@ class ExchangeEngine(ExchangeEngineBase):
             'CB-ACCESS-PASSPHRASE': self.passphrase
         }
 
+        self.sessionHeaders = self.fix_headers
+
+        # The secret is decoded and the HMAC key schedule computed only once
+        self.signer = hmac.new(base64.b64decode(self.secret_key), digestmod=hashlib.sha256)
+        self.warmUpPath = '/time'
+
         # Creation of the client session to use
         self.client_session = None
 
-    async def _send_request(self, command: str, httpMethod: str, params={}):
-        # Create the client session if not existing
-        if self.client_session is None:
-            self.client_session = aiohttp.ClientSession(headers=self.fix_headers)
+        # Account ID of each currency, listed on the first balance request
+        self.account_ids = None
 
+    async def _send_request(self, command: str, httpMethod: str, params={}, lane: str = "marketData"):
         # Create the command
         full_cmd = f"/{command}"
         # Put the HTTP method in uppercase
@@ -74,8 +84,8 @@ class ExchangeEngine(ExchangeEngineBase):
 
         # Convert to bytes
         message_bytes = message.encode('ascii')
-        hmac_key = base64.b64decode(self.secret_key)
-        signature = hmac.new(hmac_key, message_bytes, hashlib.sha256)
+        signature = self.signer.copy()
+        signature.update(message_bytes)
         signature_b64 = base64.b64encode(signature.digest()).decode('utf-8')
 
         additional_headers = {
@@ -83,15 +93,35 @@ class ExchangeEngine(ExchangeEngineBase):
             'CB-ACCESS-TIMESTAMP': timestamp
         }
 
-        # Send the request
-        response = await self.client_session.request(upper_method, f"{self.API_URL}{full_cmd}", data=msg_body, headers=additional_headers)
+        # The market data endpoints are public, they have their own rate limit
+        bucket = "public" if full_cmd.startswith("/products") or full_cmd == "/time" else "private"
+
+        # Send the request and get the answer as dictionary
+        content = await self.request(upper_method, f"{self.API_URL}{full_cmd}", bucket, lane, data=msg_body, headers=additional_headers)
 
-        # Get the answer as dictionary
-        async with response:
-            content = await response.json()
+        # The errors are answered with their message only
+        if isinstance(content, dict) and list(content) == ["message"]:
+            raise ExchangeException(content["message"])
 
         return content
   
+    async def get_account_ids(self) -> Dict[str, str]:
+        '''
+        Return the account ID of each currency, the accounts are only listed on the
+        first call and then kept in cache.
+
+        The result is a dictionnary, looking like the following:
+
+        {
+            'ETH': '71452118-efc7-4cc4-8780-a5e22d4baa53',
+            'XRP': 'e316cb9a-0808-4fd7-8914-97829c1925de'
+        }
+        '''
+        if self.account_ids is None:
+            accounts_list = await self._send_request("accounts", "GET", lane="account")
+            self.account_ids = {account["currency"]: account["id"] for account in accounts_list}
+        return self.account_ids
+
     async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
         '''
         Return the balance of all the tickers given by the caller. A ticker is the unique
@@ -105,26 +135,18 @@ class ExchangeEngine(ExchangeEngineBase):
             'XRP': 1.5
         }
         '''
-        # Create the resulting dict
-        result = {}
-
-        # Send the request allowing to get all accounts
-        accounts_list = await self._send_request("accounts", "GET")
-
-        # Check along the accounts to retrieve the ticker
-        for account in accounts_list:
-            if account["currency"] in tickers:
-                # If it is part of the tickers wanted add it in the dict
-                result[account["currency"]] = float(account["balance"])
-                # Check if we have all our tickers
-                if len(result) == len(tickers):
-                    break
+        # Get the account of each ticker from the cache
+        account_ids = await self.get_account_ids()
 
         # Raise an exception if we did not found all the tickers
-        if len(result) != len(tickers):
+        if any(ticker not in account_ids for ticker in tickers):
             raise ExchangeException("One of the ticker balance has not been found!")
-        else:
-            return result
+
+        # Only request the accounts wanted
+        accounts = await asyncio.gather(
+            *[self._send_request(f"accounts/{account_ids[ticker]}", "GET", lane="account") for ticker in tickers])
+
+        return {ticker: float(account["balance"]) for ticker, account in zip(tickers, accounts)}
     
     async def get_ticker_history(self, ticker):
         raise NotImplementedError("This function seems not needed for Triangular arbitrage")
@@ -186,6 +208,89 @@ class ExchangeEngine(ExchangeEngineBase):
 
         return result
 
+    async def get_ticker_orderBook_depth(self, ticker_pair: str, depth: int) -> Dict[str, List[List[float]]]:
+        '''
+        Get the first levels of the order book for a ticker pair, best level first.
+        A ticker pair looks like that: "XLM-BTC", "BTC-EUR", etc.
+
+        The result is a dictionnary, looking like the following:
+
+        {
+            'bids': [[0.02202, 1103.5148], [0.02201, 12.5]],
+            'asks': [[0.02400, 103.2], [0.02410, 50.0]]
+        }
+        '''
+        # The level 2 book gives the 50 best aggregated levels of each side
+        book = await self._send_request(f"products/{ticker_pair}/book?level=2", "GET")
+
+        return {
+            "bids": [[float(price), float(amount)] for price, amount, _ in book["bids"][:depth]],
+            "asks": [[float(price), float(amount)] for price, amount, _ in book["asks"][:depth]]
+        }
+
+    async def get_products(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of the products that can be traded on the exchange.
+
+        The result is a list, looking like the following:
+
+        [
+            {
+                'pair': 'ADA-ETH',
+                'base': 'ADA',
+                'quote': 'ETH'
+            }
+        ]
+        '''
+        # Get all the products of the exchange
+        products = await self._send_request("products", "GET")
+
+        # Keep only the products that can currently be traded
+        result = []
+        for product in products:
+            if product.get("trading_disabled", False) or product.get("status", "online") != "online":
+                continue
+            result.append({
+                "pair": product["id"],
+                "base": product["base_currency"],
+                "quote": product["quote_currency"]
+            })
+
+        return result
+
+    async def get_product_details(self) -> List[Dict[str, str]]:
+        '''
+        Return the trading rules of all the products of the exchange. The sizes are
+        given as received, in strings, so that their number of decimals is kept.
+
+        The result is a list, looking like the following:
+
+        [
+            {
+                'pair': 'ADA-ETH',
+                'tickSize': '0.00000001',   # price increment, in the quote currency
+                'lotSize': '0.1',           # amount increment, in the base currency
+                'minSize': '1',
+                'maxSize': '1000000',       # None when not limited
+                'minFunds': '0.0001',       # minimum amount * price, None when not limited
+                'tradable': True
+            }
+        ]
+        '''
+        products = await self._send_request("products", "GET")
+
+        return [{
+            "pair": product["id"],
+            "tickSize": product["quote_increment"],
+            "lotSize": product["base_increment"],
+            "minSize": product.get("base_min_size") or product["base_increment"],
+            "maxSize": product.get("base_max_size"),
+            "minFunds": product.get("min_market_funds"),
+            # Post only products reject the limit orders crossing the book, as placed here
+            "tradable": product.get("status", "online") == "online" and not product.get("trading_disabled", False)
+                        and not product.get("cancel_only", False) and not product.get("post_only", False)
+        } for product in products]
+
     async def get_open_order(self) -> List[Dict[str, float]]:
         '''
         Return the list of open orders currently existing
@@ -202,7 +307,7 @@ class ExchangeEngine(ExchangeEngineBase):
         result = []
 
         # Get the list of orders
-        orders = await self._send_request("orders?limit=100", "GET")
+        orders = await self._send_request("orders?limit=100", "GET", lane="account")
 
         # For each order just save the ID
         for order in orders:
@@ -221,6 +326,8 @@ class ExchangeEngine(ExchangeEngineBase):
         action: 'bid' or 'ask'
         amount: 700
         price: 0.2
+
+        Return the ID of the order as listed by get_open_order: {'orderId': '1242424'}
         '''
         # Define the action wanted
         action = 'buy' if action == 'bid' else 'sell'
@@ -234,17 +341,22 @@ class ExchangeEngine(ExchangeEngineBase):
             "size": str(amount)
         }
         
-        return await self._send_request("orders", "POST", params=req_body)
+        order = await self._send_request("orders", "POST", params=req_body, lane="orders")
+        return {"orderId": str(order["id"])}
 
     async def cancel_order(self, orderID):
         '''
         Function allowing to cancel an order that has been previously open
         '''
-        return await self._send_request(f"orders/{orderID}", "DELETE")
+        return await self._send_request(f"orders/{orderID}", "DELETE", lane="orders")
 
-    async def end_engine(self):
-        if self.client_session is not None:
-            await self.client_session.close()
+    def create_feed(self, ticker_pairs: List[str]) -> CoinbaseProFeed:
+        '''
+        Create a WebSocket feed keeping the order books of the ticker pairs in memory.
+        The feed has to be started, it then offers the same get_ticker_orderBook_innermost
+        and get_ticker_orderBook_depth functions as the engine.
+        '''
+        return CoinbaseProFeed(ticker_pairs)
 
 if __name__ == "__main__":
     engine = ExchangeEngine('keys/coinbasepro_sandbox.key')
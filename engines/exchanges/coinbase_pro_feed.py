@@ -0,0 +1,239 @@
+'''
+Coinbase Pro market data received over WebSocket.
+
+The feed subscribes to the level2 and ticker channels and keeps a local order
+book per product: the snapshot message initializes the book, the l2update
+messages are applied on top of it. When a book message carrying a sequence
+number is not the next one for its product, the product is resubscribed to get
+a fresh snapshot. The innermost order book can then be read from memory,
+without any network round trip.
+'''
+
+import asyncio
+import json
+from typing import Dict, List
+import aiohttp
+# Puts the modules of the adapters on the path
+import engines.exchanges.loader
+from base import ExchangeException
+from engines.order_book import OrderBook
+from utils.logging import crypto_arb_log
+
+
+class CoinbaseProFeed(object):
+    def __init__(self, productIds: List[str], url: str = 'wss://ws-feed.exchange.coinbase.com',
+                 timeout: float = 10):
+        '''
+        timeout: time a book is waited for while it is not synchronized, in seconds
+        '''
+        self.url = url
+        self.productIds = list(productIds)
+        self.reconnectDelay = 1
+        self.timeout = timeout
+
+        self.books = {productId: OrderBook() for productId in self.productIds}
+        self.synced = {productId: asyncio.Event() for productId in self.productIds}
+        self.sequences = {}
+        self.lastPrices = {}
+        # Functions called with the product ID each time the top of its book changes
+        self.listeners = []
+
+        self.ws = None
+        self.task = None
+
+    def start(self):
+        '''
+        Start receiving the market data in the background
+        '''
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        '''
+        Keep a connection to the feed, reconnecting and resynchronizing all the
+        books when it is lost
+        '''
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    async with session.ws_connect(self.url, heartbeat=30) as ws:
+                        self.ws = ws
+                        await self._subscribe(self.productIds)
+                        async for msg in ws:
+                            if msg.type == aiohttp.WSMsgType.TEXT:
+                                await self.handle_message(json.loads(msg.data))
+                            elif msg.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                crypto_arb_log.error('Coinbase Pro feed: {0}'.format(err))
+            except Exception as err:
+                # A malformed message must not stop the feed for good, the books are resynchronized below
+                crypto_arb_log.error('Coinbase Pro feed: unexpected error {0!r}'.format(err))
+
+            self.ws = None
+            for productId in self.productIds:
+                self._unsync(productId)
+            await asyncio.sleep(self.reconnectDelay)
+
+    async def _subscribe(self, productIds: List[str], msgType: str = 'subscribe'):
+        await self.ws.send_str(json.dumps({
+            'type': msgType,
+            'product_ids': productIds,
+            'channels': ['level2', 'ticker']
+        }))
+
+    async def _wait_synced(self, productId: str):
+        try:
+            await asyncio.wait_for(self.synced[productId].wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ExchangeException('Book of {0} not synchronized after {1} s'.format(productId, self.timeout))
+
+    def _unsync(self, productId: str):
+        self.synced[productId].clear()
+        self.sequences.pop(productId, None)
+
+    async def resync(self, productId: str):
+        '''
+        Drop the local book of a product and subscribe again to get a new snapshot
+        '''
+        crypto_arb_log.info('Coinbase Pro feed: resynchronizing {0}'.format(productId))
+        self._unsync(productId)
+        if self.ws is not None:
+            await self._subscribe([productId], 'unsubscribe')
+            await self._subscribe([productId])
+
+    async def handle_message(self, msg: Dict):
+        msgType = msg.get('type')
+        productId = msg.get('product_id')
+
+        if msgType == 'error':
+            crypto_arb_log.error('Coinbase Pro feed: {0}'.format(msg.get('message')))
+            return
+        if productId not in self.books:
+            return
+
+        if msgType in ('snapshot', 'l2update'):
+            sequence = msg.get('sequence')
+            if msgType == 'snapshot':
+                self.books[productId].load_snapshot(msg['bids'], msg['asks'])
+                self.synced[productId].set()
+                self._notify(productId)
+            elif not self.synced[productId].is_set():
+                # Updates received before the snapshot are already part of it
+                return
+            elif sequence is not None and productId in self.sequences:
+                if sequence <= self.sequences[productId]:
+                    return
+                if sequence != self.sequences[productId] + 1:
+                    await self.resync(productId)
+                    return
+                self._apply_changes(productId, msg['changes'])
+            else:
+                self._apply_changes(productId, msg['changes'])
+            if sequence is not None:
+                self.sequences[productId] = sequence
+
+        elif msgType == 'ticker':
+            self.lastPrices[productId] = float(msg['price'])
+
+    def _apply_changes(self, productId: str, changes: List[List[str]]):
+        book = self.books[productId]
+        before = (book.best_bid(), book.best_ask())
+        for side, price, size in changes:
+            book.update('bid' if side == 'buy' else 'ask', float(price), float(size))
+        if (book.best_bid(), book.best_ask()) != before:
+            self._notify(productId)
+
+    def _notify(self, productId: str):
+        # A failing listener must not stop the feed nor the other listeners
+        for listener in self.listeners:
+            try:
+                listener(productId)
+            except Exception as e:
+                crypto_arb_log.error('Coinbase Pro feed listener failed on {0}: {1}'.format(productId, e))
+
+    async def get_ticker_orderBook_innermost(self, ticker_pair: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Return the best bid and ask of a product from the local book, with the same
+        format as the adapter. Only waits when the book is not synchronized yet,
+        up to timeout seconds.
+        '''
+        await self._wait_synced(ticker_pair)
+        book = self.books[ticker_pair].innermost()
+        if book is None:
+            raise ExchangeException('Empty side in the book of {0}'.format(ticker_pair))
+        return book
+
+    async def get_ticker_orderBook_depth(self, ticker_pair: str, depth: int) -> Dict[str, List[List[float]]]:
+        '''
+        Return the first levels of the local book of a product, best level first
+        '''
+        await self._wait_synced(ticker_pair)
+        return self.books[ticker_pair].depth(depth)
+
+    async def get_books_batch(self, pairs: List[str], depth: int) -> Dict[str, Dict[str, List[List[float]]]]:
+        '''
+        Return the first levels of the local books of several products, with the
+        same format as the adapter
+        '''
+        responses = await asyncio.gather(
+            *[self.get_ticker_orderBook_depth(pair, depth) for pair in pairs], return_exceptions=True)
+        return dict(zip(pairs, responses))
+
+
+if __name__ == '__main__':
+    from aiohttp import web
+
+    # Local fake feed replaying canned messages, the first replay skips a sequence number
+    canned = [
+        {'type': 'snapshot', 'product_id': 'ETH-BTC', 'sequence': 10,
+         'bids': [['0.0699', '4.0'], ['0.0698', '10.0']], 'asks': [['0.0700', '3.0'], ['0.0701', '8.0']]},
+        {'type': 'l2update', 'product_id': 'ETH-BTC', 'sequence': 11, 'changes': [['buy', '0.06995', '1.5']]},
+        {'type': 'l2update', 'product_id': 'ETH-BTC', 'sequence': 13, 'changes': [['sell', '0.0700', '0']]}
+    ]
+    resynced = [
+        {'type': 'snapshot', 'product_id': 'ETH-BTC', 'sequence': 20,
+         'bids': [['0.06995', '1.5'], ['0.0699', '4.0']], 'asks': [['0.0701', '8.0']]},
+        {'type': 'l2update', 'product_id': 'ETH-BTC', 'sequence': 21, 'changes': [['sell', '0.07005', '2.0']]},
+        {'type': 'ticker', 'product_id': 'ETH-BTC', 'sequence': 22, 'price': '0.06997'}
+    ]
+
+    async def fake_feed(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        subscriptions = 0
+        async for msg in ws:
+            request = json.loads(msg.data)
+            print('server received', request['type'], request['product_ids'])
+            if request['type'] == 'subscribe':
+                for message in canned if subscriptions == 0 else resynced:
+                    await ws.send_str(json.dumps(message))
+                subscriptions += 1
+        return ws
+
+    async def main():
+        app = web.Application()
+        app.router.add_get('/', fake_feed)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 8765)
+        await site.start()
+
+        feed = CoinbaseProFeed(['ETH-BTC'], 'ws://127.0.0.1:8765/')
+        feed.start()
+        await asyncio.sleep(0.5)
+        print(await feed.get_ticker_orderBook_innermost('ETH-BTC'), feed.lastPrices)
+        await feed.stop()
+        await runner.cleanup()
+
+    asyncio.run(main())
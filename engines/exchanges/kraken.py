@@ -11,184 +11,267 @@
     0.00%    0.10%    > 10,000,000
 '''
 
+import asyncio
 from datetime import datetime, timedelta
 import calendar
+from base import ExchangeException
 from mod_imports import *
+from typing import Dict, List
 
 class ExchangeEngine(ExchangeEngineBase):
-    def __init__(self):
-        self.API_URL = 'https://api.kraken.com'
+    # Public calls are limited to about 1 per second. Private calls increase a counter
+    # decaying by 0.33 per second and limited to 15 (starter tier), the orders have
+    # their own counter decaying by 1 per second and limited to 60.
+    rateLimits = {'public': (1, 3), 'private': (0.33, 15), 'orders': (1, 60)}
+
+    def __init__(self, filename):
         self.apiVersion = '0'
         self.feeRatio = 0.0026
         self.sleepTime = 5
-        self.async = True
-                  
-    def _send_request(self, command, httpMethod, params={}, hook=None):          
-        command = '/{0}/{1}'.format(self.apiVersion, command)
 
+        self.load_key(filename)
+        self.API_URL = self.key.get('api_url', 'https://api.kraken.com')
+
+        # The secret is decoded and the HMAC key schedule computed only once
+        self.signer = hmac.new(base64.b64decode(self.key['private']), digestmod=hashlib.sha512)
+        self.warmUpPath = '/0/public/Time'
+
+        # Creation of the client session to use
+        self.client_session = None
+
+    async def _send_request(self, command: str, httpMethod: str, params={}, lane: str = 'marketData'):
+        command = '/{0}/{1}'.format(self.apiVersion, command)
         url = self.API_URL + command
 
-        if httpMethod == "GET":
-            R = grequests.get
-        elif httpMethod == "POST":
-            R = grequests.post          
-        
         headers = {}
+        bucket = 'public'
         if not any(x in command for x in ['Public', 'public']):
-            secret = self.key['private']
-      
+            bucket = 'orders' if any(x in command for x in ['AddOrder', 'CancelOrder']) else 'private'
+            params = dict(params)
             params['nonce'] = int(1000*time.time())
-    
-            message = command + hashlib.sha256(str(params['nonce']) + urllib.urlencode(params)).digest()
-            signature = hmac.new(base64.b64decode(secret), message, hashlib.sha512)
-    
+            postdata = urllib.parse.urlencode(params)
+
+            # API-Sign = HMAC-SHA512 of (URI path + SHA256(nonce + POST data)) with the base64 decoded secret
+            message = command.encode() + hashlib.sha256((str(params['nonce']) + postdata).encode()).digest()
+            signature = self.signer.copy()
+            signature.update(message)
+
             headers = {
                 'API-Key': self.key['public'],
-                'API-Sign': base64.b64encode(signature.digest())
-            }          
-        
-        args = {'data': params, 'headers': headers}
-        if hook:
-            args['hooks'] = dict(response=hook)
-        
-        req = R(url, **args)
-        if self.async:
-            return req
-        else:
-            response = grequests.map([req])[0].json()
-
-        if 'error' in response:
-            print(response)
-        return response
-  
-    def get_balance(self, tickers=[]):
-        return self._send_request('private/Balance', 'POST', {}, [self.hook_getBalance(tickers=tickers)]) 
-    
-    def hook_getBalance(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            
-            if factory_kwargs['tickers']:
-               filtered = filter(lambda ticker: ticker.upper() in factory_kwargs['tickers'], json['result'])
-            else:
-                filtered = json['result']
-
-            for ticker in filtered:
-                r.parsed[ticker.upper()] = float(json['result'][ticker])
-                                  
-        return res_hook       
-
-    def get_ticker_orderBook_innermost(self, ticker): 
-        return self._send_request('public/Depth?pair={0}&count=1'.format(ticker), 'GET', {}, self.hook_orderBook)  
-
-    def hook_orderBook(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        ticker = next(iter(json['result']))
-        result = json['result'][ticker]
-        r.parsed = {
-            'bid':  {
-                'price': float(result['bids'][0][0]),
-                'amount': float(result['bids'][0][1])
+                'API-Sign': base64.b64encode(signature.digest()).decode()
+            }
+
+        content = await self.request(httpMethod, url, bucket, lane, data=params if httpMethod == 'POST' else None, headers=headers)
+
+        if content.get('error'):
+            raise ExchangeException(content['error'])
+        return content['result']
+
+    async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
+        '''
+        Return the balance of the tickers given by the caller, or of all the tickers
+        when none is given.
+
+        {
+            'XETH': 0.005,
+            'XXBT': 0
+        }
+        '''
+        balances = await self._send_request('private/Balance', 'POST', lane='account')
+
+        return {ticker.upper(): float(amount) for ticker, amount in balances.items()
+                if not tickers or ticker.upper() in tickers}
+
+    async def get_ticker_orderBook_innermost(self, ticker: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Get the best bid and ask of a ticker pair
+
+        {
+            'bid': {
+                'price': 0.02202,
+                'amount': 1103.5148
             },
-            'ask':  {
-                'price': float(result['asks'][0][0]),
-                'amount': float(result['asks'][0][1])
+            'ask': {
+                'price': 0.02400,
+                'amount': 103.2
             }
         }
+        '''
+        result = await self._send_request('public/Depth?pair={0}&count=1'.format(ticker), 'GET')
+        book = next(iter(result.values()))
 
-    def get_open_order(self):
-        return self._send_request('private/OpenOrders', 'POST', {}, self.hook_openOrder)
-
-    def hook_openOrder(self, r, *r_args, **r_kwargs):
-        json = r.json()
-        r.parsed = []
-        for order in json['result']:
-            r.parsed.append({'orderId': str(order['OrderUuid']), 'created': order['Opened']})
- 
-    
-    def cancel_order(self, orderID):
-        return self._send_request('private/CancelOrder', 'POST', {'txid': orderID})
-    
-    def withdraw(self, ticker, withdrawalKey, amount):
-        return self._send_request('private/Withdraw', 'POST', {'asset ': ticker, 'key': withdrawalKey, 'amount': amount})
-        
-    
-    '''
+        return {
+            'bid': {
+                'price': float(book['bids'][0][0]),
+                'amount': float(book['bids'][0][1])
+            },
+            'ask': {
+                'price': float(book['asks'][0][0]),
+                'amount': float(book['asks'][0][1])
+            }
+        }
+
+    async def get_ticker_orderBook_depth(self, ticker: str, count: int) -> Dict[str, List[List[float]]]:
+        '''
+        Get the first levels of the order book of a ticker pair, best level first
+
+        {
+            'bids': [[0.02202, 1103.5148], [0.02201, 12.5]],
+            'asks': [[0.02400, 103.2], [0.02410, 50.0]]
+        }
+        '''
+        result = await self._send_request('public/Depth?pair={0}&count={1}'.format(ticker, count), 'GET')
+        book = next(iter(result.values()))
+
+        return {
+            'bids': [[float(level[0]), float(level[1])] for level in book['bids']],
+            'asks': [[float(level[0]), float(level[1])] for level in book['asks']]
+        }
+
+    async def get_products(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of the products that can be traded on the exchange, the
+        currencies being named as in the balances. The name is the usual
+        one, without the X and Z prefixes.
+
+        [
+            {
+                'pair': 'XETHXXBT',
+                'base': 'XETH',
+                'quote': 'XXBT',
+                'name': 'ETH/XBT'
+            }
+        ]
+        '''
+        result = await self._send_request('public/AssetPairs', 'GET')
+
+        # The dark pool pairs (.d suffix) have no wsname and are not traded here
+        return [{'pair': pair, 'base': product['base'], 'quote': product['quote'], 'name': product['wsname']}
+                for pair, product in result.items()
+                if 'wsname' in product and product.get('status', 'online') == 'online']
+
+    async def get_product_details(self) -> List[Dict[str, str]]:
+        '''
+        Return the trading rules of all the pairs of the exchange, the sizes in strings
+
+        [
+            {
+                'pair': 'XETHXXBT',
+                'tickSize': '0.00001',
+                'lotSize': '0.00000001',
+                'minSize': '0.01',
+                'maxSize': None,
+                'minFunds': '0.00002',
+                'tradable': True
+            }
+        ]
+        '''
+        result = await self._send_request('public/AssetPairs', 'GET')
+
+        return [{
+            'pair': pair,
+            'tickSize': product.get('tick_size', '1e-{0}'.format(product['pair_decimals'])),
+            'lotSize': '1e-{0}'.format(product['lot_decimals']),
+            'minSize': product.get('ordermin', '0'),
+            'maxSize': None,
+            'minFunds': product.get('costmin'),
+            'tradable': product.get('status', 'online') == 'online'
+        } for pair, product in result.items() if 'wsname' in product]
+
+    async def get_tickers_batch(self, pairs: List[str]) -> Dict[str, Dict[str, Dict[str, float]]]:
+        '''
+        Get the best bid and ask of several ticker pairs in one request, given with
+        their Kraken names ('XETHXXBT'), by the Ticker endpoint
+
+        {
+            'XETHXXBT': {'bid': {'price': 0.02202, 'amount': 3}, 'ask': {'price': 0.02400, 'amount': 1}}
+        }
+        '''
+        try:
+            result = await self._send_request('public/Ticker?pair={0}'.format(','.join(pairs)), 'GET')
+        except (Exception, ExchangeException) as e:
+            return dict.fromkeys(pairs, e)
+
+        # a and b are [price, whole lot volume, lot volume]
+        return {pair: {
+            'bid': {'price': float(result[pair]['b'][0]), 'amount': float(result[pair]['b'][2])},
+            'ask': {'price': float(result[pair]['a'][0]), 'amount': float(result[pair]['a'][2])}
+        } if pair in result else ExchangeException('No ticker for {0}'.format(pair)) for pair in pairs}
+
+    async def get_open_order(self) -> List[Dict[str, str]]:
+        '''
+        Return the list of open orders currently existing
+
+        [
+            {
+                'orderId': 'OUYOOV-W6LU5-3MTVUD'
+            }
+        ]
+        '''
+        result = await self._send_request('private/OpenOrders', 'POST', lane='account')
+
+        return [{'orderId': txid, 'created': order['opentm']} for txid, order in result['open'].items()]
+
+    async def cancel_order(self, orderID):
+        return await self._send_request('private/CancelOrder', 'POST', {'txid': orderID}, 'orders')
+
+    async def withdraw(self, ticker, withdrawalKey, amount):
+        return await self._send_request('private/Withdraw', 'POST', {'asset': ticker, 'key': withdrawalKey, 'amount': amount}, 'orders')
+
+    async def place_order(self, ticker: str, action: str, amount: float, price: float):
+        '''
         ticker: 'XRPUSD'
         action: 'bid' or 'ask'
         amount: 700
         price: 0.2
-    '''
-    def place_order(self, ticker, action, amount, price):
+
+        Return the ID of the order as listed by get_open_order: {'orderId': 'OUYOOV-W6LU5-3MTVUD'}
+        '''
         action = 'buy' if action == 'bid' else 'sell'
         data = {'pair': ticker, 'type': action, 'volume': str(amount), 'price': str(price), 'ordertype': 'limit'}
-        return self._send_request('private/AddOrder', 'POST', data)
+        result = await self._send_request('private/AddOrder', 'POST', data, 'orders')
+        return {'orderId': result['txid'][0]}
+
+    async def get_ticker_lastPrice(self, ticker: str) -> Dict[str, float]:
+        '''
+        Get the last price in USD of a ticker
 
-    '''
-        return USDT in r.parsed
         {
-            'BTC': 18000    
+            'XXBT': 18000
         }
-    '''       
-    def get_ticker_lastPrice(self, ticker):
-         return self._send_request('public/Ticker?pair={0}ZUSD'.format(ticker), 'GET', {}, [self.hook_lastPrice(ticker=ticker)])
-
-    def hook_lastPrice(self, *factory_args, **factory_kwargs):
-        def res_hook(r, *r_args, **r_kwargs):
-            json = r.json()
-            r.parsed = {}
-            r.parsed[factory_kwargs['ticker']] = float(json['result'].itervalues().next()['c'][0])
-                                  
-        return res_hook    
+        '''
+        result = await self._send_request('public/Ticker?pair={0}ZUSD'.format(ticker), 'GET')
+
+        return {ticker: float(next(iter(result.values()))['c'][0])}
 
     '''
     <time>, <open>, <high>, <low>, <close>, <vwap>, <volume>, <count>
     '''
-    def get_ticker_history(self, ticker, timeframe='1'):
+    async def get_ticker_history(self, ticker, timeframe='1'):
         # 1 hour ago
         since = calendar.timegm((datetime.utcnow() - timedelta(hours = 1)).timetuple())
-        return self._send_request('public/OHLC?pair={0}&interval={1}&since={2}'.format(ticker, timeframe, since), 'GET')      
-    
+        return await self._send_request('public/OHLC?pair={0}&interval={1}&since={2}'.format(ticker, timeframe, since), 'GET')
+
     def parseTickerData(self, ticker, tickerData):
         vwapIndex = 5
-        for key in tickerData['result'].keys():
-            if isinstance(tickerData['result'][key], list):
-                return {'exchange': self.key['exchange'], 'ticker': ticker, 'data': list(map(lambda x: {'price': x[vwapIndex]}, tickerData['result'][key]))}
-    
-    
+        for key in tickerData.keys():
+            if isinstance(tickerData[key], list):
+                return {'exchange': self.key['exchange'], 'ticker': ticker, 'data': list(map(lambda x: {'price': x[vwapIndex]}, tickerData[key]))}
+
+
 if __name__ == "__main__":
-    engine = ExchangeEngine()
-    engine.load_key('../../keys/kraken.key')
-    # for res in grequests.map([engine.get_balance(['XXRP'])]):
-    #     print(res.parsed
-    #     pass
-       
-    # for res in grequests.map([engine.get_ticker_orderBook_innermost('XEOSZUSD')]):
-    #     print(res.parsed
-    #     pass     
-
-    # for res in grequests.map([engine.get_open_order()]):
-    #     print(res
-    #     pass 
-
-    for res in grequests.map([engine.get_ticker_lastPrice('XXBT')]):
-        print(res.parsed)
-        pass    
-
-    # for res in grequests.map([engine.place_order('ETCETH', 'ask', 1.5, 0.075)]):
-    #     print(res
-    #     pass     
-
-
-    # for res in grequests.map([engine.cancel_order('OUYOOV-W6LU5-3MTVUD')]):
-    #     print(res
-    #     pass     
-    #print(engine.get_ticker_history('ETHUSD')
-
-    #print(engine.withdraw('ETH', 'Bitfinex ETH', 0.5)
-    
-    
-    #print(engine.parseTickerData(engine.get_ticker_history('XRPUSD'))
-    #print(engine.place_order('ETCETH', 'ask', 1.5, 0.075)
-    #engine.place_order('XRPUSD', 'ask', 1, 200)
\ No newline at end of file
+    engine = ExchangeEngine('../../keys/kraken.key')
+
+    async def main():
+        try:
+            print(await engine.get_ticker_lastPrice('XXBT'))
+            # print(await engine.get_ticker_orderBook_innermost('XEOSZUSD'))
+            # print(await engine.get_balance(['XXRP']))
+            # print(await engine.get_open_order())
+            # print(await engine.place_order('ETCETH', 'ask', 1.5, 0.075))
+            # print(await engine.cancel_order('OUYOOV-W6LU5-3MTVUD'))
+            # print(await engine.withdraw('ETH', 'Bitfinex ETH', 0.5))
+        finally:
+            await engine.end_engine()
+
+    asyncio.run(main())
@@ -0,0 +1,409 @@
+'''
+Local mock of the Coinbase Pro REST API, to run the whole bot without network.
+
+It serves the endpoints used by the coinbase_pro adapter: time, accounts,
+products, products/{id}/book, products/{id}/ticker, orders and orders/{id}.
+The book of each product follows a random walk, regenerated every tickInterval
+around its mid price. Limit orders go through a small matching engine: the part
+crossing the book is filled right away against its levels, the rest stays open
+and is filled once the walk of the book reaches its price. The funds of the
+orders are held and the balances of the accounts moved by the fills, fees
+included.
+
+Every request can be delayed (latency plus an exponential jitter, for a long
+tail), answered with a 500 (errorRate) or a 429 (throttleRate, or above the
+rateLimit token bucket), so that the retries, the timeouts and the tail latency
+of the bot are exercised. The adapter is pointed at it with the 'api_url' entry
+of its key file:
+
+    {"api_key": "key", "passphrase": "pass", "api_secret": "c2VjcmV0", "api_url": "http://127.0.0.1:8767"}
+
+Running this module starts the mock in its own process and the triangular
+engine against it in production mode for a few seconds, then prints the
+requests served, the orders and fills, and the latency seen by the bot:
+
+    python -m engines.exchanges.mock_coinbase_pro
+'''
+
+import asyncio
+import collections
+import itertools
+import math
+import multiprocessing
+import random
+import socket
+import time
+import uuid
+from datetime import datetime, timezone
+from decimal import Decimal
+from typing import Dict, Optional, Tuple
+from aiohttp import web
+from engines.exchanges.rate_limit import TokenBucket
+
+
+class MockCoinbasePro(object):
+    def __init__(self, products: Dict[str, float], balances: Dict[str, float], latency: float = 0,
+                 jitter: float = 0, errorRate: float = 0, throttleRate: float = 0,
+                 rateLimit: Optional[Tuple[float, float]] = None, volatility: float = 0.0005,
+                 tickInterval: float = 0.1, levels: int = 50, feeRatio: float = 0.005, seed: Optional[int] = None):
+        '''
+        products: mid price of each product at the start, e.g. {'ETH-BTC': 0.07}
+        balances: balance of each currency at the start
+        latency: seconds added to each answer, plus an exponential jitter of mean jitter
+        errorRate: share of the requests answered with a 500
+        throttleRate: share of the requests answered with a 429, on top of the rateLimit bucket
+        rateLimit: (requests per second, burst) accepted, all endpoints together
+        volatility: standard deviation of the relative move of a mid price at each tick
+        '''
+        self.random = random.Random(seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.errorRate = errorRate
+        self.throttleRate = throttleRate
+        self.limiter = TokenBucket(*rateLimit) if rateLimit is not None else None
+        self.volatility = volatility
+        self.tickInterval = tickInterval
+        self.levels = levels
+        self.feeRatio = feeRatio
+
+        self.mids = dict(products)
+        # Price increment of about a millionth of the price, the amounts to 0.0001
+        self.tickSizes = {pair: Decimal(1).scaleb(math.floor(math.log10(mid)) - 6) for pair, mid in products.items()}
+        self.books = {}
+        self.sequence = 0
+        for pair in self.mids:
+            self.generate_book(pair)
+
+        self.accounts = {currency: {'id': str(uuid.uuid4()), 'currency': currency, 'balance': float(balance), 'hold': 0.0}
+                         for currency, balance in balances.items()}
+        self.orders = collections.OrderedDict()
+        self.tradeIds = itertools.count(1)
+        self.stats = collections.Counter()
+        self.task = None
+
+    def generate_book(self, pair: str):
+        '''
+        Move the mid price of a product and build its levels around it, a spread of about 0.1%
+        '''
+        mid = self.mids[pair] = self.mids[pair] * math.exp(self.random.gauss(0, self.volatility))
+        tick = float(self.tickSizes[pair])
+        step = max(mid * 1e-4, tick)
+        self.books[pair] = {
+            'bids': [[mid * 0.9995 - i * step, round(self.random.uniform(0.5, 50), 4)] for i in range(self.levels)],
+            'asks': [[mid * 1.0005 + i * step, round(self.random.uniform(0.5, 50), 4)] for i in range(self.levels)]
+        }
+        self.sequence += 1
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.tickInterval)
+            for pair in self.mids:
+                self.generate_book(pair)
+                self.match_open(pair)
+
+    def _price(self, pair: str, price: float) -> str:
+        return str(Decimal(price).quantize(self.tickSizes[pair]))
+
+    def _fill(self, order: Dict, size: float, price: float):
+        base, quote = order['product_id'].split('-')
+        funds = size * price
+        fee = funds * self.feeRatio
+        if order['side'] == 'buy':
+            # The hold was taken at the limit price, what is not spent is released
+            self.accounts[quote]['hold'] -= size * float(order['price']) * (1 + self.feeRatio)
+            self.accounts[quote]['balance'] -= funds + fee
+            self.accounts[base]['balance'] += size
+        else:
+            self.accounts[base]['hold'] -= size
+            self.accounts[base]['balance'] -= size
+            self.accounts[quote]['balance'] += funds - fee
+        order['filled_size'] += size
+        order['executed_value'] += funds
+        order['fill_fees'] += fee
+        self.stats['fills'] += 1
+        if float(order['size']) - order['filled_size'] <= 1e-12:
+            order['status'], order['settled'], order['done_reason'] = 'done', True, 'filled'
+
+    def match(self, order: Dict):
+        '''
+        Fill an order against the levels of its book that it crosses, taking their size
+        '''
+        book = self.books[order['product_id']]
+        side = book['asks'] if order['side'] == 'buy' else book['bids']
+        limit = float(order['price'])
+        while side and order['status'] != 'done':
+            price, size = side[0]
+            if (price > limit) if order['side'] == 'buy' else (price < limit):
+                break
+            take = min(size, float(order['size']) - order['filled_size'])
+            self._fill(order, take, price)
+            if take >= size:
+                side.pop(0)
+            else:
+                side[0][1] = size - take
+
+    def match_open(self, pair: str):
+        for order in list(self.orders.values()):
+            if order['product_id'] == pair and order['status'] == 'open':
+                self.match(order)
+
+    @staticmethod
+    def _error(message: str, status: int) -> web.Response:
+        return web.json_response({'message': message}, status=status)
+
+    @web.middleware
+    async def inject(self, request, handler):
+        '''
+        Delay the answers and inject the errors and the 429 of a busy exchange
+        '''
+        self.stats['requests'] += 1
+        delay = self.latency + (self.random.expovariate(1 / self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+        if self.limiter is not None:
+            self.limiter._refill()
+            if self.limiter.tokens < 1:
+                self.stats['429'] += 1
+                return self._error('Rate limit exceeded', 429)
+            self.limiter.tokens -= 1
+        draw = self.random.random()
+        if draw < self.throttleRate:
+            self.stats['429'] += 1
+            return self._error('Rate limit exceeded', 429)
+        if draw < self.throttleRate + self.errorRate:
+            self.stats['errors'] += 1
+            return self._error('Internal server error', 500)
+        try:
+            return await handler(request)
+        except ConnectionResetError:
+            # The client left in the middle of the request, e.g. an engine being stopped
+            return self._error('Client disconnected', 499)
+
+    async def get_time(self, request):
+        now = time.time()
+        return web.json_response({'iso': datetime.fromtimestamp(now, timezone.utc).isoformat(), 'epoch': now})
+
+    def _account(self, account: Dict) -> Dict:
+        return {'id': account['id'], 'currency': account['currency'], 'balance': str(account['balance']),
+                'hold': str(account['hold']), 'available': str(account['balance'] - account['hold'])}
+
+    async def get_accounts(self, request):
+        return web.json_response([self._account(account) for account in self.accounts.values()])
+
+    async def get_account(self, request):
+        for account in self.accounts.values():
+            if account['id'] == request.match_info['id']:
+                return web.json_response(self._account(account))
+        return self._error('NotFound', 404)
+
+    async def get_products(self, request):
+        return web.json_response([{
+            'id': pair, 'base_currency': pair.split('-')[0], 'quote_currency': pair.split('-')[1],
+            'quote_increment': str(tick), 'base_increment': '0.0001', 'base_min_size': '0.0001',
+            'min_market_funds': None, 'status': 'online', 'trading_disabled': False,
+            'cancel_only': False, 'post_only': False
+        } for pair, tick in self.tickSizes.items()])
+
+    async def get_book(self, request):
+        pair = request.match_info['id']
+        if pair not in self.books:
+            return self._error('NotFound', 404)
+        count = 50 if request.query.get('level') == '2' else 1
+        book = self.books[pair]
+        return web.json_response({
+            'sequence': self.sequence,
+            'bids': [[self._price(pair, price), str(size), 1] for price, size in book['bids'][:count]],
+            'asks': [[self._price(pair, price), str(size), 1] for price, size in book['asks'][:count]]
+        })
+
+    async def get_ticker(self, request):
+        pair = request.match_info['id']
+        if pair not in self.books:
+            return self._error('NotFound', 404)
+        book = self.books[pair]
+        return web.json_response({
+            'trade_id': next(self.tradeIds), 'price': self._price(pair, self.mids[pair]), 'size': '1',
+            'bid': self._price(pair, book['bids'][0][0]), 'ask': self._price(pair, book['asks'][0][0]),
+            'volume': '1000', 'time': datetime.now(timezone.utc).isoformat()
+        })
+
+    def _order(self, order: Dict) -> Dict:
+        return dict(order, filled_size=str(order['filled_size']), executed_value=str(order['executed_value']),
+                    fill_fees=str(order['fill_fees']))
+
+    async def post_order(self, request):
+        body = await request.json()
+        pair = body.get('product_id')
+        if pair not in self.books or body.get('side') not in ('buy', 'sell') or body.get('type', 'limit') != 'limit':
+            return self._error('Invalid order', 400)
+        try:
+            size, price = float(body['size']), float(body['price'])
+        except (KeyError, ValueError):
+            return self._error('Invalid size or price', 400)
+        if size <= 0 or price <= 0:
+            return self._error('Invalid size or price', 400)
+        base, quote = pair.split('-')
+        currency, funds = (quote, size * price * (1 + self.feeRatio)) if body['side'] == 'buy' else (base, size)
+        account = self.accounts.get(currency)
+        if account is None or account['balance'] - account['hold'] < funds:
+            return self._error('Insufficient funds', 400)
+        account['hold'] += funds
+
+        order = {'id': str(uuid.uuid4()), 'price': body['price'], 'size': body['size'], 'product_id': pair,
+                 'side': body['side'], 'type': 'limit', 'time_in_force': 'GTC', 'post_only': False,
+                 'created_at': datetime.now(timezone.utc).isoformat(), 'fill_fees': 0.0, 'filled_size': 0.0,
+                 'executed_value': 0.0, 'status': 'open', 'settled': False}
+        self.orders[order['id']] = order
+        self.stats['orders'] += 1
+        self.match(order)
+        return web.json_response(self._order(order))
+
+    async def get_orders(self, request):
+        return web.json_response([self._order(order) for order in self.orders.values() if order['status'] == 'open'])
+
+    async def get_order(self, request):
+        order = self.orders.get(request.match_info['id'])
+        if order is None:
+            return self._error('NotFound', 404)
+        return web.json_response(self._order(order))
+
+    async def delete_order(self, request):
+        order = self.orders.get(request.match_info['id'])
+        if order is None or order['status'] != 'open':
+            return self._error('Order already done', 400)
+        base, quote = order['product_id'].split('-')
+        remaining = float(order['size']) - order['filled_size']
+        if order['side'] == 'buy':
+            self.accounts[quote]['hold'] -= remaining * float(order['price']) * (1 + self.feeRatio)
+        else:
+            self.accounts[base]['hold'] -= remaining
+        order['status'], order['done_reason'] = 'done', 'canceled'
+        self.stats['cancels'] += 1
+        return web.json_response(order['id'])
+
+    async def on_startup(self, app):
+        self.task = asyncio.ensure_future(self.run())
+
+    async def on_cleanup(self, app):
+        self.task.cancel()
+
+    def make_app(self) -> web.Application:
+        app = web.Application(middlewares=[self.inject])
+        app.router.add_get('/time', self.get_time)
+        app.router.add_get('/accounts', self.get_accounts)
+        app.router.add_get('/accounts/{id}', self.get_account)
+        app.router.add_get('/products', self.get_products)
+        app.router.add_get('/products/{id}/book', self.get_book)
+        app.router.add_get('/products/{id}/ticker', self.get_ticker)
+        app.router.add_post('/orders', self.post_order)
+        app.router.add_get('/orders', self.get_orders)
+        app.router.add_get('/orders/{id}', self.get_order)
+        app.router.add_delete('/orders/{id}', self.delete_order)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def serve(port: int, options: Dict, statsQueue=None):
+    '''
+    Run the mock until the process is terminated, the counters of the requests
+    being put on statsQueue every second
+    '''
+    mock = MockCoinbasePro(**options)
+    app = mock.make_app()
+
+    async def report(app):
+        async def run():
+            while True:
+                await asyncio.sleep(1)
+                statsQueue.put(dict(mock.stats))
+        app['report'] = asyncio.ensure_future(run())
+
+    if statsQueue is not None:
+        app.on_startup.append(report)
+    web.run_app(app, host='127.0.0.1', port=port, print=None, access_log=None)
+
+
+def start_mock(port: int, options: Dict, statsQueue=None) -> multiprocessing.Process:
+    '''
+    Start the mock in its own process, so that it does not share the event loop
+    (or the GIL) of the bot being measured, and wait until it accepts connections
+    '''
+    process = multiprocessing.Process(target=serve, args=(port, options, statsQueue), daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('The mock server did not start')
+
+
+if __name__ == '__main__':
+    import json
+    import logging
+    import os
+    import tempfile
+    from engines.triangular_arbitrage import CryptoEngineTriArbitrage
+    from utils.logging import crypto_arb_log
+
+    port = 8767
+    duration = 10
+    # The tickers are valued from their EUR products, as on the exchange
+    options = {'products': {'ADA-ETH': 0.00015, 'ETH-BTC': 0.07, 'ADA-BTC': 0.0000105,
+                            'ADA-EUR': 0.315, 'ETH-EUR': 2100, 'BTC-EUR': 30000},
+               'balances': {'ADA': 10000, 'ETH': 1.5, 'BTC': 0.1, 'EUR': 1000},
+               'latency': 0.02, 'jitter': 0.01, 'errorRate': 0.01, 'throttleRate': 0.01,
+               'volatility': 0.002, 'feeRatio': 0.001, 'seed': 0}
+    statsQueue = multiprocessing.Queue()
+    server = start_mock(port, options, statsQueue)
+
+    with tempfile.NamedTemporaryFile('w', suffix='.key', delete=False) as f:
+        # The limits of the adapter are lifted to measure the bot itself
+        json.dump({'api_key': 'key', 'passphrase': 'pass', 'api_secret': 'c2VjcmV0',
+                   'api_url': 'http://127.0.0.1:{0}'.format(port),
+                   'rate_limits': {'public': None, 'private': None}}, f)
+    config = {'exchange': 'coinbase_pro', 'keyFile': f.name,
+              'tickerPairA': 'ADA-ETH', 'tickerPairB': 'ETH-BTC', 'tickerPairC': 'ADA-BTC',
+              'tickerA': 'ADA', 'tickerB': 'ETH', 'tickerC': 'BTC',
+              'feeRatio': 0.001, 'minProfit': 0.01, 'minPollInterval': 0.01, 'maxPollInterval': 0.05}
+
+    async def main():
+        engine = CryptoEngineTriArbitrage(config, mock=False)
+        ticks = 0
+        tick = engine.tick
+
+        async def counted_tick():
+            nonlocal ticks
+            ticks += 1
+            return await tick()
+        engine.tick = counted_tick
+        try:
+            await asyncio.wait_for(engine.run(), duration)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            await engine.end_engine()
+        return ticks, engine.engine.requestLatency
+
+    crypto_arb_log.setLevel(logging.WARNING)
+    try:
+        ticks, requestLatency = asyncio.run(main())
+        stats = {}
+        while not statsQueue.empty():
+            stats = statsQueue.get()
+        print('{0} s against the mock: {1} evaluations ({2:.0f} per second), {3} requests ({4:.0f} per second), '
+              '{5} errors and {6} 429 injected, {7} orders, {8} fills, {9} cancels'.format(
+                  duration, ticks, ticks / duration, stats.get('requests', 0), stats.get('requests', 0) / duration,
+                  stats.get('errors', 0), stats.get('429', 0), stats.get('orders', 0), stats.get('fills', 0),
+                  stats.get('cancels', 0)))
+        for label, tracker in sorted(requestLatency.items()):
+            print('{0}: {1} requests, {2}'.format(label, tracker.count, ', '.join(
+                'p{0} {1:.1f} ms'.format(percent, value) for percent, value in tracker.percentiles([50, 90, 99, 99.9]).items())))
+    finally:
+        # Let the server answer the requests the stopped engine left in flight
+        time.sleep(0.5)
+        server.terminate()
+        os.remove(f.name)
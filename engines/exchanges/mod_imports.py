@@ -4,5 +4,5 @@ import hmac
 import hashlib
 import base64
 import time
-import urllib
+import urllib.parse
 from base import ExchangeEngineBase
\ No newline at end of file
@@ -0,0 +1,165 @@
+'''
+Rate limits of the exchange APIs, enforced on the client side.
+
+Each limit is a token bucket: it holds up to `burst` tokens, refilled at `rate`
+tokens per second, and a request takes one token (or its cost) before being
+sent. This is also how the Kraken decaying call counter works, seen from the
+other side: the counter is the number of tokens missing. The requests waiting
+for a token are served by priority (orders before account checks before market
+data), then in their order of arrival. When the exchange still answers with a
+429, the bucket is emptied so that the next requests wait.
+'''
+
+import asyncio
+import heapq
+import itertools
+import time
+from typing import Dict
+
+
+class TokenBucket(object):
+    def __init__(self, rate: float, burst: float):
+        '''
+        rate: tokens added per second
+        burst: maximum number of tokens, i.e. of requests that can be sent at once
+        '''
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        # Requests waiting for a token: heap of (priority, arrival, cost, future)
+        self.waiters = []
+        self._arrivals = itertools.count()
+        self.task = None
+
+        self.started = self.updated
+        self.requests = 0
+        self.used = 0.0
+        self.waited = 0.0
+        self.rejected = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, cost: float = 1, priority: int = 0):
+        '''
+        Wait until the request can be sent without exceeding the limit, the lower
+        priorities being served first
+        '''
+        start = time.monotonic()
+        self._refill()
+        if not self.waiters and self.tokens >= cost:
+            self.tokens -= cost
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(self.waiters, (priority, next(self._arrivals), cost, future))
+            if self.task is None or self.task.done():
+                self.task = asyncio.ensure_future(self._serve())
+            await future
+        self.requests += 1
+        self.used += cost
+        self.waited += time.monotonic() - start
+
+    async def _serve(self):
+        '''
+        Hand the tokens to the waiting requests as they are refilled. The first
+        waiter is looked at again after each sleep, a request of higher priority
+        arriving meanwhile goes first.
+        '''
+        while self.waiters:
+            priority, arrival, cost, future = self.waiters[0]
+            if future.done():
+                # Cancelled while waiting
+                heapq.heappop(self.waiters)
+                continue
+            self._refill()
+            if self.tokens >= cost:
+                heapq.heappop(self.waiters)
+                self.tokens -= cost
+                future.set_result(None)
+            else:
+                await asyncio.sleep((cost - self.tokens) / self.rate)
+
+    def penalize(self, retryAfter: float = 0):
+        '''
+        Called when the exchange rejected a request for exceeding its limit: no
+        request is sent before retryAfter seconds, or before the next token otherwise
+        '''
+        self._refill()
+        self.tokens = min(self.tokens, 0) - retryAfter * self.rate
+        self.rejected += 1
+
+    def usage(self) -> Dict[str, float]:
+        '''
+        Return how much of the budget has been used since the bucket was created
+        '''
+        elapsed = time.monotonic() - self.started
+        allowance = self.burst + elapsed * self.rate
+        return {
+            'requests': self.requests,
+            'used': self.used,
+            'budget': allowance,
+            'ratio': self.used / allowance,
+            'waited': self.waited,
+            'rejected': self.rejected
+        }
+
+
+if __name__ == '__main__':
+    import json
+    import os
+    import tempfile
+    from engines.exchanges.loader import EngineLoader
+    from engines.exchanges.stub_server import start_server
+
+    # The stub allows 20 requests per second with bursts of 5 and answers 429 above
+    port = 8768
+    requests = 100
+    server = start_server(port, rateLimit=(20, 5))
+
+    async def run(rateLimits, maxRetries):
+        with tempfile.NamedTemporaryFile('w', suffix='.key', delete=False) as f:
+            json.dump({'exchange': 'kraken', 'public': '', 'private': '',
+                       'api_url': 'http://127.0.0.1:{0}'.format(port), 'rate_limits': rateLimits}, f)
+        engine = EngineLoader.getEngine('kraken', f.name)
+        os.remove(f.name)
+        engine.maxRetries = maxRetries
+        start = time.perf_counter()
+        responses = await asyncio.gather(
+            *[engine.get_ticker_orderBook_innermost('XETHXXBT') for _ in range(requests)], return_exceptions=True)
+        elapsed = time.perf_counter() - start
+        errors = sum(isinstance(res, BaseException) for res in responses)
+        print('rate limits {0}: {1} requests in {2:.2f} s, {3} failed'.format(rateLimits, requests, elapsed, errors))
+        await engine.end_engine()
+
+    async def run_lanes():
+        '''
+        Orders and account checks sent while 60 book requests are queued in the same bucket
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.key', delete=False) as f:
+            json.dump({'exchange': 'kraken', 'public': '', 'private': '',
+                       'api_url': 'http://127.0.0.1:{0}'.format(port), 'rate_limits': {'public': [20, 5]}}, f)
+        engine = EngineLoader.getEngine('kraken', f.name)
+        os.remove(f.name)
+        url = engine.API_URL + '/0/public/Depth?pair=XETHXXBT&count=1'
+        reads = [asyncio.ensure_future(engine.request('GET', url, 'public', 'marketData')) for _ in range(60)]
+        await asyncio.sleep(0.5)
+        await asyncio.gather(*[engine.request('GET', url, 'public', lane) for lane in ['orders', 'account'] * 3])
+        await asyncio.gather(*reads)
+        for lane, tracker in engine.laneWait.items():
+            print('{0}: {1} requests, queue wait {2}'.format(lane, tracker.count, ', '.join(
+                'p{0} {1:.1f} ms'.format(percent, value) for percent, value in tracker.percentiles().items())))
+        await engine.end_engine()
+
+    try:
+        # Without client side limit nor retry, most of the burst is rejected
+        asyncio.run(run({'public': None}, 0))
+        # Let the stub bucket fill up again
+        time.sleep(1)
+        asyncio.run(run({'public': [20, 5]}, 3))
+        time.sleep(1)
+        asyncio.run(run_lanes())
+    finally:
+        server.terminate()
@@ -0,0 +1,212 @@
+'''
+Exchange replaying a tick recording (engines/tick_recorder.py) instead of a
+live venue, loaded like any other adapter with the recording as key file:
+
+    EngineLoader.getEngine('replay', 'recordings/')
+
+The engine holds the books of the current record only: the driver moves the
+virtual clock with replay(), one record at a time, and the engine code reads
+the books and places its orders as it would on the venue. The limit orders
+are filled at their price against the books recorded after them, up to the
+size shown, and the balances are kept here, fees included.
+'''
+
+import itertools
+import math
+import os
+from base import ExchangeException
+from mod_imports import *
+from typing import Dict, Iterator, List
+from engines.tick_recorder import read_ticks, read_products, recording_files
+from engines.valuation import parse_pair
+from utils.logging import crypto_arb_log
+
+# Taker fee of the recorded exchanges, the same as their adapters
+FEE_RATIOS = {'coinbase_pro': 0.005, 'kraken': 0.0026, 'bittrex': 0.0025, 'bitstamp': 0.0025, 'bitfinex': 0.002}
+
+
+class ExchangeEngine(ExchangeEngineBase):
+    # Records turned into Python values at a time, the rest of a file is only mapped
+    chunkSize = 65536
+
+    def __init__(self, filename):
+        '''
+        filename: directory of a recording, or one of its files
+        '''
+        if os.path.isdir(filename):
+            self.directory, self.files = filename, recording_files(filename)
+        else:
+            self.directory, self.files = os.path.dirname(filename) or '.', [filename]
+        if not self.files:
+            raise ValueError('No tick recording in {0}'.format(filename))
+        self.API_URL = 'replay://' + os.path.abspath(filename)
+        self.sleepTime = 0
+
+        # The products are recorded as 'exchange:pair', the engine trades the pairs
+        # of the first exchange recorded
+        products = read_products(self.directory)
+        self.exchangeName = products[0].split(':', 1)[0] if products else ''
+        self.productPairs = [product.split(':', 1)[1] if product.startswith(self.exchangeName + ':') else None
+                             for product in products]
+        self.feeRatio = FEE_RATIOS.get(self.exchangeName, 0.0026)
+
+        # Virtual clock: time of the last record replayed, and the books at that time
+        self.now = None
+        self.books = {}
+        self.depthBooks = {}
+
+        # Total balance of each currency and the part held by the open orders
+        self.balances = {}
+        self.held = {}
+        self.orders = {}
+        self.openPairs = set()
+        self.fills = []
+        self._orderIds = itertools.count(1)
+
+    async def _send_request(self, command: str, httpMethod: str, params={}):
+        raise ExchangeException('No request is sent during a replay')
+
+    async def warm_up(self):
+        pass
+
+    async def end_engine(self):
+        pass
+
+    def replay(self) -> Iterator[str]:
+        '''
+        Move the clock through the recording, one record at a time, and yield the pair
+        of each book replayed. The open orders of the pair are matched against it first.
+        '''
+        for path in self.files:
+            ticks = read_ticks(path)
+            depth = ticks.dtype['bids'].shape[0] if 'bids' in ticks.dtype.names else 0
+            for start in range(0, len(ticks), self.chunkSize):
+                chunk = ticks[start:start + self.chunkSize]
+                columns = [chunk[name].tolist() for name in ('time', 'product', 'bidPrice', 'bidSize', 'askPrice', 'askSize')]
+                for index, (now, productId, bidPrice, bidSize, askPrice, askSize) in enumerate(zip(*columns)):
+                    pair = self.productPairs[productId]
+                    if pair is None:
+                        continue
+                    self.now = now
+                    self.books[pair] = {'bid': {'price': bidPrice, 'amount': bidSize},
+                                        'ask': {'price': askPrice, 'amount': askSize}}
+                    if depth and not math.isnan(chunk['bids'][index, 0, 0]):
+                        self.depthBooks[pair] = {side: [level for level in chunk[side][index].tolist() if not math.isnan(level[0])]
+                                                 for side in ('bids', 'asks')}
+                    else:
+                        self.depthBooks.pop(pair, None)
+                    if pair in self.openPairs:
+                        self.match_orders(pair)
+                    yield pair
+                del chunk
+            del ticks
+
+    def _currencies(self, pair: str):
+        currencies = parse_pair(pair, list(self.balances))
+        if currencies is None:
+            raise ExchangeException('Currencies of {0} unknown'.format(pair))
+        return currencies
+
+    def match_orders(self, pair: str):
+        '''
+        Fill the open orders of a pair crossed by its book, up to the size shown
+        '''
+        book = self.books[pair]
+        sizes = {'bid': book['ask']['amount'], 'ask': book['bid']['amount']}
+        for order in list(self.orders.values()):
+            if order['tickerPair'] != pair or order['remaining'] <= 0:
+                continue
+            action = order['action']
+            if action == 'bid' and book['ask']['price'] > order['price']:
+                continue
+            if action == 'ask' and book['bid']['price'] < order['price']:
+                continue
+            amount = min(order['remaining'], sizes[action])
+            if amount <= 0:
+                continue
+            sizes[action] -= amount
+            self._fill(order, amount)
+        self.openPairs = {order['tickerPair'] for order in self.orders.values() if order['remaining'] > 0}
+
+    def _fill(self, order: Dict, amount: float):
+        base, quote = self._currencies(order['tickerPair'])
+        funds = amount * order['price']
+        fee = funds * self.feeRatio
+        if order['action'] == 'bid':
+            self.balances[quote] -= funds + fee
+            self.held[quote] -= funds + fee
+            self.balances[base] = self.balances.get(base, 0.0) + amount
+        else:
+            self.balances[base] -= amount
+            self.held[base] -= amount
+            self.balances[quote] = self.balances.get(quote, 0.0) + funds - fee
+        order['remaining'] -= amount
+        self.fills.append({'time': self.now, 'orderId': order['id'], 'tickerPair': order['tickerPair'],
+                           'action': order['action'], 'amount': amount, 'price': order['price'],
+                           'fee': fee, 'feeCurrency': quote})
+
+    async def get_balance(self, tickers: list=[]) -> Dict[str, float]:
+        return {ticker: self.balances.get(ticker, 0.0) for ticker in tickers}
+
+    async def get_ticker_history(self, ticker):
+        raise NotImplementedError("This function seems not needed for Triangular arbitrage")
+
+    async def get_ticker_lastPrice(self, ticker: str) -> Dict[str, float]:
+        raise ExchangeException('No last price of {0} during a replay, its pairs have to be recorded'.format(ticker))
+
+    async def get_ticker_orderBook_innermost(self, ticker_pair: str) -> Dict[str, Dict[str, float]]:
+        book = self.books.get(ticker_pair)
+        if book is None:
+            raise ExchangeException('No book of {0} replayed yet'.format(ticker_pair))
+        return book
+
+    async def get_ticker_orderBook_depth(self, ticker_pair: str, depth: int) -> Dict[str, List[List[float]]]:
+        '''
+        Return the levels recorded with the book, or its innermost level when recorded without depth
+        '''
+        book = self.depthBooks.get(ticker_pair)
+        if book is None:
+            innermost = await self.get_ticker_orderBook_innermost(ticker_pair)
+            return {'bids': [[innermost['bid']['price'], innermost['bid']['amount']]],
+                    'asks': [[innermost['ask']['price'], innermost['ask']['amount']]]}
+        return {'bids': book['bids'][:depth], 'asks': book['asks'][:depth]}
+
+    async def get_open_order(self) -> List[Dict[str, float]]:
+        return [{'orderId': order['id']} for order in self.orders.values() if order['remaining'] > 0]
+
+    async def place_order(self, ticker_pair: str, action: str, amount: float, price: float):
+        '''
+        Hold the funds of a limit order, then match it against the current book
+        '''
+        amount, price = float(amount), float(price)
+        base, quote = self._currencies(ticker_pair)
+        currency, funds = (quote, amount * price * (1 + self.feeRatio)) if action == 'bid' else (base, amount)
+        if self.balances.get(currency, 0.0) - self.held.get(currency, 0.0) < funds * (1 - 1e-9):
+            raise ExchangeException('Insufficient funds for {0} {1} {2} at {3}'.format(action, amount, ticker_pair, price))
+        self.held[currency] = self.held.get(currency, 0.0) + funds
+
+        order = {'id': str(next(self._orderIds)), 'time': self.now, 'tickerPair': ticker_pair, 'action': action,
+                 'amount': amount, 'price': price, 'remaining': amount}
+        self.orders[order['id']] = order
+        self.openPairs.add(ticker_pair)
+        if ticker_pair in self.books:
+            self.match_orders(ticker_pair)
+        return {'orderId': order['id']}
+
+    async def cancel_order(self, orderID):
+        '''
+        Cancel the rest of an order and release its funds
+        '''
+        order = self.orders.get(orderID)
+        if order is None or order['remaining'] <= 0:
+            raise ExchangeException('Order {0} is not open'.format(orderID))
+        base, quote = self._currencies(order['tickerPair'])
+        if order['action'] == 'bid':
+            self.held[quote] -= order['remaining'] * order['price'] * (1 + self.feeRatio)
+        else:
+            self.held[base] -= order['remaining']
+        order['cancelled'] = order['remaining']
+        order['remaining'] = 0.0
+        self.openPairs = {order['tickerPair'] for order in self.orders.values() if order['remaining'] > 0}
+        crypto_arb_log.debug('Order {0} cancelled, {1} left unfilled'.format(orderID, order['cancelled']))
+        return {'id': orderID}
@@ -0,0 +1,200 @@
+'''
+Local stub of the public order book endpoints of Kraken, Bittrex, Bitfinex and
+Bitstamp, and of the Kraken and Bitfinex tickers of many pairs, answering with a
+fixed book after an optional delay. The stub can also enforce a rate limit,
+answering with a 429 to the requests above it.
+
+Running this module compares, against the stub, the time taken by a round of
+concurrent book requests done by the async adapters with the same round done
+with grequests (the way the adapters used to work), when it is installed. It
+then compares the tickers of many pairs requested one by one and in a batch,
+within the rate limits of the exchanges:
+
+    python -m engines.exchanges.stub_server
+'''
+
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import tempfile
+import time
+from aiohttp import web
+from engines.exchanges.rate_limit import TokenBucket
+
+LEVELS = [[0.0700 + i * 0.0001, 1.0 + i] for i in range(25)]
+
+# Exchange -> (path of the book endpoint for a ticker pair, ticker pairs requested)
+BOOK_PATHS = {
+    'kraken': ('/0/public/Depth?pair={0}&count=1', ['XETHXXBT', 'XLTCXXBT', 'XXRPXXBT']),
+    'bittrex': ('/v1.1/public/getorderbook?type=both&market={0}', ['BTC-ETH', 'BTC-LTC', 'BTC-XRP']),
+    'bitfinex': ('/v1/book/{0}?limit_bids=1&limit_asks=1', ['ETHBTC', 'LTCBTC', 'XRPBTC']),
+    'bitstamp': ('/v2/order_book/{0}/', ['ethbtc', 'ltcbtc', 'xrpbtc'])
+}
+
+
+def make_app(delay: float = 0, rateLimit=None) -> web.Application:
+    '''
+    rateLimit: (requests per second, burst) accepted by the stub, all endpoints together
+    '''
+    bids = LEVELS
+    asks = [[price + 0.01, amount] for price, amount in LEVELS]
+    limiter = TokenBucket(*rateLimit) if rateLimit is not None else None
+
+    async def reply(body):
+        if limiter is not None:
+            limiter._refill()
+            if limiter.tokens < 1:
+                limiter.rejected += 1
+                return web.json_response({'error': ['EAPI:Rate limit exceeded'], 'message': 'Rate limit exceeded'}, status=429)
+            limiter.tokens -= 1
+        if delay:
+            await asyncio.sleep(delay)
+        return web.json_response(body)
+
+    async def kraken(request):
+        book = {'bids': [[str(p), str(a), 0] for p, a in bids], 'asks': [[str(p), str(a), 0] for p, a in asks]}
+        return await reply({'error': [], 'result': {request.query['pair']: book}})
+
+    async def bittrex(request):
+        return await reply({'success': True, 'message': '', 'result': {
+            'buy': [{'Rate': p, 'Quantity': a} for p, a in bids],
+            'sell': [{'Rate': p, 'Quantity': a} for p, a in asks]}})
+
+    async def bitfinex(request):
+        return await reply({
+            'bids': [{'price': str(p), 'amount': str(a)} for p, a in bids],
+            'asks': [{'price': str(p), 'amount': str(a)} for p, a in asks]})
+
+    async def bitstamp(request):
+        return await reply({'bids': [[str(p), str(a)] for p, a in bids], 'asks': [[str(p), str(a)] for p, a in asks]})
+
+    async def kraken_ticker(request):
+        ticker = {'a': [str(asks[0][0]), '1', str(asks[0][1])], 'b': [str(bids[0][0]), '1', str(bids[0][1])]}
+        return await reply({'error': [], 'result': {pair: ticker for pair in request.query['pair'].split(',')}})
+
+    async def bitfinex_tickers(request):
+        return await reply([[symbol, bids[0][0], bids[0][1], asks[0][0], asks[0][1]]
+                            for symbol in request.query['symbols'].split(',')])
+
+    app = web.Application()
+    app.router.add_get('/0/public/Depth', kraken)
+    app.router.add_get('/v1.1/public/getorderbook', bittrex)
+    app.router.add_get('/v1/book/{symbol}', bitfinex)
+    app.router.add_get('/v2/order_book/{symbol}/', bitstamp)
+    app.router.add_get('/0/public/Ticker', kraken_ticker)
+    app.router.add_get('/v2/tickers', bitfinex_tickers)
+    return app
+
+
+def serve(port: int, delay: float = 0, rateLimit=None):
+    '''
+    Run the stub until the process is terminated
+    '''
+    web.run_app(make_app(delay, rateLimit), host='127.0.0.1', port=port, print=None)
+
+
+def start_server(port: int, delay: float = 0, rateLimit=None) -> multiprocessing.Process:
+    '''
+    Start the stub in its own process, so that it does not share the event loop
+    (or the GIL) of the client being measured, and wait until it accepts connections
+    '''
+    process = multiprocessing.Process(target=serve, args=(port, delay, rateLimit), daemon=True)
+    process.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process
+        except OSError:
+            time.sleep(0.05)
+    process.terminate()
+    raise RuntimeError('The stub server did not start')
+
+
+if __name__ == '__main__':
+    from engines.exchanges.loader import EngineLoader
+
+    port = 8766
+    rounds = 50
+    url = 'http://127.0.0.1:{0}'.format(port)
+    server = start_server(port, delay=0.005)
+
+    keyFiles = {}
+    for exchange in BOOK_PATHS:
+        with tempfile.NamedTemporaryFile('w', suffix='.key', delete=False) as f:
+            # The stub has no rate limit, the client side buckets are disabled
+            json.dump({'exchange': exchange, 'public': '', 'private': '', 'customer_id': '', 'api_url': url,
+                       'rate_limits': {'public': None, 'private': None, 'api': None}}, f)
+            keyFiles[exchange] = f.name
+
+    async def run_async():
+        engines = {exchange: EngineLoader.getEngine(exchange, keyFiles[exchange]) for exchange in BOOK_PATHS}
+        try:
+            samples = []
+            for _ in range(rounds):
+                start = time.perf_counter()
+                await asyncio.gather(*[engines[exchange].get_ticker_orderBook_innermost(pair)
+                                       for exchange, (path, pairs) in BOOK_PATHS.items() for pair in pairs])
+                samples.append(time.perf_counter() - start)
+            return samples
+        finally:
+            for engine in engines.values():
+                await engine.end_engine()
+
+    def run_grequests(grequests):
+        import requests
+        urls = [url + path.format(pair) for path, pairs in BOOK_PATHS.values() for pair in pairs]
+        session = requests.Session()
+        samples = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            for response in grequests.map([grequests.get(u, session=session) for u in urls]):
+                response.json()
+            samples.append(time.perf_counter() - start)
+        return samples
+
+    async def run_batch(exchange, pairs):
+        '''
+        Tickers of many pairs one by one and in a batch, with the rate limits of the exchange
+        '''
+        with tempfile.NamedTemporaryFile('w', suffix='.key', delete=False) as f:
+            json.dump({'exchange': exchange, 'public': '', 'private': '', 'api_url': url}, f)
+        engine = EngineLoader.getEngine(exchange, f.name)
+        os.remove(f.name)
+        try:
+            start = time.perf_counter()
+            await asyncio.gather(*[engine.get_ticker_orderBook_innermost(pair) for pair in pairs])
+            single = time.perf_counter() - start
+            # Let the bucket fill up again
+            await asyncio.sleep(single)
+            start = time.perf_counter()
+            tickers = await engine.get_tickers_batch(pairs)
+            batch = time.perf_counter() - start
+            assert not any(isinstance(ticker, BaseException) for ticker in tickers.values())
+            print('{0}: {1} pairs, one request each {2:.2f} s, batch in one request {3:.3f} s'.format(
+                exchange, len(pairs), single, batch))
+        finally:
+            await engine.end_engine()
+
+    def report(name, samples):
+        samples = sorted(samples)
+        print('{0}: {1} rounds of {2} book requests, median {3:.1f} ms, p90 {4:.1f} ms'.format(
+            name, len(samples), sum(len(pairs) for path, pairs in BOOK_PATHS.values()),
+            samples[len(samples) // 2] * 1000, samples[int(len(samples) * 0.9)] * 1000))
+
+    try:
+        report('aiohttp adapters', asyncio.run(run_async()))
+        try:
+            import grequests
+        except ImportError:
+            grequests = None
+            print('grequests is not installed, skipping the grequests comparison')
+        if grequests is not None:
+            report('grequests', run_grequests(grequests))
+        asyncio.run(run_batch('kraken', ['X{0}XXBT'.format(i) for i in range(8)]))
+        asyncio.run(run_batch('bitfinex', ['c{0}btc'.format(i) for i in range(15)]))
+    finally:
+        server.terminate()
+        for keyFile in keyFiles.values():
+            os.remove(keyFile)
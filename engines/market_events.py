@@ -0,0 +1,183 @@
+'''
+Market data events driving the engines instead of a fixed polling period.
+
+The sources of order books (WebSocket feeds or the polling fallback below)
+publish the products whose top of book changed. The events are coalesced per
+product: an engine busy evaluating while several updates arrive only sees one
+pending change per product when it is ready again, so it never works on stale
+data. The time between a quote change and the decision taken on it is tracked
+to report its percentiles.
+'''
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from utils.logging import crypto_arb_log
+
+
+class QuoteEvents(object):
+    def __init__(self):
+        # Product -> time of its oldest change not processed yet
+        self.pending = {}
+        self.changed = asyncio.Event()
+
+    def publish(self, product: str, timestamp: Optional[float] = None):
+        '''
+        Signal a change of the order book of a product
+        '''
+        if product not in self.pending:
+            self.pending[product] = time.monotonic() if timestamp is None else timestamp
+        self.changed.set()
+
+    async def wait(self) -> Dict[str, float]:
+        '''
+        Wait for at least one change and return all the changes pending, as a dict
+        product -> time of its oldest change
+        '''
+        await self.changed.wait()
+        self.changed.clear()
+        batch, self.pending = self.pending, {}
+        return batch
+
+
+class LatencyTracker(object):
+    def __init__(self, size: int = 10000):
+        # Ring buffer of the last latencies, in seconds
+        self.samples = np.zeros(size)
+        self.count = 0
+
+    def record(self, latency: float):
+        self.samples[self.count % len(self.samples)] = latency
+        self.count += 1
+
+    def percentiles(self, percents: List[float] = [50, 90, 99]) -> Dict[float, float]:
+        '''
+        Return the percentiles of the recorded latencies, in milliseconds
+        '''
+        if self.count == 0:
+            return {}
+        samples = self.samples[:min(self.count, len(self.samples))]
+        return {percent: float(value) for percent, value in zip(percents, np.percentile(samples, percents) * 1000)}
+
+    def log(self, name: str):
+        crypto_arb_log.info('{0} latency over {1} samples: {2}'.format(name, self.count, ', '.join(
+            'p{0} {1:.2f} ms'.format(percent, value) for percent, value in self.percentiles().items())))
+
+
+class PollingQuoteSource(object):
+    '''
+    Fallback source for the exchanges without a feed: the innermost order books
+    are requested periodically, or when the scheduler says so, and an event is
+    published for each product whose top of book changed. The engines read the
+    books from memory, like from a feed.
+    '''
+    def __init__(self, engine, pairs: List[str], events: Optional[QuoteEvents], interval: float, scheduler=None,
+                 timeout: float = 10):
+        '''
+        timeout: time the book of a pair is waited for before its first poll, in seconds
+        '''
+        self.engine = engine
+        self.pairs = list(pairs)
+        self.events = events
+        self.interval = interval
+        self.scheduler = scheduler
+
+        self.timeout = timeout
+
+        self.books = {}
+        # Set once a pair has been polled, and the error of its last poll when it failed
+        self.received = {pair: asyncio.Event() for pair in self.pairs}
+        self.errors = {}
+        # Set after each round of polls
+        self.polled = asyncio.Event()
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def poll(self, pairs: Optional[List[str]] = None):
+        pairs = self.pairs if pairs is None else pairs
+        # Module of the adapters, which imports this one
+        from base import ExchangeException
+
+        # One request for all the pairs when the exchange allows it
+        try:
+            responses = await self.engine.get_tickers_batch(pairs)
+        except (Exception, ExchangeException) as e:
+            # The request of the whole batch failed, so did the poll of each pair
+            responses = {pair: e for pair in pairs}
+        now = time.monotonic()
+        for pair, res in responses.items():
+            # ExchangeException derives from BaseException
+            if isinstance(res, BaseException):
+                crypto_arb_log.error('{0}: {1}'.format(pair, res))
+                self.errors[pair] = res
+                self.received[pair].set()
+                if self.scheduler is not None:
+                    self.scheduler.polled(pair, now)
+                continue
+            if self.scheduler is not None:
+                self.scheduler.record(pair, res, now)
+            self.errors.pop(pair, None)
+            if res != self.books.get(pair):
+                self.books[pair] = res
+                self.received[pair].set()
+                if self.events is not None:
+                    self.events.publish(pair, now)
+        self.polled.set()
+
+    async def run(self):
+        while True:
+            try:
+                if self.scheduler is None:
+                    await self.poll()
+                    await asyncio.sleep(self.interval)
+                else:
+                    await self.poll(await self.scheduler.wait())
+            except Exception as e:
+                # The polls must go on, the engines would wait for the books forever otherwise
+                crypto_arb_log.error('Polling failed: {0!r}'.format(e))
+                await asyncio.sleep(self.interval)
+
+    async def wait_poll(self):
+        '''
+        Wait for the end of the next round of polls
+        '''
+        self.polled.clear()
+        await self.polled.wait()
+
+    async def get_ticker_orderBook_innermost(self, ticker_pair: str) -> Dict[str, Dict[str, float]]:
+        '''
+        Return the last book polled of a pair. The error of its last poll is raised
+        instead when it failed, so that the engine never waits for a pair whose polls
+        keep failing nor trades on its stale book.
+        '''
+        # Module of the adapters, which imports this one
+        from base import ExchangeException
+
+        try:
+            await asyncio.wait_for(self.received[ticker_pair].wait(), self.timeout)
+        except asyncio.TimeoutError:
+            raise ExchangeException('No book of {0} polled after {1} s'.format(ticker_pair, self.timeout))
+        if ticker_pair in self.errors:
+            raise ExchangeException('Last poll of {0} failed: {1}'.format(ticker_pair, self.errors[ticker_pair]))
+        return self.books[ticker_pair]
+
+    async def get_ticker_orderBook_depth(self, ticker_pair: str, depth: int) -> Dict[str, List[List[float]]]:
+        # Only the innermost level is polled, the depth is requested directly
+        return await self.engine.get_ticker_orderBook_depth(ticker_pair, depth)
+
+    async def get_books_batch(self, pairs: List[str], depth: int) -> Dict[str, Dict[str, List[List[float]]]]:
+        return await self.engine.get_books_batch(pairs, depth)
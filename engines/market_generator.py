@@ -0,0 +1,215 @@
+'''
+Synthetic market to stress the route scoring of the triangular engine.
+
+The generator quotes hundreds of products of a currency graph like the one of a
+large exchange: the value of each currency follows a random walk made of a
+common market factor and of its own moves, so that the products move together
+as real ones do, and each update quotes one product from the values of its two
+currencies, with a small noise and a spread. Arbitrage cycles are injected at
+known times: the bid of one product is lifted by `edge` for `injectionDuration`
+seconds, then quoted normally again, which makes profitable the routes selling
+its base currency through it. A whole stream is generated with NumPy ahead of
+the run, at any update rate.
+
+StressTest feeds the stream in process to the TriangleScanner the way
+scan_triangles does (update_quote of the products changed, then evaluate and
+top_routes) and measures the real time of each evaluation. A virtual clock
+advances by that time: the updates that arrived meanwhile are coalesced into the
+next evaluation, as the QuoteEvents of the event-driven mode do. Above the
+sustainable rate, the batches and the lag behind the stream keep growing. The
+detection latency of each injected cycle is the time from its injection to the
+end of the first evaluation reporting a route through the lifted bid, and the
+recall is the share of the injected cycles reported while they lasted. Any
+other route reported is counted as a false report.
+
+    python -m engines.market_generator
+'''
+
+import time
+from typing import Dict, List, Optional
+import numpy as np
+from engines.triangle_scanner import TriangleScanner
+
+
+class SyntheticMarket(object):
+    def __init__(self, nbBases: int = 100, quotes: List[str] = ['BTC', 'ETH', 'USD', 'EUR', 'USDT', 'GBP'],
+                 volatility: float = 0.0005, correlation: float = 0.7, spread: float = 0.001,
+                 noise: float = 0.00002, stepUpdates: int = 100, seed: Optional[int] = None):
+        '''
+        nbBases: number of currencies quoted against every quote currency, the quote
+                 currencies being also quoted against each other
+        volatility: standard deviation of the log value of a currency over a second
+        correlation: share of the variance of the currencies due to the common factor
+        spread: relative spread between the bid and the ask of every product
+        noise: standard deviation of the relative error of a quote around the fair price
+        stepUpdates: number of updates between two moves of the currency values
+        '''
+        self.rng = np.random.default_rng(seed)
+        self.volatility = volatility
+        self.correlation = correlation
+        self.spread = spread
+        self.noise = noise
+        self.stepUpdates = stepUpdates
+
+        self.currencies = list(quotes) + ['C{0}'.format(i) for i in range(nbBases)]
+        currencyIndex = {currency: index for index, currency in enumerate(self.currencies)}
+        self.products = [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q}
+                         for b in self.currencies[len(quotes):] for q in quotes]
+        self.products += [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q}
+                          for b in quotes for q in quotes if b < q]
+        self.pairs = [product['pair'] for product in self.products]
+        self.base = np.array([currencyIndex[product['base']] for product in self.products])
+        self.quote = np.array([currencyIndex[product['quote']] for product in self.products])
+        # Log value of each currency at the start
+        self.logValues = np.log(self.rng.uniform(0.01, 100, len(self.currencies)))
+        # Products whose bid is lifted by the injections, the ones of the base currencies
+        self.injectedProducts = nbBases * len(quotes)
+
+    def generate(self, duration: float, rate: float, injections: int = 0, edge: float = 0.01,
+                 injectionDuration: float = 0.05) -> Dict:
+        '''
+        Generate the updates of `duration` seconds at `rate` updates per second.
+
+        The result holds NumPy arrays of the time, product, bid and ask of each update,
+        and the list of the cycles injected: {'time', 'end', 'leg'}, leg being the
+        (pair, 'ask') leg of the routes made profitable.
+        '''
+        count = int(duration * rate)
+        times = np.arange(count) / rate
+        products = self.rng.integers(0, len(self.products), count)
+
+        # The currency values move every stepUpdates updates, common factor and own moves
+        steps = count // self.stepUpdates + 1
+        scale = self.volatility * np.sqrt(self.stepUpdates / rate)
+        common = self.rng.normal(0, scale * np.sqrt(self.correlation), (steps, 1))
+        own = self.rng.normal(0, scale * np.sqrt(1 - self.correlation), (steps, len(self.currencies)))
+        logValues = self.logValues + np.cumsum(common + own, axis=0)
+        self.logValues = logValues[-1]
+        step = np.arange(count) // self.stepUpdates
+
+        # Injected cycles spread over the run: the first quote of the product is at the
+        # injection time, and the product is quoted normally again right after the end
+        injected = []
+        injectionSteps = np.linspace(0, count, injections + 2)[1:-1].astype(int) if injections else []
+        edges = np.ones(count)
+        for index in injectionSteps:
+            product = self.rng.integers(self.injectedProducts)
+            products[index] = product
+            end = min(int(index + injectionDuration * rate), count - 1)
+            within = np.flatnonzero(products[index:end] == product) + index
+            edges[within] = 1 + edge
+            products[end] = product
+            injected.append({'time': times[index], 'end': times[end], 'leg': (self.pairs[product], 'ask')})
+
+        mids = np.exp(logValues[step, self.base[products]] - logValues[step, self.quote[products]]
+                      + self.rng.normal(0, self.noise, count)) * edges
+        return {
+            'time': times, 'product': products,
+            'bid': mids * (1 - self.spread / 2), 'ask': mids * (1 + self.spread / 2),
+            'bidSize': self.rng.uniform(0.1, 10, count), 'askSize': self.rng.uniform(0.1, 10, count),
+            'injections': injected
+        }
+
+
+class StressTest(object):
+    def __init__(self, market: SyntheticMarket, feeRatio: float = 0.001, topRoutes: int = 5):
+        self.market = market
+        self.feeRatio = feeRatio
+        self.topRoutes = topRoutes
+
+    def run(self, stream: Dict, maxLag: float = 0.05) -> Dict:
+        '''
+        Feed a stream to a new scanner and return the measures of the run. The
+        scanner keeps up with the stream when it ends less than maxLag behind it.
+        '''
+        scanner = TriangleScanner(self.market.products, self.feeRatio)
+        pairs = self.market.pairs
+        times = stream['time']
+        columns = [stream[name].tolist() for name in ('product', 'bid', 'ask', 'bidSize', 'askSize')]
+        injections = sorted(stream['injections'], key=lambda injection: injection['time'])
+        for injection in injections:
+            injection['detected'] = None
+
+        clock = float(times[0])
+        start = 0
+        count = len(times)
+        batches, lags, busy = [], [], 0.0
+        falseReports = 0
+        nextInjection = 0
+        while start < count:
+            end = int(np.searchsorted(times, clock, 'right'))
+            if end <= start:
+                # Waiting for the next update
+                clock = float(times[start])
+                continue
+
+            began = time.perf_counter()
+            for index in range(start, end):
+                scanner.update_quote(pairs[columns[0][index]], {
+                    'bid': {'price': columns[1][index], 'amount': columns[3][index]},
+                    'ask': {'price': columns[2][index], 'amount': columns[4][index]}})
+            routes = scanner.top_routes(self.topRoutes, 1.0, scanner.evaluate())
+            elapsed = time.perf_counter() - began
+            busy += elapsed
+            clock += elapsed
+            batches.append(end - start)
+            lags.append(clock - float(times[end - 1]))
+
+            # Injected cycles live during this batch
+            while nextInjection < len(injections) and injections[nextInjection]['end'] < times[start]:
+                nextInjection += 1
+            live = [injection for injection in injections[nextInjection:]
+                    if injection['time'] <= times[end - 1]]
+            for route in routes:
+                legs = {(order['tickerPair'], order['action']) for order in route['orderInfo']}
+                matched = [injection for injection in live if injection['leg'] in legs]
+                if not matched:
+                    falseReports += 1
+                for injection in matched:
+                    if injection['detected'] is None:
+                        injection['detected'] = clock - injection['time']
+            start = end
+
+        latencies = np.array([injection['detected'] for injection in injections if injection['detected'] is not None])
+        duration = float(times[-1] - times[0]) or 1.0
+        return {
+            'updates': count,
+            'rate': count / duration,
+            'evaluations': len(batches),
+            'meanBatch': float(np.mean(batches)),
+            'lagP99': float(np.percentile(lags, 99)),
+            'finalLag': lags[-1],
+            # Share of the time spent evaluating, the rest waiting for updates
+            'utilization': busy / duration,
+            'keepsUp': lags[-1] < maxLag,
+            'injected': len(injections),
+            'recall': len(latencies) / len(injections) if injections else None,
+            'latencyP50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+            'latencyP99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            'falseReports': falseReports
+        }
+
+
+if __name__ == '__main__':
+    market = SyntheticMarket(seed=0)
+    test = StressTest(market, feeRatio=0.001)
+    print('{0} products, {1} triangular routes'.format(
+        len(market.products), len(TriangleScanner(market.products).routePairs)))
+    print('{0:>8} {1:>8} {2:>9} {3:>6} {4:>10} {5:>10} {6:>7} {7:>11} {8:>11} {9:>6}'.format(
+        'rate', 'evals', 'batch', 'busy', 'lag p99', 'final lag', 'recall', 'detect p50', 'detect p99', 'false'))
+
+    def ms(value):
+        return '{0:.2f} ms'.format(value * 1000) if value is not None else 'n/a'
+
+    # The injected cycles last 50 ms, the scanner keeps up while its lag stays below it
+    sustained = None
+    for rate in [10000, 50000, 100000, 200000, 400000, 800000, 1600000]:
+        stream = market.generate(duration=2, rate=rate, injections=40, edge=0.01, injectionDuration=0.05)
+        result = test.run(stream, maxLag=0.05)
+        print('{0:>8} {1:>8} {2:>9.1f} {3:>6.0%} {4:>10} {5:>10} {6:>7.0%} {7:>11} {8:>11} {9:>6}'.format(
+            rate, result['evaluations'], result['meanBatch'], result['utilization'], ms(result['lagP99']),
+            ms(result['finalLag']), result['recall'], ms(result['latencyP50']), ms(result['latencyP99']),
+            result['falseReports']))
+        if result['keepsUp']:
+            sustained = rate
+    print('Highest rate sustained: {0} updates per second'.format(sustained))
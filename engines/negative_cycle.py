@@ -0,0 +1,326 @@
+'''
+Detector of arbitrage routes of arbitrary length.
+
+Each product gives two edges in a currency graph, weighted with -log(rate) once
+the fees are applied, so that a route is profitable when the sum of its weights
+is negative. A cycle can only become profitable when the weight of one of its
+edges decreases, so the detection is incremental: the profitable cycles found
+are kept while they stay profitable, and only the cycles going through an edge
+whose weight decreased since the last detection are looked for. They are found
+with a depth first search bounded by the maximum length of a route, pruned
+with the lightest walk of each number of legs back to the edge, computed with
+a few vectorized Bellman-Ford rounds. Every profitable cycle between the
+minimum and maximum length is reported.
+'''
+
+from typing import Dict, List, Tuple
+import math
+import numpy as np
+
+# Weights are compared with this tolerance to avoid reporting rounding noise
+EPSILON = 1e-12
+
+
+class NegativeCycleDetector(object):
+    def __init__(self, products: List[Dict[str, str]], feeRatio: float = 0.0, minLength: int = 3, maxLength: int = 5):
+        '''
+        Build the currency graph from the products of an exchange, given as a list
+        of dictionnaries looking like {'pair': 'ADA-ETH', 'base': 'ADA', 'quote': 'ETH'}.
+
+        Only the cycles having between minLength and maxLength legs are reported.
+        '''
+        self.feeLog = -math.log(1 - feeRatio)
+        self.minLength = minLength
+        self.maxLength = maxLength
+
+        self.currencies = []
+        self.currencyIndex = {}
+
+        # Edges, one per direction of each product
+        self.edgeSrc = []
+        self.edgeDst = []
+        self.edgePair = []
+        self.edgeIsBid = []
+        self.weights = []
+        self.capacities = []
+        self.pairEdges = {}
+        for product in products:
+            src, dst = self._node(product['quote']), self._node(product['base'])
+            # Buying the base currency with the quote currency, then selling it
+            bidEdge = self._add_edge(src, dst, product['pair'], True)
+            askEdge = self._add_edge(dst, src, product['pair'], False)
+            self.pairEdges[product['pair']] = (bidEdge, askEdge)
+
+        nbNodes = len(self.currencies)
+        self.outEdges = [[] for _ in range(nbNodes)]
+        for edge in range(len(self.edgeSrc)):
+            self.outEdges[self.edgeSrc[edge]].append(edge)
+        self.srcArray = np.array(self.edgeSrc, dtype=np.int64)
+        self.dstArray = np.array(self.edgeDst, dtype=np.int64)
+
+        # Profitable cycles known, by canonical tuple of edges, and the edges whose
+        # weight decreased since the last detection
+        self.cycles = {}
+        self.decreased = set()
+
+        # Counter of the last detect() call
+        self.pathsVisited = 0
+
+    def _node(self, currency: str) -> int:
+        if currency not in self.currencyIndex:
+            self.currencyIndex[currency] = len(self.currencies)
+            self.currencies.append(currency)
+        return self.currencyIndex[currency]
+
+    def _add_edge(self, src: int, dst: int, pair: str, isBid: bool) -> int:
+        self.edgeSrc.append(src)
+        self.edgeDst.append(dst)
+        self.edgePair.append(pair)
+        self.edgeIsBid.append(isBid)
+        self.weights.append(math.inf)
+        self.capacities.append(0.0)
+        return len(self.edgeSrc) - 1
+
+    def update_quote(self, pair: str, book: Dict[str, Dict[str, float]]):
+        '''
+        Update the two edges of a product from its innermost order book, as returned
+        by get_ticker_orderBook_innermost. The work is done by the next detect().
+        '''
+        bidEdge, askEdge = self.pairEdges[pair]
+        ask, bid = book['ask']['price'], book['bid']['price']
+        # Buying spends ask * amount of the quote currency, selling spends amount of the base one
+        self._set_edge(bidEdge, -math.log(1 / ask) + self.feeLog if ask > 0 else math.inf,
+                       ask * book['ask']['amount'])
+        self._set_edge(askEdge, -math.log(bid) + self.feeLog if bid > 0 else math.inf,
+                       book['bid']['amount'])
+
+    def clear_quote(self, pair: str):
+        '''
+        Forget the order book of a product, its edges can no longer be used
+        '''
+        for edge in self.pairEdges[pair]:
+            self._set_edge(edge, math.inf, 0.0)
+
+    def _set_edge(self, edge: int, weight: float, capacity: float):
+        if weight < self.weights[edge]:
+            self.decreased.add(edge)
+        self.weights[edge] = weight
+        self.capacities[edge] = capacity
+
+    def _lightest_walks(self, target: int, weights: np.ndarray) -> List[List[float]]:
+        '''
+        Return, for each number of legs k up to maxLength - 1, the weight of the
+        lightest walk of at most k legs from every node to the target
+        '''
+        walks = np.full(len(self.currencies), math.inf)
+        walks[target] = 0.0
+        result = [walks.tolist()]
+        for _ in range(self.maxLength - 1):
+            walks = walks.copy()
+            np.minimum.at(walks, self.srcArray, weights + walks[self.dstArray])
+            result.append(walks.tolist())
+        return result
+
+    def _search(self, edge: int, walks: List[List[float]]):
+        '''
+        Record the profitable cycles going through an edge: the simple paths from its
+        destination back to its source, of minLength - 1 to maxLength - 1 legs, lighter
+        than minus its weight. walks are the lightest walks to its source.
+        '''
+        src, dst = self.edgeSrc[edge], self.edgeDst[edge]
+        edgeWeight = self.weights[edge]
+        if edgeWeight + walks[self.maxLength - 1][dst] >= -EPSILON:
+            return
+        path = [edge]
+        visited = {src, dst}
+
+        def extend(node, weight):
+            self.pathsVisited += 1
+            legsLeft = self.maxLength - len(path)
+            for nextEdge in self.outEdges[node]:
+                nextNode = self.edgeDst[nextEdge]
+                nextWeight = weight + self.weights[nextEdge]
+                if nextNode == src:
+                    if len(path) + 1 >= self.minLength and nextWeight < -EPSILON:
+                        self._record_cycle(path + [nextEdge])
+                elif nextNode not in visited and legsLeft > 1 and \
+                        nextWeight + walks[legsLeft - 1][nextNode] < -EPSILON:
+                    path.append(nextEdge)
+                    visited.add(nextNode)
+                    extend(nextNode, nextWeight)
+                    visited.discard(nextNode)
+                    path.pop()
+
+        extend(dst, edgeWeight)
+
+    def _record_cycle(self, edges: List[int]):
+        # Rotate the cycle so the same cycle found from another edge has the same key
+        start = edges.index(min(edges))
+        self.cycles[tuple(edges[start:] + edges[:start])] = True
+
+    def _cycle_weight(self, edges: Tuple[int]) -> float:
+        return sum(self.weights[edge] for edge in edges)
+
+    def detect(self) -> List[Dict]:
+        '''
+        Look for the cycles made profitable by the changes and return all the profitable
+        cycles, sorted from the most to the least profitable. Each cycle is described
+        as the following:
+
+        {
+            'currencies': ['BTC', 'ETH', 'ADA', 'EUR'],
+            'multiplier': 1.0042,
+            'limitingLeg': 2,
+            'maxAmount': 0.15,
+            'orderInfo': [{'tickerPair': 'ETH-BTC', 'action': 'bid', 'price': 0.07}, ...]
+        }
+
+        multiplier is the gross result of the route once the fees are applied, limitingLeg
+        is the index of the leg with the smallest innermost amount and maxAmount this
+        amount expressed in the first currency of the route.
+        '''
+        self.pathsVisited = 0
+
+        # Forget the cycles that are not profitable anymore
+        for key in list(self.cycles):
+            if self._cycle_weight(key) >= -EPSILON:
+                del self.cycles[key]
+
+        if self.decreased:
+            # The lightest walks only depend on the source of the edge, shared by its edges
+            weights = np.array(self.weights)
+            walks = {}
+            for edge in sorted(self.decreased):
+                if self.weights[edge] < math.inf:
+                    src = self.edgeSrc[edge]
+                    if src not in walks:
+                        walks[src] = self._lightest_walks(src, weights)
+                    self._search(edge, walks[src])
+            self.decreased = set()
+
+        cycles = [self.describe_cycle(key) for key in self.cycles]
+        cycles.sort(key=lambda cycle: cycle['multiplier'], reverse=True)
+        return cycles
+
+    def rebuild(self) -> List[Dict]:
+        '''
+        Look for the profitable cycles through every edge, used at startup
+        '''
+        self.cycles = {}
+        self.decreased = set(range(len(self.edgeSrc)))
+        return self.detect()
+
+    def describe_cycle(self, edges: Tuple[int]) -> Dict:
+        orderInfo = []
+        rate = 1.0
+        maxAmount = math.inf
+        limitingLeg = 0
+        for index, edge in enumerate(edges):
+            # Capacity of the leg expressed in the first currency of the route
+            legAmount = self.capacities[edge] / rate
+            if legAmount < maxAmount:
+                maxAmount = legAmount
+                limitingLeg = index
+            rate *= math.exp(-self.weights[edge])
+            price = math.exp(self.weights[edge] - self.feeLog)
+            orderInfo.append({
+                'tickerPair': self.edgePair[edge],
+                'action': 'bid' if self.edgeIsBid[edge] else 'ask',
+                'price': price if self.edgeIsBid[edge] else 1 / price
+            })
+
+        return {
+            'currencies': [self.currencies[self.edgeSrc[edge]] for edge in edges],
+            'multiplier': math.exp(-self._cycle_weight(edges)),
+            'limitingLeg': limitingLeg,
+            'maxAmount': maxAmount,
+            'orderInfo': orderInfo
+        }
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    # Benchmark on a synthetic exchange with a full graph of about 600 products
+    random.seed(0)
+    quotes = ['BTC', 'ETH', 'USD', 'EUR', 'USDT', 'GBP']
+    bases = ['C{0}'.format(i) for i in range(100)]
+    products = [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q} for b in bases for q in quotes]
+    products += [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q} for b in quotes for q in quotes if b < q]
+    value = {currency: random.uniform(0.1, 100) for currency in bases + quotes}
+
+    def book(product, skew=1.0):
+        mid = value[product['base']] / value[product['quote']] * skew
+        return {'bid': {'price': mid * 0.9995, 'amount': 10.0}, 'ask': {'price': mid * 1.0005, 'amount': 10.0}}
+
+    detector = NegativeCycleDetector(products, feeRatio=0.001)
+    for product in products:
+        detector.update_quote(product['pair'], book(product))
+
+    start = time.perf_counter()
+    cycles = detector.rebuild()
+    fullTime = time.perf_counter() - start
+    print('{0} currencies, {1} edges, full detection {2:.2f} ms, {3} cycles'.format(
+        len(detector.currencies), len(detector.weights), fullTime * 1000, len(cycles)))
+
+    # Single changed quotes only search the cycles through their edges
+    ticks = 2000
+    start = time.perf_counter()
+    for _ in range(ticks):
+        product = random.choice(products)
+        detector.update_quote(product['pair'], book(product, random.uniform(0.9995, 1.0005)))
+        detector.detect()
+    print('incremental tick {0:.3f} ms'.format((time.perf_counter() - start) / ticks * 1000))
+
+    # A 4-leg opportunity: USD -> C1 -> EUR -> C2 -> USD
+    for product in products:
+        if product['pair'] in ('C1-EUR', 'C2-EUR'):
+            detector.update_quote(product['pair'], book(product, 1.01 if product['base'] == 'C1' else 0.99))
+    start = time.perf_counter()
+    cycles = detector.detect()
+    print('injected cycle detected in {0:.3f} ms, {1} profitable cycles'.format(
+        (time.perf_counter() - start) * 1000, len(cycles)))
+    for cycle in cycles[:5]:
+        print(cycle['currencies'], cycle['multiplier'], cycle['limitingLeg'], cycle['maxAmount'])
+
+    # Every profitable cycle of 4 or 5 legs is reported, checked against a brute
+    # force enumeration of the simple cycles of small random graphs
+    import itertools
+
+    def brute_force(detector):
+        found = set()
+
+        def extend(start, node, path, weight):
+            for edge in detector.outEdges[node]:
+                nextNode, nextWeight = detector.edgeDst[edge], weight + detector.weights[edge]
+                if nextNode == start and detector.minLength <= len(path) + 1 and nextWeight < -EPSILON:
+                    edges = path + [edge]
+                    first = edges.index(min(edges))
+                    found.add(tuple(edges[first:] + edges[:first]))
+                elif nextNode > start and len(path) + 1 < detector.maxLength and \
+                        nextNode not in [detector.edgeSrc[e] for e in path]:
+                    extend(start, nextNode, path + [edge], nextWeight)
+
+        for start in range(len(detector.currencies)):
+            extend(start, start, [], 0.0)
+        return found
+
+    graphs = 0
+    for seed in range(200):
+        random.seed(seed)
+        currencies = ['K{0}'.format(i) for i in range(random.randint(5, 9))]
+        value = {currency: random.uniform(0.1, 10) for currency in currencies}
+        products = [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q}
+                    for b, q in itertools.combinations(currencies, 2) if random.random() < 0.6]
+        detector = NegativeCycleDetector(products, feeRatio=0.001, minLength=4, maxLength=5)
+        for _ in range(3):
+            for product in products:
+                detector.update_quote(product['pair'], book(product, random.gauss(1, 0.006)))
+            reported = {tuple(sorted((order['tickerPair'], order['action']) for order in cycle['orderInfo']))
+                        for cycle in detector.detect()}
+            expected = {tuple(sorted((detector.edgePair[edge], 'bid' if detector.edgeIsBid[edge] else 'ask')
+                                     for edge in cycle)) for cycle in brute_force(detector)}
+            assert reported == expected, (seed, reported ^ expected)
+            graphs += bool(expected)
+    print('all the profitable cycles reported on {0} random graphs having some'.format(graphs))
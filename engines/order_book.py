@@ -0,0 +1,234 @@
+'''
+Local order book kept in compact sorted NumPy arrays.
+
+Each side stores its levels sorted so that the best price is the last element:
+the bids by increasing price and the asks by decreasing price. A level is found
+with a binary search (O(log n)), the best bid and ask are read in O(1), and as
+most of the updates happen close to the top of the book, inserting or removing
+a level only moves the few elements placed after it. The top N levels are
+returned as NumPy views, without any copy.
+'''
+
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+class BookSide(object):
+    def __init__(self, isBid: bool, capacity: int = 64):
+        self.isBid = isBid
+        # Search keys are sorted in increasing order: the price for the bids, minus the price for the asks
+        self.keys = np.empty(capacity)
+        self.prices = self.keys if isBid else np.empty(capacity)
+        self.sizes = np.empty(capacity)
+        self.count = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def _grow(self):
+        capacity = 2 * len(self.keys)
+        count = self.count
+        keys = np.empty(capacity)
+        keys[:count] = self.keys[:count]
+        sizes = np.empty(capacity)
+        sizes[:count] = self.sizes[:count]
+        if self.isBid:
+            self.prices = keys
+        else:
+            prices = np.empty(capacity)
+            prices[:count] = self.prices[:count]
+            self.prices = prices
+        self.keys = keys
+        self.sizes = sizes
+
+    def load(self, prices, sizes):
+        '''
+        Replace all the levels of the side, the levels can be given in any order
+        '''
+        prices = np.asarray(prices, dtype=float)
+        sizes = np.asarray(sizes, dtype=float)
+        keep = sizes > 0
+        prices, sizes = prices[keep], sizes[keep]
+        keys = prices if self.isBid else -prices
+        order = np.argsort(keys, kind='stable')
+        count = len(order)
+
+        capacity = max(len(self.keys), 64)
+        while capacity < count:
+            capacity *= 2
+        self.keys = np.empty(capacity)
+        self.keys[:count] = keys[order]
+        self.sizes = np.empty(capacity)
+        self.sizes[:count] = sizes[order]
+        if self.isBid:
+            self.prices = self.keys
+        else:
+            self.prices = np.empty(capacity)
+            self.prices[:count] = prices[order]
+        self.count = count
+
+    def update(self, price: float, size: float):
+        '''
+        Set the size of a price level, a size of 0 removes the level
+        '''
+        key = price if self.isBid else -price
+        count = self.count
+        index = int(self.keys[:count].searchsorted(key))
+        exists = index < count and self.keys[index] == key
+
+        if size == 0:
+            if exists:
+                self.keys[index:count - 1] = self.keys[index + 1:count]
+                self.sizes[index:count - 1] = self.sizes[index + 1:count]
+                if not self.isBid:
+                    self.prices[index:count - 1] = self.prices[index + 1:count]
+                self.count = count - 1
+        elif exists:
+            self.sizes[index] = size
+        else:
+            if count == len(self.keys):
+                self._grow()
+            self.keys[index + 1:count + 1] = self.keys[index:count]
+            self.sizes[index + 1:count + 1] = self.sizes[index:count]
+            self.keys[index] = key
+            self.sizes[index] = size
+            if not self.isBid:
+                self.prices[index + 1:count + 1] = self.prices[index:count]
+                self.prices[index] = price
+            self.count = count + 1
+
+    def best(self) -> Optional[Tuple[float, float]]:
+        if self.count == 0:
+            return None
+        return float(self.prices[self.count - 1]), float(self.sizes[self.count - 1])
+
+    def top(self, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        '''
+        Return views on the prices and sizes of the best levels, best level first
+        '''
+        start = max(self.count - depth, 0)
+        return self.prices[start:self.count][::-1], self.sizes[start:self.count][::-1]
+
+    def snapshot(self) -> Tuple[np.ndarray, np.ndarray]:
+        return self.prices[:self.count].copy(), self.sizes[:self.count].copy()
+
+
+class OrderBook(object):
+    def __init__(self, capacity: int = 64):
+        self.bids = BookSide(True, capacity)
+        self.asks = BookSide(False, capacity)
+
+    def load_snapshot(self, bids: List[List[float]], asks: List[List[float]]):
+        '''
+        Replace the whole book, the levels being given as [[price, size], ...]
+        '''
+        for side, levels in ((self.bids, bids), (self.asks, asks)):
+            levels = np.asarray(levels, dtype=float).reshape(-1, 2)
+            side.load(levels[:, 0], levels[:, 1])
+
+    def update(self, side: str, price: float, size: float):
+        '''
+        Set the size of a level of the 'bid' or 'ask' side, a size of 0 removes the level
+        '''
+        (self.bids if side == 'bid' else self.asks).update(price, size)
+
+    def best_bid(self) -> Optional[Tuple[float, float]]:
+        return self.bids.best()
+
+    def best_ask(self) -> Optional[Tuple[float, float]]:
+        return self.asks.best()
+
+    def top_bids(self, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.bids.top(depth)
+
+    def top_asks(self, depth: int) -> Tuple[np.ndarray, np.ndarray]:
+        return self.asks.top(depth)
+
+    def innermost(self) -> Optional[Dict[str, Dict[str, float]]]:
+        '''
+        Return the best bid and ask with the format of get_ticker_orderBook_innermost,
+        or None when a side of the book is empty
+        '''
+        bid, ask = self.bids.best(), self.asks.best()
+        if bid is None or ask is None:
+            return None
+        return {
+            'bid': {'price': bid[0], 'amount': bid[1]},
+            'ask': {'price': ask[0], 'amount': ask[1]}
+        }
+
+    def depth(self, depth: int) -> Dict[str, List[List[float]]]:
+        '''
+        Return the best levels with the format of get_ticker_orderBook_depth
+        '''
+        result = {}
+        for name, side in (('bids', self.bids), ('asks', self.asks)):
+            prices, sizes = side.top(depth)
+            result[name] = np.column_stack((prices, sizes)).tolist()
+        return result
+
+    def snapshot(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        '''
+        Return a copy of the book that can be given back to restore()
+        '''
+        return {'bids': self.bids.snapshot(), 'asks': self.asks.snapshot()}
+
+    def restore(self, snapshot: Dict[str, Tuple[np.ndarray, np.ndarray]]):
+        self.bids.load(*snapshot['bids'])
+        self.asks.load(*snapshot['asks'])
+
+
+if __name__ == '__main__':
+    import time
+
+    class DictOrderBook(object):
+        '''
+        Baseline keeping each side in a dict, the best price being searched on each read
+        '''
+        def __init__(self):
+            self.bids = {}
+            self.asks = {}
+
+        def update(self, side, price, size):
+            levels = self.bids if side == 'bid' else self.asks
+            if size == 0:
+                levels.pop(price, None)
+            else:
+                levels[price] = size
+
+        def best_bid(self):
+            price = max(self.bids)
+            return price, self.bids[price]
+
+        def best_ask(self):
+            price = min(self.asks)
+            return price, self.asks[price]
+
+    # 1M random level updates around a mid price of 100 with 0.01 ticks, 20% of them removing a level
+    rng = np.random.default_rng(0)
+    updates = 1000000
+    isBid = rng.random(updates) < 0.5
+    distance = np.minimum(rng.geometric(0.02, updates), 1000)
+    prices = np.round(np.where(isBid, 100 - distance * 0.01, 100 + distance * 0.01), 2).tolist()
+    sizes = np.where(rng.random(updates) < 0.2, 0, np.round(rng.uniform(0.1, 10, updates), 3)).tolist()
+    sides = np.where(isBid, 'bid', 'ask').tolist()
+
+    for name, book in (('OrderBook', OrderBook()), ('dict baseline', DictOrderBook())):
+        # Start from 200 levels on each side
+        for tick in range(1, 201):
+            book.update('bid', round(100 - tick * 0.01, 2), 1.0)
+            book.update('ask', round(100 + tick * 0.01, 2), 1.0)
+
+        start = time.perf_counter()
+        for side, price, size in zip(sides, prices, sizes):
+            book.update(side, price, size)
+            book.best_bid()
+            book.best_ask()
+        elapsed = time.perf_counter() - start
+        print('{0}: {1:.2f} s, {2:.2f} us per update + best bid/ask'.format(name, elapsed, elapsed / updates * 1e6))
+
+        if isinstance(book, OrderBook):
+            start = time.perf_counter()
+            book.restore(book.snapshot())
+            print('{0} levels, snapshot + restore {1:.1f} us'.format(
+                len(book.bids) + len(book.asks), (time.perf_counter() - start) * 1e6))
@@ -0,0 +1,140 @@
+'''
+Per-product polling schedule adapted to how fast each order book moves.
+
+The last quotes of each product are kept in a ring buffer. From them the
+realized variance per second of the best bid and ask (in log) is estimated, and
+a product is polled about as often as it takes for its quotes to move by
+targetMove: a product whose prices or spread move is polled more often, a dead
+one backs off down to maxInterval. The products of routes close to being
+profitable are polled every minInterval. When the resulting request rate is
+above the rate allowed for polling, all the intervals are stretched by the same
+ratio.
+'''
+
+import asyncio
+import time
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class PollingScheduler(object):
+    def __init__(self, pairs: List[str], minInterval: float = 0.5, maxInterval: float = 30,
+                 requestRate: Optional[float] = None, targetMove: float = 1e-4, historySize: int = 32):
+        '''
+        pairs: the products to poll
+        requestRate: requests per second that can be used for polling, not limited when None
+        targetMove: relative move of the quotes expected between two polls of a product
+        '''
+        self.pairs = list(pairs)
+        self.index = {pair: i for i, pair in enumerate(self.pairs)}
+        self.minInterval = minInterval
+        self.maxInterval = maxInterval
+        self.requestRate = requestRate
+        self.targetMove = targetMove
+
+        # Ring buffers of the last quotes: log of the best bid and ask, and time received
+        nbPairs = len(self.pairs)
+        self.logBids = np.zeros((nbPairs, historySize))
+        self.logAsks = np.zeros((nbPairs, historySize))
+        self.times = np.zeros((nbPairs, historySize))
+        self.counts = np.zeros(nbPairs, dtype=int)
+
+        # Interval wanted for each product, before the rate limit is applied
+        self.intervals = np.full(nbPairs, minInterval)
+        self.near = np.zeros(nbPairs, dtype=bool)
+        self.lastPoll = np.full(nbPairs, -np.inf)
+
+    def record(self, pair: str, book: Dict[str, Dict[str, float]], now: Optional[float] = None):
+        '''
+        Add the innermost order book of a product just polled and update its interval
+        '''
+        i = self.index[pair]
+        now = time.monotonic() if now is None else now
+        slot = self.counts[i] % self.logBids.shape[1]
+        self.logBids[i, slot] = np.log(book['bid']['price'])
+        self.logAsks[i, slot] = np.log(book['ask']['price'])
+        self.times[i, slot] = now
+        self.counts[i] += 1
+        self.lastPoll[i] = now
+        self.intervals[i] = self._interval(i)
+
+    def polled(self, pair: str, now: Optional[float] = None):
+        '''
+        Reschedule a product whose poll failed, keeping its interval
+        '''
+        self.lastPoll[self.index[pair]] = time.monotonic() if now is None else now
+
+    def _interval(self, i: int) -> float:
+        count = min(self.counts[i], self.logBids.shape[1])
+        if count < 2:
+            return self.minInterval
+        # Samples of the ring buffer in the order they were received
+        order = np.argsort(self.times[i, :count])
+        elapsed = self.times[i, order[-1]] - self.times[i, order[0]]
+        moves = np.diff(self.logBids[i, order]) ** 2 + np.diff(self.logAsks[i, order]) ** 2
+        variance = moves.sum() / 2 / elapsed if elapsed > 0 else 0
+        if variance == 0:
+            return self.maxInterval
+        return float(np.clip(self.targetMove ** 2 / variance, self.minInterval, self.maxInterval))
+
+    def set_near(self, pairs: List[str]):
+        '''
+        Set the products of the routes close to being profitable, polled every minInterval
+        '''
+        self.near[:] = False
+        for pair in pairs:
+            if pair in self.index:
+                self.near[self.index[pair]] = True
+
+    def effective_intervals(self) -> np.ndarray:
+        '''
+        Return the interval of each product, stretched if needed to stay within the request rate
+        '''
+        intervals = np.where(self.near, self.minInterval, self.intervals)
+        if self.requestRate:
+            rate = (1 / intervals).sum()
+            if rate > self.requestRate:
+                intervals = intervals * (rate / self.requestRate)
+        return intervals
+
+    def due(self, now: Optional[float] = None) -> List[str]:
+        now = time.monotonic() if now is None else now
+        nextPoll = self.lastPoll + self.effective_intervals()
+        return [self.pairs[i] for i in np.flatnonzero(nextPoll <= now)]
+
+    async def wait(self) -> List[str]:
+        '''
+        Wait until at least one product has to be polled and return the products due
+        '''
+        while True:
+            now = time.monotonic()
+            nextPoll = self.lastPoll + self.effective_intervals()
+            due = np.flatnonzero(nextPoll <= now)
+            if len(due):
+                return [self.pairs[i] for i in due]
+            await asyncio.sleep(float(nextPoll.min() - now))
+
+    def describe(self) -> Dict[str, float]:
+        return dict(zip(self.pairs, self.effective_intervals().tolist()))
+
+
+if __name__ == '__main__':
+    # Three products: one random walking fast, one slowly, one frozen, with 5 requests per second allowed
+    rng = np.random.default_rng(0)
+    scheduler = PollingScheduler(['FAST', 'SLOW', 'DEAD'], 0.2, 30, requestRate=5)
+    volatility = {'FAST': 2e-4, 'SLOW': 2e-5, 'DEAD': 0}
+    mids = dict.fromkeys(volatility, 100.0)
+
+    # Simulated clock: poll each product when due, the mid moving with its volatility per sqrt(second)
+    now = 0.0
+    polls = dict.fromkeys(volatility, 0)
+    while now < 600:
+        for pair in scheduler.due(now):
+            elapsed = max(now - scheduler.lastPoll[scheduler.index[pair]], 0) if polls[pair] else 0
+            mids[pair] *= np.exp(volatility[pair] * np.sqrt(elapsed) * rng.standard_normal())
+            scheduler.record(pair, {'bid': {'price': mids[pair] * 0.9999}, 'ask': {'price': mids[pair] * 1.0001}}, now)
+            polls[pair] += 1
+        now += 0.05
+    for pair, interval in scheduler.describe().items():
+        print('{0}: polled {1} times in 600 s, interval now {2:.2f} s'.format(pair, polls[pair], interval))
+    print('{0:.2f} requests per second'.format(sum(polls.values()) / 600))
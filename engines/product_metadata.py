@@ -0,0 +1,214 @@
+'''
+Trading rules of the products of an exchange, used to place orders it accepts.
+
+The price increment (tick), the amount increment (lot), the minimum and maximum
+sizes and the status of each product are loaded once at startup and refreshed in
+the background. The increments are turned into integer scales when loaded: a
+price or an amount is then rounded as an integer number of ticks or lots, and
+written in decimal from that integer, so that no float artefact (0.30000000000000004,
+1e-05) reaches the exchange. A product whose trading is disabled is known
+without a request.
+'''
+
+import asyncio
+import math
+from decimal import Decimal
+from typing import Dict, List, Optional
+# Puts the modules of the adapters on the path
+import engines.exchanges.loader
+from base import ExchangeException
+from utils.logging import crypto_arb_log
+
+
+class ProductMetadata(object):
+    def __init__(self, details: Dict):
+        '''
+        details: the rules of a product as returned by the get_product_details method of an engine
+        '''
+        self.pair = details['pair']
+        self.tradable = details.get('tradable', True)
+        self.priceDecimals, self.tickUnits = self.integer_scale(details['tickSize'])
+        self.amountDecimals, self.lotUnits = self.integer_scale(details['lotSize'])
+        self.priceScale = 10 ** self.priceDecimals
+        self.amountScale = 10 ** self.amountDecimals
+        self.minSize = float(details.get('minSize') or 0)
+        self.maxSize = float(details['maxSize']) if details.get('maxSize') else math.inf
+        self.minFunds = float(details['minFunds']) if details.get('minFunds') else 0.0
+
+    @staticmethod
+    def integer_scale(increment: str):
+        '''
+        Return the number of decimals of an increment and the increment in units of
+        the last decimal: '0.00025' gives (5, 25)
+        '''
+        exponent = Decimal(str(increment)).normalize().as_tuple().exponent
+        decimals = max(-exponent, 0)
+        return decimals, max(int(Decimal(str(increment)).scaleb(decimals)), 1)
+
+    @staticmethod
+    def _units(value: float, scale: int, step: int, up: bool) -> int:
+        # The tolerance absorbs the float error of value * scale, e.g. 0.29 * 100 = 28.999999999999996
+        if up:
+            return -(-math.ceil(value * scale - 1e-6) // step) * step
+        return math.floor(value * scale + 1e-6) // step * step
+
+    @staticmethod
+    def _format(units: int, decimals: int) -> str:
+        if not decimals:
+            return str(units)
+        return '{0}.{1:0{2}d}'.format(units // 10 ** decimals, units % 10 ** decimals, decimals)
+
+    def round_price(self, price: float, up: bool = False) -> str:
+        '''
+        Round a price to the tick, down for a buy and up for a sell so that the limit
+        is never more aggressive than computed
+        '''
+        return self._format(self._units(price, self.priceScale, self.tickUnits, up), self.priceDecimals)
+
+    def round_amount(self, amount: float) -> Optional[str]:
+        '''
+        Round an amount down to the lot and the maximum size, None when below the minimum size
+        '''
+        units = self._units(min(amount, self.maxSize), self.amountScale, self.lotUnits, False)
+        if units <= 0 or units < self.minSize * self.amountScale - 1e-6:
+            return None
+        return self._format(units, self.amountDecimals)
+
+
+class ProductMetadataCache(object):
+    def __init__(self, engine, refreshInterval: float = 3600):
+        self.engine = engine
+        self.refreshInterval = refreshInterval
+        self.products = {}
+        self.task = None
+
+    async def load(self):
+        '''
+        Get the rules of the products from the exchange. An engine without
+        get_product_details leaves the orders as they are.
+        '''
+        if not hasattr(self.engine, 'get_product_details'):
+            return
+        details = await self.engine.get_product_details()
+        self.products = {product['pair']: ProductMetadata(product) for product in details}
+        disabled = [pair for pair, product in self.products.items() if not product.tradable]
+        crypto_arb_log.info('Rules of {0} products loaded, {1} not tradable'.format(len(self.products), len(disabled)))
+
+    def start(self):
+        '''
+        Start the background refresh of the rules
+        '''
+        if self.task is None:
+            self.task = asyncio.ensure_future(self.run())
+        return self.task
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.refreshInterval)
+            try:
+                await self.load()
+            except (Exception, ExchangeException) as e:
+                crypto_arb_log.error('Refresh of the product rules failed: {0}'.format(e))
+
+    def tradable(self, pair: str) -> bool:
+        product = self.products.get(pair)
+        return product is None or product.tradable
+
+    def round_order(self, pair: str, action: str, amount: float, price: float) -> Optional[Dict]:
+        '''
+        Return the amount and price of an order, rounded to the rules of its product
+        and written in decimal, or None when the exchange would reject it
+        '''
+        product = self.products.get(pair)
+        if product is None:
+            return {'amount': amount, 'price': price}
+        if not product.tradable:
+            return None
+        roundedAmount = product.round_amount(amount)
+        roundedPrice = product.round_price(price, up=(action == 'ask'))
+        if roundedAmount is None or float(roundedAmount) * float(roundedPrice) < product.minFunds:
+            return None
+        return {'amount': roundedAmount, 'price': roundedPrice}
+
+    def round_orders(self, orders: List[Dict]) -> Optional[List[Dict]]:
+        '''
+        Round the orders of a route ({'tickerPair', 'action', 'amount', 'price'}),
+        None when one of them would be rejected
+        '''
+        result = []
+        for order in orders:
+            rounded = self.round_order(order['tickerPair'], order['action'], order['amount'], order['price'])
+            if rounded is None:
+                crypto_arb_log.info('Order {0} below the rules of the product, not placed'.format(order))
+                return None
+            result.append(dict(order, **rounded))
+        return result
+
+
+if __name__ == '__main__':
+    import random
+    import time
+
+    product = ProductMetadata({'pair': 'ADA-ETH', 'tickSize': '0.00000025', 'lotSize': '0.1',
+                               'minSize': '1', 'maxSize': '1000000', 'minFunds': '0.001'})
+
+    # Edge cases of the rounding, checked before the timings
+    # Exactly on a tick: unchanged both ways; just off a tick: down for a buy, up for a sell
+    assert product.round_price(0.00074125) == '0.00074125'
+    assert product.round_price(0.00074125, up=True) == '0.00074125'
+    assert product.round_price(0.00074125 + 1e-10) == '0.00074125'
+    assert product.round_price(0.00074125 + 1e-10, up=True) == '0.00074150'
+    assert product.round_price(0.00074125 - 1e-10) == '0.00074100'
+    assert product.round_price(0.00074125 - 1e-10, up=True) == '0.00074125'
+    # Float artefacts do not move a value off its lot, amounts are always rounded down
+    assert product.round_amount(0.1 * 3 * 4) == '1.2'
+    assert product.round_amount(0.1 + 0.2 + 1) == '1.3'
+    assert product.round_amount(1.29) == '1.2'
+    assert product.round_amount(2e6) == '1000000.0'
+    # Minimum size: the minimum itself is accepted, anything rounded below it is not
+    assert product.round_amount(1) == '1.0'
+    assert product.round_amount(1.09) == '1.0'
+    assert product.round_amount(0.99) is None
+    assert product.round_amount(0.04) is None
+    # Minimum funds, on the rounded amount and price
+    cache = ProductMetadataCache(None)
+    cache.products = {'ADA-ETH': product, 'ETH-BTC': ProductMetadata(
+        {'pair': 'ETH-BTC', 'tickSize': '0.00001', 'lotSize': '0.001', 'tradable': False})}
+    assert cache.round_order('ADA-ETH', 'bid', 1, 0.001) == {'amount': '1.0', 'price': '0.00100000'}
+    assert cache.round_order('ADA-ETH', 'bid', 1, 0.00099999) is None
+    assert cache.round_order('ADA-ETH', 'ask', 1.05, 0.00099999) == {'amount': '1.0', 'price': '0.00100000'}
+    assert cache.round_order('ADA-ETH', 'bid', 1.99, 0.0005) is None
+    assert cache.round_order('ADA-ETH', 'bid', 2, 0.0005) == {'amount': '2.0', 'price': '0.00050000'}
+    # A disabled product rejects its orders, an unknown one leaves them as they are
+    assert cache.round_order('ETH-BTC', 'bid', 1, 0.07) is None
+    assert cache.round_order('LTC-BTC', 'bid', 1, 0.07) == {'amount': 1, 'price': 0.07}
+    assert cache.round_orders([{'tickerPair': 'ADA-ETH', 'action': 'bid', 'amount': 2, 'price': 0.0005},
+                               {'tickerPair': 'ADA-ETH', 'action': 'ask', 'amount': 0.5, 'price': 0.0005}]) is None
+    print(product.round_price(0.00074123456), product.round_price(0.00074123456, up=True),
+          product.round_amount(0.3 * 3), product.round_amount(12.29), product.round_amount(0.1 + 0.2 + 2))
+
+    random.seed(0)
+    values = [random.uniform(0.5, 5000) for _ in range(100000)]
+    start = time.perf_counter()
+    for value in values:
+        product.round_amount(value)
+        product.round_price(value / 1e6)
+    integerTime = (time.perf_counter() - start) / len(values)
+
+    tick, lot = Decimal('0.00000025'), Decimal('0.1')
+    start = time.perf_counter()
+    for value in values:
+        str((Decimal(value) / lot).to_integral_value(rounding='ROUND_FLOOR') * lot)
+        str((Decimal(value / 1e6) / tick).to_integral_value(rounding='ROUND_FLOOR') * tick)
+    decimalTime = (time.perf_counter() - start) / len(values)
+    print('rounding of an order: {0:.2f} us with integer scales, {1:.2f} us with Decimal'.format(
+        integerTime * 1e6, decimalTime * 1e6))
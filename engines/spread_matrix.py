@@ -0,0 +1,149 @@
+'''
+Cross-exchange spreads of many assets at once.
+
+The best bid and ask of each asset on each venue are kept in bids[venue, asset]
+and asks[venue, asset] arrays, updated in place as quotes arrive, along with
+their values net of the venue fee. The spread of buying an asset on a venue and
+selling it on another one, fees included, is then computed for all the venue
+pairs and all the assets with a single broadcast operation:
+
+    net[buyVenue, sellVenue, asset] = bid[sellVenue] * (1 - fee[sellVenue])
+                                      / (ask[buyVenue] * (1 + fee[buyVenue])) - 1
+
+A missing quote is stored as a bid of 0 and an ask of +inf, which gives a spread
+of -1 and never an opportunity.
+'''
+
+from typing import Dict, List
+import numpy as np
+
+
+class SpreadMatrix(object):
+    def __init__(self, venues: List[str], assets: List[str], feeRatios: List[float]):
+        self.venues = list(venues)
+        self.assets = list(assets)
+        self.venueIndex = {venue: i for i, venue in enumerate(self.venues)}
+        self.assetIndex = {asset: i for i, asset in enumerate(self.assets)}
+        nbVenues, nbAssets = len(self.venues), len(self.assets)
+
+        self.feeRatios = np.asarray(feeRatios, dtype=float)
+        self.bids = np.zeros((nbVenues, nbAssets))
+        self.asks = np.full((nbVenues, nbAssets), np.inf)
+        # Bid received and ask paid per unit of asset, fees included
+        self.netBids = np.zeros((nbVenues, nbAssets))
+        self.netAsks = np.full((nbVenues, nbAssets), np.inf)
+        self.net = np.empty((nbVenues, nbVenues, nbAssets))
+        self.sameVenue = np.eye(nbVenues, dtype=bool)
+
+    def update(self, venue: str, asset: str, bid: float, ask: float):
+        v, a = self.venueIndex[venue], self.assetIndex[asset]
+        self.bids[v, a] = bid
+        self.asks[v, a] = ask
+        self.netBids[v, a] = bid * (1 - self.feeRatios[v])
+        self.netAsks[v, a] = ask * (1 + self.feeRatios[v])
+
+    def update_book(self, venue: str, asset: str, book: Dict[str, Dict[str, float]]):
+        '''
+        Update from an innermost order book, as returned by get_ticker_orderBook_innermost
+        '''
+        self.update(venue, asset, book['bid']['price'], book['ask']['price'])
+
+    def clear(self, venue: str, asset: str):
+        self.update(venue, asset, 0.0, np.inf)
+
+    def net_spreads(self) -> np.ndarray:
+        '''
+        Return the [buyVenue, sellVenue, asset] tensor of the relative spreads net of
+        fees, buying and selling on the same venue being excluded (-inf)
+        '''
+        np.divide(self.netBids[np.newaxis, :, :], self.netAsks[:, np.newaxis, :], out=self.net)
+        self.net -= 1
+        self.net[self.sameVenue] = -np.inf
+        return self.net
+
+    def best(self) -> Dict[str, np.ndarray]:
+        '''
+        Return for each asset the best venue pair and its spread
+        '''
+        net = self.net_spreads()
+        nbVenues = len(self.venues)
+        flat = net.reshape(nbVenues * nbVenues, len(self.assets))
+        best = flat.argmax(axis=0)
+        return {
+            'buyVenue': best // nbVenues,
+            'sellVenue': best % nbVenues,
+            'spread': flat[best, np.arange(len(self.assets))]
+        }
+
+    def opportunities(self, minSpread: float = 0.0) -> List[Dict]:
+        '''
+        Return the assets whose best spread is above minSpread, from the best one
+        '''
+        best = self.best()
+        result = []
+        for a in np.argsort(best['spread'])[::-1]:
+            if best['spread'][a] <= minSpread:
+                break
+            buy, sell = best['buyVenue'][a], best['sellVenue'][a]
+            result.append({
+                'asset': self.assets[a],
+                'buyVenue': self.venues[buy],
+                'sellVenue': self.venues[sell],
+                'ask': float(self.asks[buy, a]),
+                'bid': float(self.bids[sell, a]),
+                'spread': float(best['spread'][a])
+            })
+        return result
+
+
+if __name__ == '__main__':
+    import time
+
+    # 20 assets on 5 venues, quotes updated one at a time around a common mid price
+    rng = np.random.default_rng(0)
+    venues = ['venue{0}'.format(v) for v in range(5)]
+    assets = ['asset{0}'.format(a) for a in range(20)]
+    feeRatios = [0.001, 0.002, 0.0026, 0.0026, 0.005]
+    matrix = SpreadMatrix(venues, assets, feeRatios)
+
+    mids = rng.uniform(1, 1000, len(assets))
+    updates = 100000
+    venueUpdates = rng.integers(len(venues), size=updates).tolist()
+    assetUpdates = rng.integers(len(assets), size=updates).tolist()
+    prices = (mids[assetUpdates] * rng.normal(1, 0.003, updates)).tolist()
+
+    start = time.perf_counter()
+    for v, a, price in zip(venueUpdates, assetUpdates, prices):
+        matrix.update(venues[v], assets[a], price * 0.9995, price * 1.0005)
+    updateTime = (time.perf_counter() - start) / updates
+
+    loops = 10000
+    start = time.perf_counter()
+    for _ in range(loops):
+        matrix.opportunities()
+    vectorTime = (time.perf_counter() - start) / loops
+
+    def loop_spreads():
+        '''
+        Baseline computing the same spreads with Python loops
+        '''
+        best = {}
+        for a, asset in enumerate(assets):
+            for b, buyFee in enumerate(feeRatios):
+                for s, sellFee in enumerate(feeRatios):
+                    if b != s:
+                        spread = matrix.bids[s, a] * (1 - sellFee) / (matrix.asks[b, a] * (1 + buyFee)) - 1
+                        if spread > best.get(asset, (-np.inf,))[0]:
+                            best[asset] = (spread, b, s)
+        return best
+
+    start = time.perf_counter()
+    for _ in range(loops // 10):
+        baseline = loop_spreads()
+    loopTime = (time.perf_counter() - start) / (loops // 10)
+
+    best = matrix.best()
+    assert all(abs(best['spread'][a] - baseline[asset][0]) < 1e-12 for a, asset in enumerate(assets))
+    print('{0} venues x {1} assets: update {2:.2f} us, full spread tensor + opportunities {3:.1f} us, '
+          'Python loops {4:.1f} us'.format(len(venues), len(assets), updateTime * 1e6, vectorTime * 1e6, loopTime * 1e6))
+    print('{0} assets with a spread above fees'.format(len(matrix.opportunities())))
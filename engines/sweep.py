@@ -0,0 +1,134 @@
+'''
+Parameter sweeps of the triangular engine over a tick recording.
+
+Each combination of a grid of options of the 'triangular' block (minProfit,
+feeRatio, routes, maxOrderValue, depth...) is backtested on the same recording
+(engines/backtest.py), the combinations being spread across the cores with a
+process pool. Only the path of the recording is sent to the workers: each one
+maps the files with np.memmap, the pages being shared through the page cache,
+and nothing but the small result row comes back. The rows are gathered in one
+table, best profit first.
+
+    grid = {'minProfit': [0.1, 0.3, 1], 'feeRatio': [0.001, 0.005], 'routes': [[1], [2], [1, 2]]}
+    rows = run_sweep(config['triangular'], 'recordings/', grid)
+    print(format_table(rows, list(grid)))
+'''
+
+import asyncio
+import itertools
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+from utils.logging import crypto_arb_log
+
+
+def parameter_grid(grid: Dict[str, List]) -> List[Dict]:
+    '''
+    Return every combination of the values of a grid: {'a': [1, 2], 'b': [3]} gives [{'a': 1, 'b': 3}, {'a': 2, 'b': 3}]
+    '''
+    names = list(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def _init_worker():
+    # The opportunities and rejected orders of thousands of backtests would flood the
+    # output, the rejections are counted in the rejectedOrders of each result instead
+    crypto_arb_log.setLevel(logging.CRITICAL)
+
+
+def run_backtest(config: Dict, recording: str, params: Dict, startValue: float = 1000) -> Dict:
+    '''
+    Backtest one combination and return its row: the parameters and the results
+    '''
+    from engines.backtest import TriangularBacktest
+
+    async def run():
+        backtest = TriangularBacktest(dict(config, **params), recording, startValue)
+        try:
+            return await backtest.run()
+        finally:
+            await backtest.end_engine()
+
+    report = asyncio.run(run())
+    row = dict(params)
+    for key in ['records', 'opportunities', 'orders', 'filledOrders', 'cancelledOrders', 'rejectedOrders', 'fills',
+                'feesValue', 'pnlValue', 'wallTime']:
+        row[key] = report.get(key)
+    return row
+
+
+def run_sweep(config: Dict, recording: str, grid: Dict[str, List], workers: Optional[int] = None,
+              startValue: float = 1000) -> List[Dict]:
+    '''
+    Backtest every combination of a grid across a process pool and return the rows, best profit first
+
+    config: the 'triangular' block of arbitrage_config.json, the values of the grid replacing its keys
+    workers: number of processes, the number of cores when None
+    '''
+    combinations = parameter_grid(grid)
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers, initializer=_init_worker) as executor:
+        rows = list(executor.map(run_backtest, itertools.repeat(config), itertools.repeat(recording),
+                                 combinations, itertools.repeat(startValue)))
+    return sorted(rows, key=lambda row: -row['pnlValue'] if row['pnlValue'] is not None else float('inf'))
+
+
+def format_table(rows: List[Dict], params: List[str]) -> str:
+    columns = params + ['opportunities', 'orders', 'filledOrders', 'cancelledOrders', 'rejectedOrders', 'feesValue', 'pnlValue']
+
+    def cell(value):
+        if isinstance(value, float):
+            return '{0:.4f}'.format(value)
+        return 'n/a' if value is None else str(value)
+
+    cells = [[cell(row.get(column)) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(line[index]) for line in cells]) for index, column in enumerate(columns)]
+    lines = ['  '.join(column.rjust(width) for column, width in zip(columns, widths))]
+    lines += ['  '.join(value.rjust(width) for value, width in zip(line, widths)) for line in cells]
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import random
+    import shutil
+    import tempfile
+    import time
+    from engines.tick_recorder import TickRecorder
+
+    # An hour of books of a triangle, the same generator as the backtest demo
+    directory = tempfile.mkdtemp()
+    recorder = TickRecorder(directory)
+    recorder.start()
+    random.seed(0)
+    ethBtc, adaBtc, btcEur = 0.07, 0.00001, 30000.0
+    for step in range(7200):
+        now = 1700000000 + step * 0.5
+        ethBtc *= random.gauss(1, 0.0002)
+        btcEur *= random.gauss(1, 0.0002)
+        adaBtc *= random.gauss(1, 0.0002)
+        jump = 1.02 if step % 600 == 300 else (0.98 if step % 600 == 0 else 1.0)
+        for pair, mid, size in [('ADA-ETH', adaBtc / ethBtc, 5000.0), ('ETH-BTC', ethBtc, 20.0),
+                                ('ADA-BTC', adaBtc * jump, 5000.0), ('BTC-EUR', btcEur, 2.0)]:
+            recorder.record('coinbase_pro:' + pair, {'bid': {'price': mid * 0.9995, 'amount': size},
+                                                     'ask': {'price': mid * 1.0005, 'amount': size}}, now)
+    recorder.stop()
+
+    config = {'tickerPairA': 'ADA-ETH', 'tickerPairB': 'ETH-BTC', 'tickerPairC': 'ADA-BTC',
+              'tickerA': 'ADA', 'tickerB': 'ETH', 'tickerC': 'BTC'}
+    grid = {'minProfit': [0.1, 0.3, 1.0], 'feeRatio': [0.001, 0.0026, 0.005],
+            'routes': [[1], [2], [1, 2]], 'maxOrderValue': [100, None]}
+
+    # The same grid with 1 process up to one per core: the combinations are independent,
+    # the time should fall about linearly until the cores are all busy
+    cores = os.cpu_count()
+    counts = sorted({1, 2, 4, cores} & set(range(1, cores + 1)))
+    times = {}
+    for workers in counts:
+        start = time.perf_counter()
+        rows = run_sweep(config, directory, grid, workers)
+        times[workers] = time.perf_counter() - start
+        print('{0} backtests with {1} workers: {2:.2f} s, speedup {3:.2f} ({4:.0%} of linear)'.format(
+            len(rows), workers, times[workers], times[1] / times[workers], times[1] / times[workers] / workers))
+    print(format_table(rows[:10], list(grid)))
+    shutil.rmtree(directory)
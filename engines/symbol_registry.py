@@ -0,0 +1,181 @@
+'''
+Registry of the symbols used by each venue for the same markets.
+
+Each exchange names its products and currencies its own way: 'BTC-ETH' on
+Bittrex, 'ethbtc' on Bitstamp, 'XETHXXBT' on Kraken, 'ETH-BTC' on Coinbase Pro,
+'XETH' or 'eth' for the same currency. The registry lists the products of each
+venue once and indexes them by canonical (base, quote) currencies in both
+directions, so that finding the symbol of a market on a venue, or the market
+of a symbol, is a dict lookup. The product lists are saved to a cache file and
+read from it at the next startup, a venue being asked again only once its
+entry is older than maxAge.
+'''
+
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+from utils.logging import crypto_arb_log
+
+# Other names of the same currencies
+ALIASES = {'XBT': 'BTC', 'XDG': 'DOGE'}
+
+
+def canonical_currency(name: str) -> str:
+    name = name.upper()
+    return ALIASES.get(name, name)
+
+
+class SymbolRegistry(object):
+    cacheFile = 'symbols_cache.json'
+
+    def __init__(self, cacheFile: Optional[str] = None, maxAge: float = 86400):
+        '''
+        cacheFile: file the product lists are saved to, not saved when None
+        maxAge: seconds after which the product list of a venue is asked again
+        '''
+        self.cacheFile = cacheFile
+        self.maxAge = maxAge
+        # Product list of each venue as received, and the time it was received
+        self.listings = {}
+        # (base, quote) -> {venue: pair}, and venue -> {pair: (base, quote)}
+        self.markets = {}
+        self.products = {}
+        # venue -> {canonical currency: currency of the venue}, and the reverse
+        self.currencies = {}
+        self.canonicals = {}
+
+    def add_products(self, venue: str, products: List[Dict[str, str]], updated: Optional[float] = None):
+        '''
+        Index the products of a venue, as returned by the get_products method of its engine
+        '''
+        self.listings[venue] = {'updated': time.time() if updated is None else updated, 'products': products}
+        for pairs in self.markets.values():
+            pairs.pop(venue, None)
+        self.products[venue] = {}
+        self.currencies[venue] = {}
+        self.canonicals[venue] = {}
+        for product in products:
+            # Kraken gives the usual names of the currencies apart from their own codes
+            names = product['name'].split('/') if 'name' in product else (product['base'], product['quote'])
+            market = tuple(canonical_currency(name) for name in names)
+            self.markets.setdefault(market, {})[venue] = product['pair']
+            self.products[venue][product['pair']] = market
+            for currency, canonical in zip((product['base'], product['quote']), market):
+                self.currencies[venue][canonical] = currency
+                self.canonicals[venue][currency] = canonical
+
+    def load_cache(self):
+        if self.cacheFile is None or not os.path.exists(self.cacheFile):
+            return
+        try:
+            with open(self.cacheFile) as f:
+                listings = json.load(f)
+        except (OSError, ValueError) as e:
+            crypto_arb_log.error('Symbol cache {0} ignored: {1}'.format(self.cacheFile, e))
+            return
+        for venue, listing in listings.items():
+            self.add_products(venue, listing['products'], listing['updated'])
+
+    def save_cache(self):
+        if self.cacheFile is None:
+            return
+        # Written next to the cache then renamed, a reader never sees a partial file
+        tmpFile = self.cacheFile + '.tmp'
+        with open(tmpFile, 'w') as f:
+            json.dump(self.listings, f)
+        os.replace(tmpFile, self.cacheFile)
+
+    async def load(self, engines: Dict[str, object]):
+        '''
+        Read the cache, then ask the venues missing from it or expired for their
+        products, all at once. A venue failing to answer keeps its expired entry.
+
+        engines: exchange engine of each venue, e.g. {'kraken': engine}
+        '''
+        self.load_cache()
+        now = time.time()
+        expired = [venue for venue in engines
+                   if venue not in self.listings or now - self.listings[venue]['updated'] > self.maxAge]
+        if not expired:
+            return
+        responses = await asyncio.gather(*[engines[venue].get_products() for venue in expired], return_exceptions=True)
+        for venue, products in zip(expired, responses):
+            # ExchangeException derives from BaseException
+            if isinstance(products, BaseException):
+                crypto_arb_log.error('Products of {0} not listed: {1}'.format(venue, products))
+                continue
+            self.add_products(venue, products)
+            crypto_arb_log.info('{0} products listed on {1}'.format(len(products), venue))
+        self.save_cache()
+
+    def symbol(self, venue: str, base: str, quote: str) -> Optional[str]:
+        '''
+        Return the pair of a market on a venue: ('ETH', 'BTC') gives 'XETHXXBT' on Kraken
+        '''
+        return self.markets.get((canonical_currency(base), canonical_currency(quote)), {}).get(venue)
+
+    def market(self, venue: str, pair: str) -> Optional[Tuple[str, str]]:
+        '''
+        Return the canonical (base, quote) currencies of a pair of a venue
+        '''
+        return self.products.get(venue, {}).get(pair)
+
+    def venues(self, base: str, quote: str) -> Dict[str, str]:
+        '''
+        Return the pair of a market on each venue listing it
+        '''
+        return self.markets.get((canonical_currency(base), canonical_currency(quote)), {})
+
+    def currency(self, venue: str, name: str) -> Optional[str]:
+        '''
+        Return the code of a currency on a venue: 'BTC' gives 'XXBT' on Kraken and 'btc' on Bitstamp
+        '''
+        return self.currencies.get(venue, {}).get(canonical_currency(name))
+
+    def canonical(self, venue: str, currency: str) -> Optional[str]:
+        return self.canonicals.get(venue, {}).get(currency)
+
+
+if __name__ == '__main__':
+    import tempfile
+
+    class ListingEngine(object):
+        '''
+        Engine answering with a fixed product list after the time of a request
+        '''
+        def __init__(self, products):
+            self.products = products
+
+        async def get_products(self):
+            await asyncio.sleep(0.2)
+            return self.products
+
+    engines = {
+        'kraken': ListingEngine([{'pair': 'XETHXXBT', 'base': 'XETH', 'quote': 'XXBT', 'name': 'ETH/XBT'},
+                                 {'pair': 'XLTCXXBT', 'base': 'XLTC', 'quote': 'XXBT', 'name': 'LTC/XBT'}]),
+        'bittrex': ListingEngine([{'pair': 'BTC-ETH', 'base': 'ETH', 'quote': 'BTC'},
+                                  {'pair': 'BTC-LTC', 'base': 'LTC', 'quote': 'BTC'}]),
+        'bitstamp': ListingEngine([{'pair': 'ethbtc', 'base': 'eth', 'quote': 'btc'}]),
+        'coinbase_pro': ListingEngine([{'pair': 'ETH-BTC', 'base': 'ETH', 'quote': 'BTC'}])
+    }
+    cacheFile = os.path.join(tempfile.mkdtemp(), 'symbols_cache.json')
+
+    for run in ['first start', 'cached start']:
+        registry = SymbolRegistry(cacheFile)
+        start = time.perf_counter()
+        asyncio.run(registry.load(engines))
+        print('{0}: loaded in {1:.1f} ms'.format(run, (time.perf_counter() - start) * 1000))
+
+    print('ETH/BTC:', registry.venues('ETH', 'XBT'))
+    print('LTC/BTC on Kraken:', registry.symbol('kraken', 'LTC', 'BTC'), '- BTC on Bitstamp:', registry.currency('bitstamp', 'BTC'))
+    print('XETHXXBT on Kraken:', registry.market('kraken', 'XETHXXBT'))
+
+    lookups = 100000
+    start = time.perf_counter()
+    for _ in range(lookups):
+        registry.symbol('kraken', 'ETH', 'BTC')
+        registry.market('bitstamp', 'ethbtc')
+    print('{0:.2f} us per lookup'.format((time.perf_counter() - start) / lookups / 2 * 1e6))
+    os.remove(cacheFile)
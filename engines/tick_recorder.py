@@ -0,0 +1,272 @@
+'''
+Recorder of the order books received, in compact binary files.
+
+Each book received through an engine is appended as a fixed-width record: time,
+product ID, best bid and ask with their sizes, and optionally the first levels
+of the book (NaN when not known). The engine only appends a tuple to a deque;
+a background thread packs the pending records into a NumPy array and writes
+them, so that the event loop never waits on the disk. A new file is started
+every maxRecords records.
+
+A file is a 256 bytes JSON header followed by the records, so it can be read
+back with np.memmap without copying, and the product IDs are listed in
+products.json in the same directory:
+
+    ticks = read_ticks('recordings/ticks-20260101-120000-0000.bin')
+    ticks['bidPrice'][ticks['product'] == 3]
+'''
+
+import collections
+import glob
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from engines.exchanges.base import ExchangeEngineBase
+from utils.logging import crypto_arb_log
+
+HEADER_SIZE = 256
+MAGIC = 'ticks'
+
+
+def record_dtype(depth: int = 0) -> np.dtype:
+    fields = [('time', '<f8'), ('product', '<u4'),
+              ('bidPrice', '<f8'), ('bidSize', '<f8'), ('askPrice', '<f8'), ('askSize', '<f8')]
+    if depth:
+        fields += [('bids', '<f8', (depth, 2)), ('asks', '<f8', (depth, 2))]
+    return np.dtype(fields)
+
+
+def read_ticks(path: str) -> np.memmap:
+    '''
+    Map the records of a file, without reading them
+    '''
+    with open(path, 'rb') as f:
+        header = json.loads(f.read(HEADER_SIZE).rstrip(b'\0'))
+    if header.get('magic') != MAGIC:
+        raise ValueError('{0} is not a tick recording'.format(path))
+    dtype = record_dtype(header['depth'])
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if not count:
+        return np.zeros(0, dtype)
+    return np.memmap(path, dtype, mode='r', offset=HEADER_SIZE, shape=(count,))
+
+
+def read_products(directory: str) -> List[str]:
+    '''
+    Return the product of each ID, 'exchange:pair'
+    '''
+    with open(os.path.join(directory, 'products.json')) as f:
+        return json.load(f)
+
+
+def recording_files(directory: str) -> List[str]:
+    # Named after their creation time and index, in the order they were written
+    return sorted(glob.glob(os.path.join(directory, 'ticks-*.bin')))
+
+
+class TickRecorder(object):
+    def __init__(self, directory: str, depth: int = 0, maxRecords: int = 1000000, flushInterval: float = 0.2):
+        '''
+        directory: where the files are written
+        depth: number of levels of each side recorded with the depth books, none when 0
+        maxRecords: number of records after which a new file is started
+        flushInterval: seconds between two writes of the pending records
+        '''
+        self.directory = directory
+        self.depth = depth
+        self.dtype = record_dtype(depth)
+        self.maxRecords = maxRecords
+        self.flushInterval = flushInterval
+        os.makedirs(directory, exist_ok=True)
+
+        # Product IDs are kept across the files of a directory
+        productsFile = os.path.join(directory, 'products.json')
+        self.products = read_products(directory) if os.path.exists(productsFile) else []
+        self.productIds = {product: i for i, product in enumerate(self.products)}
+        self.productsChanged = False
+
+        # Records waiting for the writer: (time, product ID, book); deque appends and pops are thread safe
+        self.pending = collections.deque()
+        self.file = None
+        self.fileRecords = 0
+        self.fileIndex = 0
+        self.written = 0
+        self.stopping = threading.Event()
+        self.thread = None
+
+    def record(self, product: str, book: Dict, now: Optional[float] = None):
+        '''
+        Add a book, innermost ({'bid', 'ask'}) or with depth ({'bids', 'asks'}); called from the event loop
+        '''
+        productId = self.productIds.get(product)
+        if productId is None:
+            productId = self.productIds[product] = len(self.products)
+            self.products.append(product)
+            self.productsChanged = True
+        self.pending.append((time.time() if now is None else now, productId, book))
+
+    def attach(self, engine, exchange: str):
+        '''
+        Record the books returned by an engine: its order book and batch methods are
+        wrapped on the instance, the engine code being left as is
+        '''
+        recorder = self
+
+        def wrap(method, isBatch=False):
+            async def wrapper(*args, **kwargs):
+                result = await method(*args, **kwargs)
+                if isBatch:
+                    for pair, book in result.items():
+                        if not isinstance(book, BaseException):
+                            recorder.record('{0}:{1}'.format(exchange, pair), book)
+                else:
+                    recorder.record('{0}:{1}'.format(exchange, args[0]), result)
+                return result
+            return wrapper
+
+        batchMethod = getattr(type(engine), 'get_tickers_batch', None)
+        innermost = engine.get_ticker_orderBook_innermost
+        engine.get_ticker_orderBook_innermost = wrap(innermost)
+        if hasattr(engine, 'get_ticker_orderBook_depth'):
+            engine.get_ticker_orderBook_depth = wrap(engine.get_ticker_orderBook_depth)
+        # The default batch calls get_ticker_orderBook_innermost, already recorded
+        if batchMethod is not None and batchMethod is not ExchangeEngineBase.get_tickers_batch:
+            engine.get_tickers_batch = wrap(engine.get_tickers_batch, True)
+
+    def attach_feed(self, feed, exchange: str):
+        '''
+        Record the top of the local books of a WebSocket feed each time it changes,
+        the books with an empty side being skipped
+        '''
+        def listener(productId):
+            book = feed.books[productId].innermost()
+            if book is not None:
+                self.record('{0}:{1}'.format(exchange, productId), book)
+
+        feed.listeners.append(listener)
+
+    def start(self):
+        if self.thread is None:
+            self.stopping.clear()
+            self.thread = threading.Thread(target=self.run, name='tick-recorder', daemon=True)
+            self.thread.start()
+        return self.thread
+
+    def stop(self):
+        '''
+        Write the pending records and close the file
+        '''
+        if self.thread is not None:
+            self.stopping.set()
+            self.thread.join()
+            self.thread = None
+        crypto_arb_log.info('{0} ticks recorded in {1}'.format(self.written, self.directory))
+
+    def run(self):
+        while not self.stopping.wait(self.flushInterval):
+            self.flush()
+        self.flush()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _open(self):
+        name = 'ticks-{0}-{1:04d}.bin'.format(time.strftime('%Y%m%d-%H%M%S'), self.fileIndex)
+        self.fileIndex += 1
+        self.file = open(os.path.join(self.directory, name), 'wb')
+        header = json.dumps({'magic': MAGIC, 'version': 1, 'depth': self.depth, 'created': time.time()}).encode()
+        self.file.write(header.ljust(HEADER_SIZE, b'\0'))
+        self.fileRecords = 0
+
+    def _pack(self, records: List[Tuple[float, int, Dict]]) -> np.ndarray:
+        array = np.empty(len(records), self.dtype)
+        rows = []
+        depthBooks = []
+        for now, productId, book in records:
+            if 'bid' in book:
+                bid, ask = book['bid'], book['ask']
+                rows.append((now, productId, bid['price'], bid['amount'], ask['price'], ask['amount']))
+                depthBooks.append(None)
+            else:
+                bids, asks = book['bids'], book['asks']
+                nan = (np.nan, np.nan)
+                bid, ask = bids[0] if bids else nan, asks[0] if asks else nan
+                rows.append((now, productId, bid[0], bid[1], ask[0], ask[1]))
+                depthBooks.append(book)
+        columns = np.array(rows, dtype=float).reshape(-1, 6)
+        for index, name in enumerate(['time', 'product', 'bidPrice', 'bidSize', 'askPrice', 'askSize']):
+            array[name] = columns[:, index]
+        if self.depth:
+            array['bids'] = np.nan
+            array['asks'] = np.nan
+            for index, book in enumerate(depthBooks):
+                if book is not None:
+                    for side in ('bids', 'asks'):
+                        levels = book[side][:self.depth]
+                        if levels:
+                            array[side][index, :len(levels)] = levels
+        return array
+
+    def flush(self):
+        count = len(self.pending)
+        if not count:
+            return
+        records = [self.pending.popleft() for _ in range(count)]
+        if self.productsChanged:
+            self.productsChanged = False
+            with open(os.path.join(self.directory, 'products.json'), 'w') as f:
+                json.dump(list(self.products), f)
+        array = self._pack(records)
+        start = 0
+        while start < len(array):
+            if self.file is None or self.fileRecords >= self.maxRecords:
+                if self.file is not None:
+                    self.file.close()
+                self._open()
+            end = start + min(self.maxRecords - self.fileRecords, len(array) - start)
+            self.file.write(array[start:end].tobytes())
+            self.fileRecords += end - start
+            start = end
+        self.file.flush()
+        self.written += len(array)
+
+
+if __name__ == '__main__':
+    import random
+    import shutil
+    import tempfile
+
+    # 200000 innermost books of 50 products recorded from the caller side, as the engine loop would
+    directory = tempfile.mkdtemp()
+    recorder = TickRecorder(directory, depth=5, maxRecords=50000)
+    recorder.start()
+    random.seed(0)
+    books = [{'bid': {'price': 100 - random.random(), 'amount': random.random()},
+              'ask': {'price': 100 + random.random(), 'amount': random.random()}} for _ in range(1000)]
+    depthBook = {'bids': [[99.9 - i * 0.1, 1.0] for i in range(10)], 'asks': [[100.1 + i * 0.1, 1.0] for i in range(10)]}
+    products = ['kraken:PAIR{0}'.format(i) for i in range(50)]
+
+    updates = 200000
+    start = time.perf_counter()
+    for i in range(updates):
+        recorder.record(products[i % 50], depthBook if i % 100 == 0 else books[i % 1000])
+    callTime = (time.perf_counter() - start) / updates
+    recorder.stop()
+    totalTime = time.perf_counter() - start
+
+    files = recording_files(directory)
+    start = time.perf_counter()
+    ticks = [read_ticks(path) for path in files]
+    mapTime = time.perf_counter() - start
+    records = sum(len(t) for t in ticks)
+    assert records == updates and ticks[0]['bids'][0, 0, 0] == depthBook['bids'][0][0]
+    print('record(): {0:.2f} us per book on the engine side; {1} books written in {2:.2f} s ({3:.0f} per second), '
+          '{4} files of {5} bytes per record'.format(callTime * 1e6, records, totalTime, records / totalTime,
+                                                      len(files), recorder.dtype.itemsize))
+    print('{0} records mapped in {1:.2f} ms, mean bid of {2}: {3:.4f}'.format(
+        records, mapTime * 1000, read_products(directory)[3], ticks[0]['bidPrice'][ticks[0]['product'] == 3].mean()))
+    del ticks
+    shutil.rmtree(directory)
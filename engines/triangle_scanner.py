@@ -0,0 +1,268 @@
+'''
+Scanner evaluating every triangular route available on an exchange at once.
+
+The products of the exchange are turned into a currency graph (one node per
+currency, one edge per product), every 3-leg cycle of this graph is listed
+once at startup, and each tick all the cycles are scored in a single
+vectorized NumPy pass.
+
+A product to routes inverted index keeps track of the routes using each
+product, so that evaluate() only re-scores the routes touching a product whose
+top of book changed since the previous tick.
+'''
+
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class TriangleScanner(object):
+    def __init__(self, products: List[Dict[str, str]], feeRatio: float = 0.0):
+        '''
+        Build the currency graph and list all the triangles of an exchange.
+
+        The products are given as a list of dictionnaries, looking like the following:
+
+        [
+            {'pair': 'ADA-ETH', 'base': 'ADA', 'quote': 'ETH'},
+            {'pair': 'ETH-BTC', 'base': 'ETH', 'quote': 'BTC'}
+        ]
+        '''
+        self.feeRatio = feeRatio
+
+        # Keep only one product per couple of currencies
+        self.pairs = []
+        self.pairBase = []
+        self.pairQuote = []
+        self.pairIndex = {}
+        self.graph = {}
+        for product in products:
+            base, quote = product['base'], product['quote']
+            if base == quote or quote in self.graph.get(base, {}):
+                continue
+            index = len(self.pairs)
+            self.pairs.append(product['pair'])
+            self.pairBase.append(base)
+            self.pairQuote.append(quote)
+            self.pairIndex[product['pair']] = index
+            self.graph.setdefault(base, {})[quote] = index
+            self.graph.setdefault(quote, {})[base] = index
+
+        # Innermost order book of each product, NaN when unknown
+        nbPairs = len(self.pairs)
+        self.bids = np.full(nbPairs, np.nan)
+        self.asks = np.full(nbPairs, np.nan)
+        self.bidAmounts = np.zeros(nbPairs)
+        self.askAmounts = np.zeros(nbPairs)
+
+        self._build_routes()
+
+        # Incremental evaluation: products changed since the last evaluation and cached results
+        self.dirty = set(range(nbPairs))
+        self.results = np.zeros(len(self.routePairs))
+        self.routesEvaluated = 0
+        self.routesSkipped = 0
+
+    def _build_routes(self):
+        '''
+        List every 3-leg cycle of the currency graph. Each triangle gives two
+        routes, one per direction, exactly like the bid and ask routes of the
+        triangular engine.
+
+        A leg going from the quote to the base currency of a product is a 'bid'
+        (buy at the ask price), a leg going from the base to the quote currency
+        is an 'ask' (sell at the bid price).
+        '''
+        currencies = sorted(self.graph)
+        rank = {currency: index for index, currency in enumerate(currencies)}
+
+        routeCurrencies = []
+        legPairs = []
+        legIsBid = []
+        for u in currencies:
+            for v in self.graph[u]:
+                if rank[v] <= rank[u]:
+                    continue
+                for w in self.graph[v]:
+                    if rank[w] <= rank[v] or w not in self.graph[u]:
+                        continue
+                    for cycle in ((u, v, w), (u, w, v)):
+                        pairs = []
+                        isBid = []
+                        for index in range(3):
+                            src, dst = cycle[index], cycle[(index + 1) % 3]
+                            pair = self.graph[src][dst]
+                            pairs.append(pair)
+                            isBid.append(self.pairQuote[pair] == src)
+                        routeCurrencies.append(cycle)
+                        legPairs.append(pairs)
+                        legIsBid.append(isBid)
+
+        self.routeCurrencies = routeCurrencies
+        self.routePairs = np.array(legPairs, dtype=np.intp).reshape(-1, 3)
+        self.routeIsBid = np.array(legIsBid, dtype=bool).reshape(-1, 3)
+        # Index of each leg in the rate table built by score(): sell rates first, buy rates after
+        self._legIndex = self.routePairs + self.routeIsBid * len(self.pairs)
+        self.routesPairs = sorted({self.pairs[p] for p in np.unique(self.routePairs)})
+
+        # Inverted index product -> routes, stored as one sorted array split by offsets
+        legs = self.routePairs.ravel()
+        order = np.argsort(legs, kind='stable')
+        self._indexRoutes = order // 3
+        self._indexOffsets = np.searchsorted(legs[order], np.arange(len(self.pairs) + 1))
+
+    def routes_of_pair(self, pair: str) -> np.ndarray:
+        '''
+        Return the indexes of the routes using a product
+        '''
+        index = self.pairIndex[pair]
+        return self._indexRoutes[self._indexOffsets[index]:self._indexOffsets[index + 1]]
+
+    def update_quote(self, pair: str, book: Dict[str, Dict[str, float]]) -> bool:
+        '''
+        Store the innermost order book of a product, the book has the format returned
+        by get_ticker_orderBook_innermost.
+        Return True when the top of book changed, its routes are then re-scored by
+        the next evaluate().
+        '''
+        index = self.pairIndex[pair]
+        bid, ask = book['bid'], book['ask']
+        if self.bids[index] == bid['price'] and self.asks[index] == ask['price'] and \
+           self.bidAmounts[index] == bid['amount'] and self.askAmounts[index] == ask['amount']:
+            return False
+        self.bids[index] = bid['price']
+        self.asks[index] = ask['price']
+        self.bidAmounts[index] = bid['amount']
+        self.askAmounts[index] = ask['amount']
+        self.dirty.add(index)
+        return True
+
+    def clear_quote(self, pair: str):
+        '''
+        Forget the order book of a product, all the routes using it are then ignored
+        '''
+        index = self.pairIndex[pair]
+        if not np.isnan(self.bids[index]) or not np.isnan(self.asks[index]):
+            self.dirty.add(index)
+        self.bids[index] = np.nan
+        self.asks[index] = np.nan
+
+    def _rate_table(self) -> np.ndarray:
+        # Rate of a leg selling the base currency followed by the rate of a leg buying it
+        with np.errstate(divide='ignore'):
+            return np.concatenate((self.bids, 1 / self.asks))
+
+    def score(self) -> np.ndarray:
+        '''
+        Return the result of every route, computed the same way as bidRoute_result
+        and askRoute_result in the triangular engine, with the fees of the three
+        legs applied. Routes with an unknown order book get a result of 0.
+        '''
+        results = self._rate_table()[self._legIndex].prod(axis=1)
+        results *= (1 - self.feeRatio) ** 3
+        return np.nan_to_num(results, nan=0.0, posinf=0.0)
+
+    def evaluate(self) -> np.ndarray:
+        '''
+        Re-score only the routes using a product changed since the previous call and
+        return the results of all the routes, like score() does.
+        The number of routes re-scored and skipped is kept in routesEvaluated and
+        routesSkipped.
+        '''
+        nbRoutes = len(self.results)
+        if not self.dirty:
+            self.routesEvaluated = 0
+            self.routesSkipped = nbRoutes
+            return self.results
+
+        dirty = np.fromiter(self.dirty, dtype=np.intp, count=len(self.dirty))
+        self.dirty = set()
+        if len(dirty) * 4 > len(self.pairs):
+            # A large part of the products changed, scoring everything is cheaper
+            self.results = self.score()
+            self.routesEvaluated = nbRoutes
+        else:
+            routes = np.unique(np.concatenate(
+                [self._indexRoutes[self._indexOffsets[i]:self._indexOffsets[i + 1]] for i in dirty]))
+            results = self._rate_table()[self._legIndex[routes]].prod(axis=1)
+            results *= (1 - self.feeRatio) ** 3
+            self.results[routes] = np.nan_to_num(results, nan=0.0, posinf=0.0)
+            self.routesEvaluated = len(routes)
+        self.routesSkipped = nbRoutes - self.routesEvaluated
+        return self.results
+
+    def describe_route(self, index: int, result: float) -> Dict:
+        '''
+        Build the description of a route, its orders follow the format of the
+        orderInfo list of the triangular engine (without the amounts)
+        '''
+        orderInfo = []
+        for pair, isBid in zip(self.routePairs[index], self.routeIsBid[index]):
+            orderInfo.append({
+                'tickerPair': self.pairs[pair],
+                'action': 'bid' if isBid else 'ask',
+                'price': float(self.asks[pair] if isBid else self.bids[pair])
+            })
+        return {
+            'currencies': list(self.routeCurrencies[index]),
+            'result': float(result),
+            'orderInfo': orderInfo
+        }
+
+    def top_routes(self, k: int = 5, minResult: float = 1.0, results: Optional[np.ndarray] = None) -> List[Dict]:
+        '''
+        Return the k best routes having a result (fees included) above minResult,
+        sorted from the most to the least profitable
+        '''
+        if results is None:
+            results = self.evaluate()
+        candidates = np.flatnonzero(results > minResult)
+        if len(candidates) > k:
+            best = np.argpartition(results[candidates], -k)[-k:]
+            candidates = candidates[best]
+        candidates = candidates[np.argsort(results[candidates])[::-1]]
+        return [self.describe_route(index, results[index]) for index in candidates]
+
+
+if __name__ == '__main__':
+    import time
+
+    # Benchmark on a synthetic exchange of about 600 products
+    rng = np.random.default_rng(0)
+    quotes = ['BTC', 'ETH', 'USD', 'EUR', 'USDT', 'GBP']
+    bases = ['C{0}'.format(i) for i in range(100)]
+    products = [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q} for b in bases for q in quotes]
+    products += [{'pair': '{0}-{1}'.format(b, q), 'base': b, 'quote': q} for b in quotes for q in quotes if b < q]
+
+    start = time.perf_counter()
+    scanner = TriangleScanner(products, feeRatio=0.005)
+    buildTime = time.perf_counter() - start
+
+    value = {currency: rng.uniform(0.1, 100) for currency in bases + quotes}
+    for product in products:
+        mid = value[product['base']] / value[product['quote']] * rng.uniform(0.995, 1.005)
+        scanner.update_quote(product['pair'], {
+            'bid': {'price': mid * 0.9995, 'amount': 1.0},
+            'ask': {'price': mid * 1.0005, 'amount': 1.0}})
+
+    loops = 100
+    start = time.perf_counter()
+    for _ in range(loops):
+        routes = scanner.top_routes(5, results=scanner.score())
+    scoreTime = (time.perf_counter() - start) / loops
+
+    print('{0} products, {1} routes, build {2:.1f} ms, score + top-5 {3:.3f} ms'.format(
+        len(scanner.pairs), len(scanner.routePairs), buildTime * 1000, scoreTime * 1000))
+
+    # Only a few products change between two ticks
+    start = time.perf_counter()
+    for _ in range(loops):
+        for product in rng.choice(products, 5):
+            mid = value[product['base']] / value[product['quote']] * rng.uniform(0.995, 1.005)
+            scanner.update_quote(product['pair'], {
+                'bid': {'price': mid * 0.9995, 'amount': 1.0},
+                'ask': {'price': mid * 1.0005, 'amount': 1.0}})
+        scanner.top_routes(5)
+    print('5 changed products per tick: evaluate + top-5 {0:.3f} ms, {1} routes evaluated, {2} skipped'.format(
+        (time.perf_counter() - start) / loops * 1000, scanner.routesEvaluated, scanner.routesSkipped))
+    for route in routes:
+        print(route['currencies'], route['result'])
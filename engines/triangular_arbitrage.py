@@ -4,36 +4,149 @@ import asyncio
 import os 
 import sys
 from engines.exchanges.loader import EngineLoader
+# Module of the adapters, on the path set by the engine loader
+from base import ExchangeException
+from engines.triangle_scanner import TriangleScanner
+from engines.negative_cycle import NegativeCycleDetector
+from engines.depth_sizing import DepthSizer
+from engines.market_events import QuoteEvents, LatencyTracker, PollingQuoteSource
+from engines.polling_scheduler import PollingScheduler
+from engines.valuation import ValuationService, parse_pair
+from engines.balance_ledger import BalanceLedger
+from engines.product_metadata import ProductMetadataCache
+from engines.tick_recorder import TickRecorder
 from utils.logging import crypto_arb_log
 
 class CryptoEngineTriArbitrage(object):
     def __init__(self, exchange, mock=False):
         self.exchange = exchange
         self.mock = mock
-        self.minProfitUSDT = 0.3
+        # Minimum profit of a route, fees included, in the valuation currency
+        self.minProfitUSDT = self.exchange.get('minProfit', 0.3)
+        # Routes traded, 1 for the bid route and 2 for the ask route
+        self.routes = self.exchange.get('routes', [1, 2])
+        # Maximum value of each order in the valuation currency, not capped when None
+        self.maxOrderValue = self.exchange.get('maxOrderValue')
         self.hasOpenOrder = True # always assume there are open orders first
         self.openOrderCheckCount = 0
+        # Scan all the triangles of the exchange instead of the configured one
+        self.scanAll = self.exchange.get('scanAllTriangles', False)
+        self.topRoutes = self.exchange.get('topRoutes', 5)
+        self.scanner = None
+        # Routes longer than a triangle are looked for when maxRouteLength is above 3
+        self.maxRouteLength = self.exchange.get('maxRouteLength', 3)
+        self.cycleDetector = None
+        # Number of order book levels used to size the orders, the innermost one only when 0
+        self.depth = self.exchange.get('depth', 0)
+        # Read the order books from a WebSocket feed instead of polling them
+        self.useFeed = self.exchange.get('websocket', False)
+        # Evaluate as soon as an order book changes instead of every sleepTime
+        self.eventDriven = self.exchange.get('eventDriven', False)
+        self.events = None
+        self.latency = LatencyTracker()
       
         self.engine = EngineLoader.getEngine(self.exchange['exchange'], self.exchange['keyFile'])
+        # Fee of the tier of the account, when below the one of the adapter
+        if 'feeRatio' in self.exchange:
+            self.engine.feeRatio = self.exchange['feeRatio']
+        # The requests are paced by the rate limits of the exchange, the polling period can be lowered down to 0
+        self.sleepTime = self.exchange.get('sleepTime', self.engine.sleepTime)
+        # Each product is polled between these intervals depending on how fast it moves
+        self.minPollInterval = self.exchange.get('minPollInterval', 0.5)
+        self.maxPollInterval = self.exchange.get('maxPollInterval', 6 * self.engine.sleepTime)
+        # Routes whose result is within this margin of a profit have their products polled every minPollInterval
+        self.nearMargin = self.exchange.get('nearMargin', 0.005)
+        self.scheduler = None
+        self.depthSizer = DepthSizer(self.engine.feeRatio)
+        # Value of the tickers derived from the order books, used for the profit and the fees
+        self.valuation = ValuationService(self.engine, self.exchange.get('valuationCurrency', 'EUR'))
+        tickers = [self.exchange['tickerA'], self.exchange['tickerB'], self.exchange['tickerC']]
+        pairs = {}
+        for pairKey in ['tickerPairA', 'tickerPairB', 'tickerPairC']:
+            currencies = parse_pair(self.exchange[pairKey], tickers)
+            if currencies is not None:
+                self.valuation.add_pair(self.exchange[pairKey], *currencies)
+                pairs[self.exchange[pairKey]] = currencies
+        # Balances kept locally from the orders placed, reconciled with the exchange in the background
+        self.ledger = BalanceLedger(self.engine, tickers, pairs, self.exchange.get('reconcileInterval', 300))
+        # Tick and lot sizes and status of the products, the orders are rounded to them
+        self.productRules = ProductMetadataCache(self.engine, self.exchange.get('productRefreshInterval', 3600))
+        # Source of the order books, the engine itself or its feed
+        self.marketData = self.engine
+        # Books received written to binary files, when a directory is given
+        self.recorder = None
+        if self.exchange.get('record'):
+            self.recorder = TickRecorder(self.exchange['record'], self.exchange.get('recordDepth', 0))
+            self.recorder.attach(self.engine, self.exchange['exchange'])
+
+    # Legs of each route in the order they are chained: (ticker pair, action, input ticker)
+    routeLegs = {
+        1: [('tickerPairB', 'bid', 'tickerC'), ('tickerPairA', 'bid', 'tickerB'), ('tickerPairC', 'ask', 'tickerA')],
+        2: [('tickerPairA', 'ask', 'tickerA'), ('tickerPairB', 'ask', 'tickerB'), ('tickerPairC', 'bid', 'tickerC')]
+    }
 
     async def start_engine(self):
         crypto_arb_log.info(strftime('%Y%m%d%H%M%S') + ' starting Triangular Arbitrage Engine...')
         if self.mock:
             crypto_arb_log.info('---------------------------- MOCK MODE ----------------------------')
+        await self.engine.warm_up()
+        if self.recorder is not None:
+            self.recorder.start()
+        try:
+            await self.productRules.load()
+        except (Exception, ExchangeException) as e:
+            crypto_arb_log.error('Product rules not loaded, orders placed unrounded: {0}'.format(e))
+        self.productRules.start()
+        if self.scanAll:
+            await self.init_scanner()
+        await self.start_marketData()
+        await self.ledger.load()
+        self.ledger.start()
         #Send the request asynchronously
         while True:
+            batch = None
+            if self.events is not None and (self.mock or not self.hasOpenOrder):
+                # Wait for a change of the order books, all the changes received meanwhile are coalesced
+                batch = await self.events.wait()
             try:
-                if not self.mock and self.hasOpenOrder:
-                    await self.check_openOrder()
-                elif (await self.check_balance()):           
-                    bookStatus = await self.check_orderBook()
-                    if bookStatus['status']:
-                        await self.place_order(bookStatus['orderInfo'])
-            except Exception as e:
+                await self.tick()
+            except (Exception, ExchangeException) as e:
                # raise
                crypto_arb_log.error(e)
             
-            await asyncio.sleep(self.engine.sleepTime)
+            if batch is None and self.scheduler is not None:
+                # Next evaluation once the products due have been polled
+                await self.marketData.wait_poll()
+            elif batch is None:
+                await asyncio.sleep(self.sleepTime)
+            else:
+                self.record_latency(batch)
+
+    async def tick(self):
+        '''
+        Evaluate once: the open orders are checked first, then the order books and
+        the orders of a profitable route are placed. Return the status of the order
+        books, None when they were not checked, with the number of orders rejected
+        when a route was traded.
+        '''
+        if self.scanAll:
+            await self.scan_triangles()
+        elif not self.mock and self.hasOpenOrder:
+            await self.check_openOrder()
+        elif (await self.check_balance()):           
+            bookStatus = await self.check_orderBook()
+            if bookStatus['status']:
+                bookStatus['rejected'] = await self.place_order(bookStatus['orderInfo'])
+            return bookStatus
+        return None
+
+    def record_latency(self, batch):
+        '''
+        Record the time between the oldest quote change of a batch and the decision taken on it
+        '''
+        self.latency.record(time.monotonic() - min(batch.values()))
+        if self.latency.count % 100 == 0:
+            self.latency.log('Quote to decision')
     
     async def check_openOrder(self):
         if self.openOrderCheckCount >= 5:
@@ -41,11 +154,11 @@ class CryptoEngineTriArbitrage(object):
         else:
             crypto_arb_log.info('Checking open orders...')
             responses = await asyncio.gather(self.engine.get_open_order())
-
-            if not responses[0]:
+            if responses[0] is None:
                 crypto_arb_log.info(responses)
                 return False
-            
+            self.ledger.settle_orders([order['orderId'] for order in responses[0]])
+
             if responses[0]:
                 self.engine.openOrders = responses[0]
                 crypto_arb_log.info(self.engine.openOrders)
@@ -63,21 +176,21 @@ class CryptoEngineTriArbitrage(object):
             crypto_arb_log.info(order)
             coros.append(self.engine.cancel_order(order['orderId']))
 
-        responses = await asyncio.gather(*coros)
+        # An order filled meanwhile cannot be cancelled anymore, the others are cancelled all the same
+        responses = await asyncio.gather(*coros, return_exceptions=True)
+        for order, res in zip(self.engine.openOrders, responses):
+            if isinstance(res, BaseException):
+                crypto_arb_log.info('Order {0} not cancelled: {1}'.format(order['orderId'], res))
         
         self.engine.openOrders = []
         self.hasOpenOrder = False
+        self.ledger.release_orders()
         
 
     #Check and set current balance
     async def check_balance(self):
-        responses = await asyncio.gather(self.engine.get_balance([
-            self.exchange['tickerA'],
-            self.exchange['tickerB'],
-            self.exchange['tickerC']
-            ]))
-
-        self.engine.balance = responses[0]
+        # Balances come from the local ledger, no request is needed
+        self.engine.balance = self.ledger.available
 
         ''' Not needed? '''
         # if not self.mock:
@@ -89,21 +202,34 @@ class CryptoEngineTriArbitrage(object):
         return True
     
     async def check_orderBook(self):
-        responses = await asyncio.gather(
-            self.engine.get_ticker_lastPrice(self.exchange['tickerA']),
-            self.engine.get_ticker_lastPrice(self.exchange['tickerB']),
-            self.engine.get_ticker_lastPrice(self.exchange['tickerC']))
-
-        lastPrices = []
-        for res in responses:
-            price_value = list(res.values())
-            lastPrices.append(price_value[0])
-
-        responses = await asyncio.gather(
-            self.engine.get_ticker_orderBook_innermost(self.exchange['tickerPairA']),
-            self.engine.get_ticker_orderBook_innermost(self.exchange['tickerPairB']),
-            self.engine.get_ticker_orderBook_innermost(self.exchange['tickerPairC']))
+        pairs = [self.exchange['tickerPairA'], self.exchange['tickerPairB'], self.exchange['tickerPairC']]
+        if not all(self.productRules.tradable(pair) for pair in pairs):
+            return {'status': 0}
+        books = None
+        if self.depth:
+            batch = await self.marketData.get_books_batch(pairs, self.depth)
+            books = [batch[pair] for pair in pairs]
+            for book in books:
+                # ExchangeException derives from BaseException
+                if isinstance(book, BaseException):
+                    raise book
+            responses = [{
+                'bid': {'price': book['bids'][0][0], 'amount': book['bids'][0][1]},
+                'ask': {'price': book['asks'][0][0], 'amount': book['asks'][0][1]}
+            } for book in books]
+        else:
+            responses = await asyncio.gather(
+                self.marketData.get_ticker_orderBook_innermost(self.exchange['tickerPairA']),
+                self.marketData.get_ticker_orderBook_innermost(self.exchange['tickerPairB']),
+                self.marketData.get_ticker_orderBook_innermost(self.exchange['tickerPairC']))
         
+        for pairKey, res in zip(['tickerPairA', 'tickerPairB', 'tickerPairC'], responses):
+            self.valuation.update_book(self.exchange[pairKey], res)
+        lastPrices = await asyncio.gather(
+            self.valuation.get_value(self.exchange['tickerA']),
+            self.valuation.get_value(self.exchange['tickerB']),
+            self.valuation.get_value(self.exchange['tickerC']))
+
         if self.mock:
             crypto_arb_log.info("")
             crypto_arb_log.info("--- Current order books ---")
@@ -119,16 +245,22 @@ class CryptoEngineTriArbitrage(object):
         askRoute_result = (1 * responses[0]['bid']['price']) \
                             / responses[2]['ask']['price']   \
                             * responses[1]['bid']['price']
+
+        if self.scheduler is not None:
+            near = max(bidRoute_result, askRoute_result) > 1 - self.nearMargin
+            self.scheduler.set_near([self.exchange[pairKey] for pairKey in ['tickerPairA', 'tickerPairB', 'tickerPairC']] if near else [])
         
         # Max amount for bid route & ask routes can be different and so less profit
-        if bidRoute_result > 1 or \
-        (bidRoute_result > 1 and askRoute_result > 1 and (bidRoute_result - 1) * lastPrices[0] > (askRoute_result - 1) * lastPrices[1]):
+        if 1 in self.routes and (bidRoute_result > 1 or \
+        (bidRoute_result > 1 and askRoute_result > 1 and (bidRoute_result - 1) * lastPrices[0] > (askRoute_result - 1) * lastPrices[1])):
             status = 1 # bid route
-        elif askRoute_result > 1:
+        elif 2 in self.routes and askRoute_result > 1:
             status = 2 # ask route
         else:
             status = 0 # do nothing
         
+        if status > 0 and books is not None:
+            return self.check_depthRoute(lastPrices, books, status)
         if status > 0:
             maxAmounts = self.getMaxAmount(lastPrices, responses, status)
             fee = 0
@@ -191,6 +323,123 @@ class CryptoEngineTriArbitrage(object):
                 return {'status': 2, 'orderInfo': orderInfo}
         return {'status': 0}
 
+    def check_depthRoute(self, lastPrices, books, status):
+        '''
+        Size the orders of a route by walking several levels of the order books,
+        the fees and the balances being taken into account. The orders are placed
+        at the worst price of the levels they take.
+        '''
+        pairKeys = ['tickerPairA', 'tickerPairB', 'tickerPairC']
+        legs = []
+        balances = []
+        for pairKey, action, tickerKey in self.routeLegs[status]:
+            book = books[pairKeys.index(pairKey)]
+            legs.append({'action': action, 'levels': book['asks'] if action == 'bid' else book['bids']})
+            balance = self.engine.balance[self.exchange[tickerKey]]
+            if self.maxOrderValue is not None:
+                balance = min(balance, self.maxOrderValue / lastPrices[['tickerA', 'tickerB', 'tickerC'].index(tickerKey)])
+            balances.append(balance)
+
+        sizing = self.depthSizer.optimize(legs, balances)
+
+        # Profit is given in the first currency of the route, ticker C for the bid route, A for the ask one
+        startPrice = lastPrices[2] if status == 1 else lastPrices[0]
+        profit = sizing['profit'] * startPrice
+        if profit <= self.minProfitUSDT:
+            return {'status': 0}
+
+        crypto_arb_log.info("\nOpportunity found!")
+        crypto_arb_log.info(strftime('%Y%m%d%H%M%S') + ' {0} Route: Input - {1} Profit - {2}'.format(
+            'Bid' if status == 1 else 'Ask', sizing['input'], profit))
+        orderInfo = [None] * 3
+        for (pairKey, action, _), leg in zip(self.routeLegs[status], sizing['legs']):
+            orderInfo[pairKeys.index(pairKey)] = {
+                "tickerPair": self.exchange[pairKey],
+                "action": action,
+                "price": leg['price'],
+                "amount": leg['amount']
+            }
+        return {'status': status, 'orderInfo': orderInfo}
+
+    async def start_marketData(self):
+        '''
+        Start the source of the order books of the pairs monitored: the WebSocket feed
+        of the exchange, or a polling task following an adaptive per-product schedule.
+        The order books are then read from memory.
+        '''
+        if self.scanner is not None:
+            pairs = self.scanner.routesPairs if self.cycleDetector is None else self.scanner.pairs
+        else:
+            pairs = [self.exchange['tickerPairA'], self.exchange['tickerPairB'], self.exchange['tickerPairC']]
+
+        if self.eventDriven:
+            self.events = QuoteEvents()
+        if self.useFeed:
+            self.marketData = self.engine.create_feed(pairs)
+            if self.recorder is not None:
+                self.recorder.attach_feed(self.marketData, self.exchange['exchange'])
+            if self.events is not None:
+                self.marketData.listeners.append(self.events.publish)
+        else:
+            # Part of the market data rate limit is left to the valuation and depth requests
+            limiter = self.engine.get_rateLimiter(self.engine.marketDataBucket)
+            requestRate = 0.8 * limiter.rate if limiter is not None else None
+            self.scheduler = PollingScheduler(pairs, self.minPollInterval, self.maxPollInterval, requestRate)
+            self.marketData = PollingQuoteSource(self.engine, pairs, self.events, self.sleepTime, self.scheduler)
+        self.marketData.start()
+
+    async def init_scanner(self):
+        '''
+        Get the products of the exchange and list all the triangles they form
+        '''
+        products = await self.engine.get_products()
+        self.scanner = TriangleScanner(products, self.engine.feeRatio)
+        for product in products:
+            self.valuation.add_pair(product['pair'], product['base'], product['quote'])
+        crypto_arb_log.info('{0} products, {1} triangular routes to scan'.format(
+            len(self.scanner.pairs), len(self.scanner.routePairs)))
+        if self.maxRouteLength > 3:
+            self.cycleDetector = NegativeCycleDetector(products, self.engine.feeRatio, 4, self.maxRouteLength)
+
+    async def scan_triangles(self):
+        '''
+        Get the innermost order book of every product being part of a triangle,
+        score all the routes at once and return the most profitable ones
+        '''
+        pairs = self.scanner.routesPairs if self.cycleDetector is None else self.scanner.pairs
+        responses = await asyncio.gather(
+            *[self.marketData.get_ticker_orderBook_innermost(pair) for pair in pairs],
+            return_exceptions=True)
+
+        for pair, res in zip(pairs, responses):
+            # ExchangeException derives from BaseException
+            if isinstance(res, BaseException):
+                self.scanner.clear_quote(pair)
+                if self.cycleDetector is not None:
+                    self.cycleDetector.clear_quote(pair)
+            else:
+                self.scanner.update_quote(pair, res)
+                self.valuation.update_book(pair, res)
+                if self.cycleDetector is not None:
+                    self.cycleDetector.update_quote(pair, res)
+
+        results = self.scanner.evaluate()
+        routes = self.scanner.top_routes(self.topRoutes, results=results)
+        if self.scheduler is not None:
+            self.scheduler.set_near([order['tickerPair'] for route in self.scanner.top_routes(
+                self.topRoutes, 1 - self.nearMargin, results) for order in route['orderInfo']])
+        crypto_arb_log.debug('{0} routes evaluated, {1} skipped'.format(
+            self.scanner.routesEvaluated, self.scanner.routesSkipped))
+        if self.cycleDetector is not None:
+            routes += [{'currencies': cycle['currencies'], 'result': cycle['multiplier'], 'orderInfo': cycle['orderInfo']}
+                       for cycle in self.cycleDetector.detect()[:self.topRoutes]]
+        routes = [route for route in routes
+                  if all(self.productRules.tradable(order['tickerPair']) for order in route['orderInfo'])]
+        for route in routes:
+            crypto_arb_log.info(strftime('%Y%m%d%H%M%S') + ' Route {0}: Result - {1}'.format(
+                '->'.join(route['currencies'] + route['currencies'][:1]), route['result']))
+        return routes
+
     # Using USDT may not be accurate
     def getMaxAmount(self, lastPrices, orderBookRes, status):
         maxUSDT = []
@@ -212,6 +461,8 @@ class CryptoEngineTriArbitrage(object):
             USDT = maxBalance * lastPrices[index] * (1 - self.engine.feeRatio)
             if not maxUSDT or USDT < maxUSDT: 
                 maxUSDT = USDT       
+        if self.maxOrderValue is not None:
+            maxUSDT = min(maxUSDT, self.maxOrderValue)
 
         maxAmounts = []
         for index, tickerIndex in enumerate(['tickerA', 'tickerB', 'tickerC']):
@@ -221,6 +472,13 @@ class CryptoEngineTriArbitrage(object):
         return maxAmounts
 
     async def place_order(self, orderInfo):
+        '''
+        Place the orders of a route and return the number of them rejected by the exchange
+        '''
+        # Amounts and prices written in decimal to the tick and lot of each product
+        orderInfo = self.productRules.round_orders(orderInfo)
+        if orderInfo is None:
+            return 0
         crypto_arb_log.info(orderInfo)
         coros = []
         for order in orderInfo:
@@ -230,15 +488,41 @@ class CryptoEngineTriArbitrage(object):
                 order['amount'],
                 order['price']))
 
+        rejected = 0
         if not self.mock:
-            responses = await asyncio.gather(*coros)
+            # The orders accepted are held and followed even when another leg is rejected
+            responses = await asyncio.gather(*coros, return_exceptions=True)
+            for order, res in zip(orderInfo, responses):
+                if isinstance(res, BaseException):
+                    crypto_arb_log.error('{0} {1} rejected: {2}'.format(order['action'], order['tickerPair'], res))
+                    rejected += 1
+                    continue
+                orderId = res.get('orderId') if isinstance(res, dict) else None
+                self.ledger.hold_order(orderId, order['tickerPair'], order['action'], float(order['amount']), float(order['price']))
+            if rejected == len(orderInfo):
+                return rejected
 
         self.hasOpenOrder = True
         self.openOrderCheckCount = 0
+        return rejected
 
     async def run(self):
         await self.start_engine()
 
+    async def end_engine(self):
+        '''
+        Stop the background tasks and close the connections to the exchange
+        '''
+        if self.marketData is not self.engine:
+            await self.marketData.stop()
+        await self.ledger.stop()
+        await self.productRules.stop()
+        if self.recorder is not None:
+            self.recorder.stop()
+        if self.events is not None:
+            self.latency.log('Quote to decision')
+        await self.engine.end_engine()
+
 if __name__ == '__main__':
 
     async def main():
@@ -265,7 +549,10 @@ if __name__ == '__main__':
             'tickerC': 'BTC'
         }    
         engine = CryptoEngineTriArbitrage(exchange, True)
-        await engine.run()
+        try:
+            await engine.run()
+        finally:
+            await engine.end_engine()
 
         # except Exception as err:
         #     print("Something bad happened:")
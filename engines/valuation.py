@@ -0,0 +1,131 @@
+'''
+Valuation of the currencies in a reference currency (EUR by default) derived
+from the order books the engine already holds.
+
+The mid prices of the books form a currency graph, the value of a currency is
+the product of the rates along the shortest path (in number of legs) to the
+reference currency. Only when no such path exists, the last price is requested
+to the exchange and cached: once cached, an expired value is still returned
+while a refresh runs in the background, so the hot loop never waits on it.
+'''
+
+import asyncio
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from utils.logging import crypto_arb_log
+
+
+def parse_pair(pair: str, currencies: List[str] = []) -> Optional[Tuple[str, str]]:
+    '''
+    Return the (base, quote) currencies of a ticker pair: 'ADA-ETH' gives ('ADA', 'ETH').
+    Pairs without separator, like the Kraken 'XETHXXBT', are split using the known currencies.
+    '''
+    if '-' in pair:
+        base, quote = pair.split('-', 1)
+        return base, quote
+    for base in currencies:
+        if pair.startswith(base) and pair[len(base):] in currencies:
+            return base, pair[len(base):]
+    return None
+
+
+class ValuationService(object):
+    def __init__(self, engine, quoteCurrency: str = 'EUR', ttl: float = 60):
+        self.engine = engine
+        self.quoteCurrency = quoteCurrency
+        self.ttl = ttl
+
+        self.pairs = {}
+        # Currency graph: currency -> {neighbour currency: value of 1 currency in the neighbour one}
+        self.rates = {}
+        self.paths = {}
+
+        # Values requested to the exchange: currency -> (value, time it was received)
+        self.cache = {}
+        self.refreshing = {}
+
+    def add_pair(self, pair: str, base: str, quote: str):
+        self.pairs[pair] = (base, quote)
+
+    def update_book(self, pair: str, book: Dict[str, Dict[str, float]]):
+        '''
+        Update the rates of a pair from its innermost order book
+        '''
+        if pair not in self.pairs:
+            return
+        base, quote = self.pairs[pair]
+        mid = (book['bid']['price'] + book['ask']['price']) / 2
+        if mid <= 0:
+            return
+        if quote not in self.rates.get(base, {}):
+            # New edge in the graph, the shortest paths have to be searched again
+            self.paths = {}
+        self.rates.setdefault(base, {})[quote] = mid
+        self.rates.setdefault(quote, {})[base] = 1 / mid
+
+    def _shortest_path(self, currency: str) -> Optional[List[str]]:
+        if currency not in self.paths:
+            previous = {currency: None}
+            queue = deque([currency])
+            while queue and self.quoteCurrency not in previous:
+                node = queue.popleft()
+                for neighbour in self.rates.get(node, {}):
+                    if neighbour not in previous:
+                        previous[neighbour] = node
+                        queue.append(neighbour)
+
+            path = None
+            if self.quoteCurrency in previous:
+                path = [self.quoteCurrency]
+                while path[-1] != currency:
+                    path.append(previous[path[-1]])
+                path.reverse()
+            self.paths[currency] = path
+        return self.paths[currency]
+
+    def value_from_books(self, currency: str) -> Optional[float]:
+        '''
+        Return the value of a currency derived from the order books, None when
+        the books do not link it to the reference currency
+        '''
+        if currency == self.quoteCurrency:
+            return 1.0
+        path = self._shortest_path(currency)
+        if path is None:
+            return None
+        value = 1.0
+        for src, dst in zip(path, path[1:]):
+            value *= self.rates[src][dst]
+        return value
+
+    async def _fetch(self, currency: str) -> float:
+        try:
+            res = await self.engine.get_ticker_lastPrice(currency)
+            value = list(res.values())[0]
+            self.cache[currency] = (value, time.monotonic())
+            return value
+        finally:
+            self.refreshing.pop(currency, None)
+
+    def _refresh_done(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            crypto_arb_log.error('Valuation refresh failed: {0}'.format(task.exception()))
+
+    async def get_value(self, currency: str) -> float:
+        '''
+        Return the value of a currency in the reference currency
+        '''
+        value = self.value_from_books(currency)
+        if value is not None:
+            return value
+
+        if currency not in self.cache:
+            return await self._fetch(currency)
+
+        value, received = self.cache[currency]
+        if time.monotonic() - received > self.ttl and currency not in self.refreshing:
+            task = asyncio.ensure_future(self._fetch(currency))
+            task.add_done_callback(self._refresh_done)
+            self.refreshing[currency] = task
+        return value
@@ -12,23 +12,39 @@ with open(configFile) as cfg_file:
 parser = argparse.ArgumentParser(description='Crypto Arbitrage')
 parser.add_argument('-m', '--mode', help='Arbitrage mode: triangular or exchange', required=True)
 parser.add_argument('-p', '--production', help='Production mode', action='store_true')
+parser.add_argument('-r', '--replay', help='Backtest the triangular mode on a tick recording (directory or file)')
+parser.add_argument('-s', '--sweep', help='With --replay, JSON file of the values of the triangular options to backtest')
+parser.add_argument('-w', '--workers', help='Processes running the backtests of a sweep, one per core by default', type=int)
 args = parser.parse_args()
 
 engine = None
 isMockMode = True if not args.production else False
 
-if args.mode == 'triangular':
+if args.mode == 'triangular' and args.replay and args.sweep:
+    from engines.sweep import run_sweep, format_table
+    with open(args.sweep) as grid_file:
+        grid = json.load(grid_file)
+    print(format_table(run_sweep(config['triangular'], args.replay, grid, args.workers), list(grid)))
+elif args.mode == 'triangular' and args.replay:
+    from engines.backtest import TriangularBacktest, format_report
+    engine = TriangularBacktest(config['triangular'], args.replay)
+elif args.mode == 'triangular':
     from engines.triangular_arbitrage import CryptoEngineTriArbitrage
     engine = CryptoEngineTriArbitrage(config['triangular'], isMockMode)
 elif args.mode == 'exchange':
-    # from engines.exchange_arbitrage import CryptoEngineExArbitrage
-    # engine = CryptoEngineExArbitrage(config['exchange'], isMockMode)
-    pass
+    from engines.exchange_arbitrage import CryptoEngineExArbitrage
+    engine = CryptoEngineExArbitrage(config['exchange'], isMockMode)
 else:
     crypto_arb_log.error(f"Mode {args.mode} is not recognized")
 
 async def main():
-    await engine.run()
-
-loop = asyncio.get_event_loop()
-loop.run_until_complete(main())
+    try:
+        result = await engine.run()
+        if args.replay:
+            print(format_report(result))
+    finally:
+        # Also reached on Ctrl-C, asyncio.run cancelling the main task
+        await engine.end_engine()
+
+if engine is not None:
+    asyncio.run(main())